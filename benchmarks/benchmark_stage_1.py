@@ -0,0 +1,226 @@
+"""
+Benchmarks the stage 1 field mapping, field domain, field dtype, record splitting and interim (GeoPackage or
+GeoParquet) export steps on synthetic NRN-shaped road segment datasets, driven by the New Brunswick source conform
+mappings. Results are compared against a baseline stored on the benchmark host, such that timings are comparable: a
+baseline must be stored with --save-baseline before regressions can be checked.
+
+Usage (from the repository root):
+    python benchmarks/benchmark_stage_1.py --rows 10000 --rows 100000
+    python benchmarks/benchmark_stage_1.py --save-baseline
+    python benchmarks/benchmark_stage_1.py --interim-format parquet
+"""
+
+import click
+import geopandas as gpd
+import json
+import logging
+import numpy as np
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from shapely import linestrings
+
+# Stage 1 relies on paths relative to its own directory.
+benchmark_path = os.path.dirname(os.path.abspath(__file__))
+src_path = os.path.abspath(os.path.join(benchmark_path, "../src"))
+sys.path[1:1] = [src_path, os.path.join(src_path, "stage_1")]
+os.chdir(os.path.join(src_path, "stage_1"))
+import field_map_functions
+import stage_1
+
+
+logger = logging.getLogger()
+
+# Benchmarked source and steps.
+source = "nb"
+source_name = "geonb_nbrn-rrnb_road-route"
+steps = ["apply_field_mapping", "apply_domains", "apply_dtypes", "split_record", "export_interim"]
+
+# Synthetic value pools.
+name_bodies = ["Main", "King", "Queen", "Church", "Water", "Mill", "Victoria", "Saint-Pierre", "Principale",
+               "des Érables", "du Lac", "de l'Église", "Champlain", "Gauthier", "Acadie", "Montagne", "MacDonald",
+               "Riverview", "Lakeside", "Beauséjour", "Notre-Dame", "Pine", "Maple", "Birch", "Cedar", "Smith"]
+placenames = ["Moncton", "Dieppe", "Fredericton", "Saint John", "Bathurst", "Edmundston", "Miramichi", "Shediac",
+              "Caraquet", "Grand Falls / Grand-Sault", "Sackville", "Sussex", "Oromocto", "Tracadie", "Woodstock"]
+house_numbers = ["{}", "{}A", "{}-B", "{} 1/2", "{}"]
+
+
+def gen_source_dataframe(stage, rows, seed=0):
+    """
+    Generates a synthetic source road segment dataframe with the columns used by the source conform mapping.
+    Columns mapped to a domain-constrained target field are sampled from that (bilingual) domain.
+    """
+
+    rng = np.random.default_rng(seed)
+    conform = stage.source_attributes[source_name]["conform"]
+
+    # Identify source columns and the target fields they map to.
+    columns = dict()
+    for table, maps in conform.items():
+        for field, source_field in maps.items():
+            if isinstance(source_field, dict):
+                fields = source_field["fields"]
+                for column in [fields] if isinstance(fields, str) else fields:
+                    columns.setdefault(column, (table, field))
+            elif isinstance(source_field, str) and re.fullmatch(r"[a-z0-9_]+", source_field):
+                columns.setdefault(source_field, (table, field))
+
+    # Compile bilingual street name components from the field domains.
+    def domain_values(table, field):
+        return np.array(stage.domains[table][field]["values"] or [""], dtype=object)
+
+    dirs, types, articles = (domain_values("strplaname", field) for field in ("dirprefix", "strtypre", "starticle"))
+
+    def pick(values, weights=None):
+        return rng.choice(np.asarray(values, dtype=object), rows, p=weights)
+
+    def street_names():
+        # Street type either precedes (fr) or succeeds (en) the name body, with optional article and direction.
+        prefix = rng.random(rows) < 0.4
+        names = np.where(prefix, pick(types) + " " + np.where(rng.random(rows) < 0.5, pick(articles) + " ", "") +
+                         pick(name_bodies), pick(name_bodies) + " " + pick(types))
+        names = np.where(rng.random(rows) < 0.15, names + " " + pick(dirs), names)
+        return np.where(rng.random(rows) < 0.02, None, names)
+
+    def hnums():
+        numbers = rng.integers(1, 9999, rows).astype(str).astype(object)
+        templates = pick(house_numbers, [0.7, 0.1, 0.05, 0.05, 0.1])
+        return np.array([template.format(number) for template, number in zip(templates, numbers)], dtype=object)
+
+    data = dict()
+    for column, (table, field) in columns.items():
+        if column == "streetname":
+            data[column] = street_names()
+        elif column.endswith("placenam"):
+            data[column] = pick(placenames + [None])
+        elif column.startswith(("l_hnum", "r_hnum")) and column[-1] in "fl":
+            data[column] = hnums()
+        elif table in stage.domains and stage.domains[table].get(field, {}).get("values"):
+            data[column] = pick(domain_values(table, field))
+        elif stage.target_attributes[table]["fields"].get(field) == "int":
+            data[column] = rng.integers(1, 100, rows)
+        else:
+            data[column] = np.where(rng.random(rows) < 0.9, None, pick(name_bodies))
+
+    # Randomly place segments within New Brunswick.
+    start = np.column_stack([rng.uniform(-69.0, -63.8, rows), rng.uniform(44.6, 48.0, rows)])
+    coords = np.stack([start, start + rng.normal(0, 0.002, (rows, 2))], axis=1)
+
+    gdf = gpd.GeoDataFrame(data, geometry=linestrings(coords), crs="EPSG:4617")
+    gdf["uuid"] = np.arange(rows, dtype=np.int64)
+
+    return gdf
+
+
+def run_benchmark(rows, output_dir, interim_format="gpkg"):
+    """Runs the benchmarked stage 1 steps on a synthetic dataset of the given size. Returns seconds per step."""
+
+    # Configure stage, redirecting the interim output to the benchmark output directory.
+    stage = stage_1.Stage(source, interim_format=interim_format)
+    stage.output_path = os.path.join(output_dir, "{}_{}".format(source, rows))
+    stage.fingerprints_path = "{}_fingerprints.json".format(stage.output_path)
+    if interim_format == "gpkg":
+        stage.output_path = "{}.gpkg".format(stage.output_path)
+
+    stage.compile_source_attributes()
+    stage.source_attributes = {source_name: stage.source_attributes[source_name]}
+    stage.compile_target_attributes()
+    stage.compile_domains()
+
+    # Generate synthetic source and target dataframes.
+    stage.source_gdframes = {source_name: gen_source_dataframe(stage, rows)}
+    stage.uuids = stage_1.helpers.gen_uuids(rows)
+    stage.compile_field_mapping()
+    stage.gen_target_dataframes()
+
+    results = dict()
+
+    # Record splitting, on the left / right placename candidates of an unmapped strplaname dataframe.
+    source_gdf = stage.source_gdframes[source_name]
+    target_gdf = stage.target_gdframes["strplaname"]
+    candidates = source_gdf[["l_placenam", "r_placenam"]].set_axis(target_gdf.index, axis=0)
+    start = time.perf_counter()
+    field_map_functions.split_record(target_gdf, {"placename": candidates})
+    results["split_record"] = time.perf_counter() - start
+
+    # Field mapping, field domains, field dtypes and interim export.
+    for step in ("apply_field_mapping", "apply_domains", "apply_dtypes", "export_interim"):
+        start = time.perf_counter()
+        getattr(stage, step)()
+        results[step] = time.perf_counter() - start
+
+    return results
+
+
+@click.command()
+@click.option("--rows", "-r", type=click.IntRange(min=1), multiple=True,
+              default=[10000, 100000, 1000000, 5000000], show_default=True, help="Synthetic dataset sizes.")
+@click.option("--baseline", type=click.Path(dir_okay=False),
+              default=os.path.join(benchmark_path, "baseline_stage_1.json"),
+              show_default=True, help="Baseline results file.")
+@click.option("--save-baseline", is_flag=True, default=False, help="Store the results as the new baseline.")
+@click.option("--tolerance", type=click.FloatRange(min=0), default=0.2, show_default=True,
+              help="Relative slowdown versus baseline reported as a regression.")
+@click.option("--interim-format", type=click.Choice(["gpkg", "parquet"]), default="gpkg", show_default=True,
+              help="Interim storage format of the export step.")
+def main(rows, baseline, save_baseline, tolerance, interim_format):
+    """Benchmarks stage 1 on synthetic NRN-shaped datasets and compares the results against a stored baseline."""
+
+    logger.setLevel(logging.WARNING)
+
+    # Load baseline.
+    baseline_results = dict()
+    if os.path.exists(baseline):
+        with open(baseline, "r", encoding="utf8") as f:
+            baseline_results = json.load(f)
+
+    # Validate baseline.
+    missing = [str(size) for size in rows if str(size) not in baseline_results]
+    if missing and not save_baseline:
+        logger.error("Baseline \"{}\" contains no results for {} rows. Store a baseline with --save-baseline on the "
+                     "benchmark host first.".format(baseline, ", ".join(missing)))
+        sys.exit(1)
+
+    output_dir = tempfile.mkdtemp()
+    results = dict()
+
+    try:
+        for size in rows:
+            results[str(size)] = run_benchmark(size, output_dir, interim_format)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    # Report results and identify regressions.
+    regressions = list()
+    print("{:>10} {:<20} {:>10} {:>10} {:>8}".format("rows", "step", "seconds", "baseline", "ratio"))
+
+    for size, steps_results in results.items():
+        for step in steps:
+            seconds = steps_results[step]
+            base = baseline_results.get(size, dict()).get(step)
+            ratio = seconds / base if base else None
+            if ratio is not None and ratio > 1 + tolerance:
+                regressions.append((size, step, ratio))
+
+            print("{:>10} {:<20} {:>10.3f} {:>10} {:>8}".format(
+                size, step, seconds, "-" if base is None else "{:.3f}".format(base),
+                "-" if ratio is None else "{:.2f}".format(ratio)))
+
+    # Store baseline.
+    if save_baseline:
+        baseline_results.update(results)
+        with open(baseline, "w", encoding="utf8") as f:
+            json.dump(baseline_results, f, indent=2, sort_keys=True)
+        print("Baseline stored: {}.".format(baseline))
+
+    if regressions:
+        for size, step, ratio in regressions:
+            print("Regression: {} at {} rows is {:.2f}x slower than baseline.".format(step, size, ratio))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
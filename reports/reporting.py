@@ -2,8 +2,27 @@
 
 import geopandas as gpd
 import pandas as pd
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
 
+# Vectorized date normalization shared with the pipeline stages. The shared modules (src) are importable by the
+# notebooks once reporting is imported.
+sys.path.insert(1, str(Path(__file__).resolve().parent.parent / 'src'))
+from dates import normalize_dates
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+PROVINCES = ['QC','MB','ON','NT','NS','BC','YT','NB','SK','NL','PE','NU','AB']
+
+# Name of the columnar cache directory, created within the data directory.
+CACHE_DIRNAME = '.reporting_cache'
+
 def prov_data_paths(data_dir: Path) -> dict:
     """Build a dictionary to map a province to it's GeoPackage file."""
 
@@ -18,35 +37,108 @@ def prov_data_paths(data_dir: Path) -> dict:
         paths[prcode] = {'path': item, 'major': major, 'minor': minor}
     return paths
 
-def load_roadseg_by_prcode(data_dir: Path, prcode: str) -> gpd.GeoDataFrame:
-    """Load the roadseg layer within a GeoPackage into a GeoDataFrame."""
+def layer_columns(gpkg_path: Path, layername: str) -> dict:
+    """Map the lowercase attribute column names of a GeoPackage layer to their names in the layer."""
 
-    prov_info = prov_data_paths(data_dir)
-    major_version = prov_info[prcode]['major']
-    minor_version = prov_info[prcode]['minor']
-    gpkg_path = prov_info[prcode]['path']
+    with closing(sqlite3.connect(gpkg_path)) as con:
+        geometry = {name for name, in con.execute(
+            "select column_name from gpkg_geometry_columns where table_name = ?", (layername,))}
+        names = [row[1] for row in con.execute(f'pragma table_info("{layername}")')]
 
-    layername = f"NRN_{prcode}_{major_version}_{minor_version}_ROADSEG"
-    df = (gpd.read_file(gpkg_path, layer=layername)
+    return {name.lower(): name for name in names if name not in geometry and name.lower() != 'fid'}
+
+def read_layer(gpkg_path: Path, layername: str, columns: list, geometry: bool = True) -> pd.DataFrame:
+    """
+    Read the given attribute columns (lowercase names) of a GeoPackage layer, with or without geometry.
+    Only the requested columns are read from the file, where supported by the I/O engine.
+    """
+
+    available = layer_columns(gpkg_path, layername)
+    df = (gpd.read_file(gpkg_path, layer=layername, columns=[available[column] for column in columns],
+                        ignore_geometry=not geometry)
           .rename(columns=str.lower))
 
-    return df
+    return df[columns + ['geometry']] if geometry else pd.DataFrame(df[columns])
+
+def read_cached_layer(gpkg_path: Path, layername: str, columns: list, geometry: bool,
+                      cache_dir: Path) -> pd.DataFrame:
+    """
+    Read columns of a GeoPackage layer through a local GeoParquet cache keyed by the GeoPackage modification time.
+    Columns missing from the cache are read from the GeoPackage and added to it, so the cache accumulates the columns
+    used across reports and is replaced whenever the GeoPackage changes.
+    """
+
+    cache_file = cache_dir / f'{layername}_{gpkg_path.stat().st_mtime_ns}.parquet'
+    cached, cached_geometry = [], False
+
+    if cache_file.exists():
+        schema = pq.read_schema(cache_file)
+        cached_geometry = schema.metadata is not None and b'geo' in schema.metadata
+        cached = [name for name in schema.names if name != 'geometry']
+
+    # Extend the cache with the missing columns, dropping caches of earlier versions of the GeoPackage.
+    if not set(columns).issubset(cached) or (geometry and not cached_geometry):
+        available = layer_columns(gpkg_path, layername)
+        cached = [column for column in available if column in columns or column in cached]
+        cached_geometry = geometry or cached_geometry
+        df = read_layer(gpkg_path, layername, cached, geometry=cached_geometry)
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for stale in cache_dir.glob(f'{layername}_*.parquet'):
+            stale.unlink()
+        partial = cache_file.with_suffix('.tmp')
+        df.to_parquet(partial, index=False)
+        partial.replace(cache_file)
 
-def load_all_roadseg(data_dir: Path) -> gpd.GeoDataFrame:
-    """Load all provinces roadseg layers into a single GeoDataFrame."""
+    if geometry:
+        return gpd.read_parquet(cache_file, columns=columns + ['geometry'], memory_map=True)
+
+    return pd.read_parquet(cache_file, columns=columns, memory_map=True)
+
+def load_roadseg_by_prcode(data_dir: Path, prcode: str, columns: list = None, geometry: bool = True,
+                           cache: bool = True, paths: dict = None) -> gpd.GeoDataFrame:
+    """
+    Load the roadseg layer within a GeoPackage into a GeoDataFrame.
+
+    columns restricts the attributes read (lowercase names, missing columns are ignored) and geometry=False skips the
+    geometry, returning a DataFrame. With cache=True (and pyarrow installed), the columns are read through a local
+    columnar cache within the data directory. paths is the result of prov_data_paths, to avoid rescanning the data
+    directory.
+    """
+
+    prov_info = (paths or prov_data_paths(data_dir))[prcode]
+    major_version = prov_info['major']
+    minor_version = prov_info['minor']
+    gpkg_path = prov_info['path']
+
+    layername = f"NRN_{prcode}_{major_version}_{minor_version}_ROADSEG"
+    available = layer_columns(gpkg_path, layername)
+    columns = list(available) if columns is None else [column for column in columns if column in available]
+
+    if cache and pq is not None:
+        return read_cached_layer(gpkg_path, layername, columns, geometry, data_dir / CACHE_DIRNAME)
+
+    return read_layer(gpkg_path, layername, columns, geometry=geometry)
+
+def load_all_roadseg(data_dir: Path, columns: list = None, geometry: bool = True, cache: bool = True,
+                     max_workers: int = None) -> gpd.GeoDataFrame:
+    """
+    Load all provinces roadseg layers into a single GeoDataFrame.
+
+    The data directory is scanned once and the available provinces are read concurrently. See load_roadseg_by_prcode
+    for the columns, geometry and cache options; for example, date reports only need
+    load_all_roadseg(data_dir, columns=['datasetnam', 'credate', 'revdate'], geometry=False).
+    """
+
+    paths = prov_data_paths(data_dir)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        roadsegs = list(executor.map(
+            lambda pr: load_roadseg_by_prcode(data_dir, pr, columns=columns, geometry=geometry, cache=cache,
+                                              paths=paths), [pr for pr in PROVINCES if pr in paths]))
 
-    provs = ['QC','MB','ON','NT','NS','BC','YT','NB','SK','NL','PE','NU','AB']
-    roadsegs = []
-    for pr in provs:
-        df = load_roadseg_by_prcode(data_dir, pr)
-        roadsegs.append(df)
-    
     return pd.concat(roadsegs)
 
-def date_normalize(value):
-    ret_val = value
-    if len(value) == 6:
-        ret_val = f"{value}01"
-    if len(value) == 4:
-        ret_val = f"{value}0101"
-    return ret_val
\ No newline at end of file
+def date_normalize(values: pd.Series) -> pd.Series:
+    """Normalize YYYY / YYYYMM / YYYYMMDD dates to YYYYMMDD, padding the missing month and day with 01."""
+
+    return normalize_dates(values)
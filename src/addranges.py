@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+
+import helpers
+
+
+# Validation flags of validate_addranges, in report order.
+addrange_flags = ["l_parity", "r_parity", "l_order", "r_order", "l_overlap", "r_overlap"]
+
+# Structure type (hnumstr) and digitizing direction (digdirfg) domain codes.
+structure_codes = {"even": 1, "odd": 2, "mixed": 3, "irregular": 4}
+direction_codes = {"same": 1, "opposite": 2, "not_applicable": 3}
+
+
+def domain_array(series, table, field):
+    """Returns the field domain codes of a series of domain values or codes as an int array, 0 for unknown values."""
+
+    codes, uniques = pd.factorize(pd.Series(series).astype(object))
+    domain = helpers.domain_codes(table, field)
+    uniques = pd.Series(uniques.astype(str)).str.strip().str.lower().map(domain).fillna(0).astype(int)
+
+    return np.append(uniques.to_numpy(), 0)[codes]
+
+
+def find_overlaps(keys, lanes, low, high, records):
+    """
+    Finds overlapping house number ranges via a sort-and-sweep: ranges are sorted by key (street and place), lane
+    (parity) and first number. A range overlaps a range of another record if the running maximum last number of the
+    preceding ranges of other records reaches its first number, or if the following range of another record starts
+    within it. The running maximum of other records is the running maximum of the group, unless the range's own record
+    holds it, in which case the running maximum excluding the holding record is used. The cost is that of the sort.
+    Returns the (n, 2) array of overlapping range positions, each overlapping range once (first) with a range of another
+    record it overlaps (second).
+    """
+
+    order = np.lexsort((high, low, lanes, keys))
+    keys, lanes, low, high, records = keys[order], lanes[order], low[order], high[order], records[order]
+
+    # Group ranges by key and lane.
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = (keys[1:] != keys[:-1]) | (lanes[1:] != lanes[:-1])
+    groups = np.cumsum(starts)
+
+    # Track the running maximum last number of each group and the range holding it.
+    maximum, holders = running_maximum(high, groups)
+    holder_records = records[holders]
+
+    # Track the running maximum excluding the record holding the group maximum, per period of a single holding record.
+    # A period starts when a range of another record takes over the maximum, such that the excluded maximum starts at
+    # the preceding group maximum.
+    periods = starts.copy()
+    periods[1:] |= holder_records[1:] != holder_records[:-1]
+    period_starts = np.flatnonzero(periods)
+    inherited = ~starts[period_starts]
+    base, base_holders = np.full(len(period_starts), -np.inf), np.full(len(period_starts), -1)
+    base[inherited], base_holders[inherited] = maximum[period_starts[inherited] - 1], \
+        holders[period_starts[inherited] - 1]
+    periods = np.cumsum(periods) - 1
+    excluded, excluded_holders = running_maximum(np.where(records != holder_records, high, -np.inf), periods)
+    replaced = excluded < base[periods]
+    excluded = np.where(replaced, base[periods], excluded)
+    excluded_holders = np.where(replaced, base_holders[periods], excluded_holders)
+
+    # Compare each range to the running maximum of the preceding ranges of other records.
+    previous = np.flatnonzero(~starts)
+    own = holder_records[previous - 1] == records[previous]
+    bound = np.where(own, excluded[previous - 1], maximum[previous - 1])
+    related = np.full(len(order), -1)
+    overlap = low[previous] <= bound
+    related[previous[overlap]] = np.where(own, excluded_holders[previous - 1], holders[previous - 1])[overlap]
+
+    # Compare each remaining range to the following range of another record: the range following its run of
+    # consecutive ranges of its record.
+    runs = starts.copy()
+    runs[1:] |= records[1:] != records[:-1]
+    following = np.append(np.flatnonzero(runs)[1:], len(order))[np.cumsum(runs) - 1]
+    candidates = np.flatnonzero((related < 0) & (following < len(order)))
+    following = following[candidates]
+    overlap = (groups[following] == groups[candidates]) & (low[following] <= high[candidates])
+    related[candidates[overlap]] = following[overlap]
+
+    overlapping = np.flatnonzero(related >= 0)
+
+    return np.column_stack([order[overlapping], order[related[overlapping]]]).reshape(-1, 2)
+
+
+def running_maximum(values, groups):
+    """
+    Returns the running maximum of values within consecutive groups and the position of the value holding it (latest
+    among equal values), -1 while no value exceeds -inf.
+    """
+
+    maximum = pd.Series(values).groupby(groups).cummax().to_numpy()
+    holders = np.where((values == maximum) & (values > -np.inf), np.arange(len(values)), np.nan)
+    holders = pd.Series(holders).groupby(groups).ffill().fillna(-1).to_numpy(dtype=np.int64)
+
+    return maximum, holders
+
+
+def summarize_addranges(validated, groups):
+    """
+    Summarizes the output of validate_addranges by group (e.g. datasetnam or province): the number of records, the count
+    of each validation flag and the number of records with any flag.
+    """
+
+    df = validated[addrange_flags].assign(flagged=validated[addrange_flags].any(axis=1), records=1)
+
+    return (df.groupby(np.asarray(groups), observed=True)[["records"] + addrange_flags + ["flagged"]].sum()
+            .rename_axis(getattr(groups, "name", None)))
+
+
+def validate_addranges(addrange):
+    """
+    Validates the house number ranges of an addrange dataframe in a single columnar pass per check. Returns a dataframe
+    of the validation flags per side (l / r) and the nid of a record overlapping each side:
+    {side}_parity: the first or last house number does not match an even or odd structure type ({side}_hnumstr).
+    {side}_order: the first house number exceeds the last house number, or the reverse if the range is digitized
+    opposite to the addressing direction ({side}_digdirfg).
+    {side}_overlap: the range shares house numbers with the range of another record on the same street and place
+    ({side}_offnanid, either side). Even and odd ranges only overlap ranges of the same parity, mixed, irregular or
+    unknown structure types.
+    Ranges without a first and last house number (null or 0) are not validated.
+    """
+
+    nids = addrange["nid"].to_numpy(dtype=object) if "nid" in addrange.columns else np.arange(len(addrange))
+    validated = pd.DataFrame(index=addrange.index)
+    ranges = {name: list() for name in ("record", "side", "key", "lane", "low", "high")}
+
+    for side in ("l", "r"):
+        first = pd.to_numeric(addrange["{}_hnumf".format(side)], errors="coerce").to_numpy(dtype=float)
+        last = pd.to_numeric(addrange["{}_hnuml".format(side)], errors="coerce").to_numpy(dtype=float)
+        structure = domain_array(addrange["{}_hnumstr".format(side)], "addrange", "{}_hnumstr".format(side))
+        direction = domain_array(addrange["{}_digdirfg".format(side)], "addrange", "{}_digdirfg".format(side))
+        addressed = (first > 0) & (last > 0)
+
+        # Parity.
+        parity = np.select([structure == structure_codes["even"], structure == structure_codes["odd"]], [0, 1], -1)
+        validated["{}_parity".format(side)] = addressed & (parity >= 0) & ((first % 2 != parity) | (last % 2 != parity))
+
+        # Order.
+        validated["{}_order".format(side)] = addressed & np.where(direction == direction_codes["opposite"],
+                                                                  first < last, first > last)
+
+        # Compile ranges: even and odd structure types in their parity lane, other structure types in both lanes.
+        keys = addrange["{}_offnanid".format(side)].to_numpy(dtype=object)
+        records = np.flatnonzero(addressed & pd.notna(keys))
+        for lane in (0, 1):
+            lane_records = records[np.isin(parity[records], (lane, -1))]
+            for name, values in (("record", lane_records), ("side", np.full(len(lane_records), side == "r")),
+                                 ("key", keys[lane_records]), ("lane", np.full(len(lane_records), lane)),
+                                 ("low", np.fmin(first, last)[lane_records]),
+                                 ("high", np.fmax(first, last)[lane_records])):
+                ranges[name].append(values)
+
+    # Find overlapping ranges, relating each to a record it overlaps.
+    ranges = {name: np.concatenate(values) for name, values in ranges.items()}
+    pairs = find_overlaps(pd.factorize(ranges["key"])[0], ranges["lane"], ranges["low"], ranges["high"],
+                          ranges["record"])
+    related = np.full(len(ranges["record"]), len(addrange))
+    related[pairs[:, 0]] = ranges["record"][pairs[:, 1]]
+
+    for code, side in enumerate(("l", "r")):
+        overlapping = np.flatnonzero((ranges["side"] == code) & (related < len(addrange)))
+        records = np.full(len(addrange), len(addrange))
+        np.minimum.at(records, ranges["record"][overlapping], related[overlapping])
+        validated["{}_overlap".format(side)] = records < len(addrange)
+        validated["{}_overlap_nid".format(side)] = np.append(nids, None)[records]
+
+    return validated[addrange_flags + ["l_overlap_nid", "r_overlap_nid"]]
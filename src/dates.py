@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+
+# Validation flags of validate_dates, in report order.
+date_flags = ["invalid_credate", "invalid_revdate", "future_credate", "future_revdate", "revdate_before_credate"]
+
+
+def factorize_dates(dates):
+    """
+    Factorizes a series of NRN dates (YYYY, YYYYMM or YYYYMMDD). Returns the codes (-1 for nulls) and a series of the
+    distinct values normalized to YYYYMMDD strings, padding missing months and days with 01. Numeric values are read
+    as their integer digits. Values of other lengths are only stripped.
+    """
+
+    codes, uniques = pd.factorize(pd.Series(dates))
+
+    uniques = pd.Series(np.asarray(uniques, dtype=object)).astype(str).str.strip().str.replace(r"\.0+$", "", regex=True)
+    lengths = uniques.str.len()
+
+    return codes, uniques.mask(lengths == 4, uniques + "0101").mask(lengths == 6, uniques + "01")
+
+
+def normalize_dates(dates):
+    """Returns a series of NRN dates normalized to YYYYMMDD strings. See factorize_dates."""
+
+    codes, uniques = factorize_dates(dates)
+
+    return pd.Series(np.append(uniques.to_numpy(dtype=object), None)[codes], index=getattr(dates, "index", None))
+
+
+def parse_dates(dates):
+    """
+    Returns a datetime64 series of NRN dates (see factorize_dates). Nulls and values which are not real calendar dates
+    are NaT. Each distinct value is parsed once.
+    """
+
+    codes, uniques = factorize_dates(dates)
+
+    return pd.Series(parse_normalized_dates(uniques)[codes], index=getattr(dates, "index", None))
+
+
+def parse_normalized_dates(uniques):
+    """
+    Parses a series of YYYYMMDD strings, as returned by factorize_dates, into a datetime64 array followed by a NaT, such
+    that it may be indexed by the factorized codes. Values which are not real calendar dates are NaT.
+    """
+
+    parsed = pd.to_datetime(uniques.where(uniques.str.fullmatch(r"\d{8}")), format="%Y%m%d", errors="coerce")
+
+    return np.append(parsed.to_numpy(dtype="datetime64[ns]"), np.datetime64("NaT", "ns"))
+
+
+def summarize_dates(validated, groups):
+    """
+    Summarizes the output of validate_dates by group (e.g. datasetnam or province): the number of records, the minimum
+    and maximum created and revised dates, the minimum and maximum revision interval (days) and the count of each
+    validation flag.
+    """
+
+    df = validated.assign(interval=(validated["revised"] - validated["created"]).dt.days,
+                          group=np.asarray(groups))
+
+    aggregations = {"records": ("created", "size"), "created_min": ("created", "min"),
+                    "created_max": ("created", "max"), "revised_min": ("revised", "min"),
+                    "revised_max": ("revised", "max"), "interval_min": ("interval", "min"),
+                    "interval_max": ("interval", "max")}
+    aggregations.update({flag: (flag, "sum") for flag in date_flags})
+
+    return df.groupby("group", observed=True).agg(**aggregations).rename_axis(getattr(groups, "name", None))
+
+
+def validate_dates(credate, revdate, today=None):
+    """
+    Validates NRN credate and revdate series in a single columnar pass. Returns a dataframe of the parsed dates
+    (created, revised) and the validation flags:
+    invalid_credate / invalid_revdate: non-missing values which are not real calendar dates.
+    future_credate / future_revdate: dates after today.
+    revdate_before_credate: revision dates preceding the creation date.
+    """
+
+    today = np.datetime64(pd.Timestamp.today().normalize() if today is None else pd.Timestamp(today), "ns")
+    parsed, invalid = dict(), dict()
+
+    # Parse and identify invalid dates per distinct value, excluding nulls and empty values.
+    for field, dates in (("credate", credate), ("revdate", revdate)):
+        codes, uniques = factorize_dates(dates)
+        values = parse_normalized_dates(uniques)
+        parsed[field] = values[codes]
+        invalid[field] = (np.isnat(values) & np.append(uniques.ne("").to_numpy(), False))[codes]
+
+    return pd.DataFrame({
+        "created": parsed["credate"],
+        "revised": parsed["revdate"],
+        "invalid_credate": invalid["credate"],
+        "invalid_revdate": invalid["revdate"],
+        "future_credate": parsed["credate"] > today,
+        "future_revdate": parsed["revdate"] > today,
+        "revdate_before_credate": parsed["revdate"] < parsed["credate"]
+    }, index=getattr(credate, "index", None))
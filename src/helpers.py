@@ -1,60 +1,735 @@
-import copy
-import fiona
+import binascii
+import csv
 import geopandas as gpd
+import hashlib
+import json
 import logging
+import numpy as np
 import os
+import pandas as pd
+import pickle
+import shapely
+import shutil
 import sqlite3
 import sys
+import time
 import yaml
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, suppress
+from functools import lru_cache
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 logger = logging.getLogger()
 
 
-def export_gpkg(dataframes, gpkg_path):
-    """Receives a dictionary of pandas dataframes and exports them as geopackage layers."""
+class RunProfiler:
+    """Records wall time, rows processed, rows per second and peak RSS growth of pipeline steps."""
+
+    fields = ["step", "table", "field", "function", "rows", "seconds", "rows_per_second", "peak_rss_delta_mb"]
+
+    def __init__(self):
+        self.records = list()
+
+    @contextmanager
+    def record(self, step, table=None, field=None, function=None, rows=None):
+        """
+        Context manager which records a single step. Records are stored in start order.
+        The yielded record may be updated within the context, e.g. to set the number of rows once known.
+        """
+
+        record = {"step": step, "table": table, "field": field, "function": function, "rows": rows}
+        self.records.append(record)
+        rss = peak_rss_mb()
+        start = time.perf_counter()
+
+        try:
+            yield record
+
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            record["rows_per_second"] = round(record["rows"] / record["seconds"], 1) \
+                if record["rows"] and record["seconds"] else None
+            record["peak_rss_delta_mb"] = None if rss is None else round(peak_rss_mb() - rss, 3)
+
+    def export(self, path):
+        """Exports the recorded steps as {path}.json and {path}.csv."""
+
+        logger.info("Writing run profile report: {}.json, {}.csv.".format(path, path))
+
+        with open("{}.json".format(path), "w", encoding="utf8") as f:
+            json.dump(self.records, f, indent=2)
+
+        with open("{}.csv".format(path), "w", encoding="utf8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+
+# Compiled configuration cache directory, overridden by the NRN_CONFIG_CACHE environment variable.
+config_cache_path = os.environ.get("NRN_CONFIG_CACHE",
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/interim/cache"))
+
+# Interim storage directory.
+interim_data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/interim")
+
+# GeoPackage SQL field types by schema field type.
+gpkg_field_types = {"bool": "BOOLEAN", "date": "DATE", "datetime": "DATETIME", "float": "REAL", "int": "INTEGER",
+                    "str": "TEXT"}
+
+# GeoPackage bulk load settings: rows per insert batch and connection pragmas. The write-ahead log keeps an existing
+# GeoPackage intact if a write fails, and is reverted to a rollback journal before the connection is closed.
+gpkg_batch_size = 100000
+gpkg_pragmas = {"journal_mode": "WAL", "synchronous": "NORMAL", "temp_store": "MEMORY", "cache_size": -262144}
+gpkg_page_size = 65536
+
+# GeoPackage rtree spatial index maintenance triggers (GeoPackage 1.2, extension F.3), by trigger name suffix.
+gpkg_rtree_triggers = {
+    "insert": """AFTER INSERT ON "{t}" WHEN (new."{c}" NOT NULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"),
+        ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END;""",
+    "update1": """AFTER UPDATE OF "{c}" ON "{t}" WHEN OLD."{i}" = NEW."{i}" AND
+        (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"),
+        ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END;""",
+    "update2": """AFTER UPDATE OF "{c}" ON "{t}" WHEN OLD."{i}" = NEW."{i}" AND
+        (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+        BEGIN DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}"; END;""",
+    "update3": """AFTER UPDATE ON "{t}" WHEN OLD."{i}" != NEW."{i}" AND
+        (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}"; INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES
+        (NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")); END;""",
+    "update4": """AFTER UPDATE ON "{t}" WHEN OLD."{i}" != NEW."{i}" AND
+        (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+        BEGIN DELETE FROM "rtree_{t}_{c}" WHERE id IN (OLD."{i}", NEW."{i}"); END;""",
+    "delete": """AFTER DELETE ON "{t}" WHEN old."{c}" NOT NULL
+        BEGIN DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}"; END;"""
+}
+
+
+def cluster_labels(count, pairs):
+    """
+    Labels the connected components of count items linked by an (n, 2) array of item index pairs, via vectorized
+    union-find (hooking and pointer jumping). Returns the lowest item index of each item's component.
+    """
+
+    labels = np.arange(count)
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+
+    while len(pairs):
+
+        # Identify pairs not yet within the same component.
+        left, right = labels[pairs[:, 0]], labels[pairs[:, 1]]
+        unmerged = left != right
+        if not unmerged.any():
+            break
+        pairs, left, right = pairs[unmerged], left[unmerged], right[unmerged]
+
+        # Hook the higher root onto the lower root.
+        np.minimum.at(labels, np.maximum(left, right), np.minimum(left, right))
+
+        # Compress paths to roots.
+        while True:
+            parents = labels[labels]
+            if np.array_equal(parents, labels):
+                break
+            labels = parents
+
+    return labels
+
+
+def config_fingerprint(paths):
+    """Returns a sha256 hex digest of the names and contents of the given files. Files are read in 1 MB blocks."""
+
+    digest = hashlib.sha256()
+
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf8"))
+        file_digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                file_digest.update(block)
+        digest.update(file_digest.digest())
+
+    return digest.hexdigest()
+
+
+@lru_cache()
+def domain_codes(table, field):
+    """
+    Returns the field domain codes of a table field by lowercase domain value (English and French) and by code string,
+    from the field domain yamls. Reference domains ("field" or "table;field") are resolved. Fields without a coded
+    domain return an empty dictionary.
+    """
+
+    codes = dict()
+
+    for language in ("en", "fr"):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "field_domains_{}.yaml".format(language))
+        domains_yaml = load_yaml(path) or dict()
+        domain = (domains_yaml.get(table) or dict()).get(field)
+
+        # Resolve reference domains.
+        while isinstance(domain, str):
+            table_ref, field_ref = domain.split(";") if domain.find(";") > 0 else (table, domain)
+            domain = (domains_yaml.get(table_ref) or dict()).get(field_ref)
+
+        if isinstance(domain, dict):
+            codes.update({str(value).lower(): int(code) for code, value in domain.items()})
+            codes.update({str(code): int(code) for code in domain})
+
+    return codes
+
+
+def endpoints(geoms):
+    """
+    Returns the first and last coordinates of each (multi)linestring of a geometry array as two (n, 2) arrays. Missing
+    or empty geometries produce nan coordinates.
+    """
+
+    geoms = np.asarray(geoms)
+    first, last = np.full((len(geoms), 2), np.nan), np.full((len(geoms), 2), np.nan)
+
+    # Flatten coordinates and identify the first and last coordinate of each geometry.
+    coords, index = shapely.get_coordinates(geoms, return_index=True)
+    if len(index):
+        indexes, starts = np.unique(index, return_index=True)
+        ends = np.append(starts[1:], len(index)) - 1
+        first[indexes], last[indexes] = coords[starts], coords[ends]
+
+    return first, last
+
+
+def export_gpkg(dataframes, gpkg_path, schemas=None, append=False):
+    """
+    Receives a dictionary of pandas dataframes and exports them as geopackage layers.
+    Optional schemas ({layer: {field: field type}}) override the inferred attribute field types.
+    If append is True, records are appended to existing layers instead of replacing them.
+
+    All layers are bulk loaded through a single sqlite connection and transaction: attributes and GeoPackage binary
+    (WKB) geometries are inserted in batches, and spatial indexes are built once all records are loaded.
+    """
 
     # Create gpkg from template if it doesn't already exist.
-    if not os.path.exists(gpkg_path):
-        copy(os.path.abspath("../data/empty.gpkg"), gpkg_path)
+    new_gpkg = not os.path.exists(gpkg_path)
+    if new_gpkg:
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../data/empty.gpkg"), gpkg_path)
 
     # Export target dataframes to GeoPackage layers.
+    con = None
     try:
+
+        # Create sqlite connection and configure bulk load pragmas.
+        con = sqlite3.connect(gpkg_path, isolation_level=None)
+        if new_gpkg:
+            con.execute("pragma page_size = {};".format(gpkg_page_size))
+            con.execute("vacuum;")
+        for pragma, value in gpkg_pragmas.items():
+            con.execute("pragma {} = {};".format(pragma, value))
+
+        con.execute("begin;")
+        spatial_indexes = dict()
+
         for name, gdf in dataframes.items():
 
             logger.info("Writing to GeoPackage {}, layer={}.".format(gpkg_path, name))
 
+            exists = append and con.execute("select 1 from gpkg_contents where table_name = ?;", (name,)).fetchone()
+            if not append:
+                gpkg_drop_layer(con, name)
+
+            # Configure attribute fields.
+            spatial = isinstance(gdf, gpd.GeoDataFrame)
+            fields = [field for field in gdf.columns if not (spatial and field == gdf.geometry.name)]
+            field_types = schemas[name] if schemas is not None and name in schemas else dict()
+            field_types = {field: gpkg_field_types.get(field_types.get(field), gpkg_sql_type(gdf[field]))
+                           for field in fields}
+            columns = ["fid integer primary key autoincrement not null"]
+            columns += ["\"{}\" {}".format(field, field_type) for field, field_type in field_types.items()]
+
             # Spatial data.
-            if "geometry" in dir(gdf):
-                # Open GeoPackage.
-                with fiona.open(gpkg_path, "w", layer=name, driver="GPKG", crs=gdf.crs,
-                                schema=gpd.io.file.infer_schema(gdf)) as gpkg:
+            if spatial:
+                geoms = np.asarray(gdf.geometry.values)
+                srs_id = gpkg_srs_id(con, gdf.crs)
+
+                # Defer spatial index maintenance until all records are loaded.
+                gpkg_drop_rtree_triggers(con, name)
+
+                # Create layer.
+                if not exists:
+                    geom_type = gpkg_geometry_type(geoms)
+                    con.execute("create table \"{}\" ({});".format(
+                        name, ", ".join(columns[:1] + ["geom {}".format(geom_type)] + columns[1:])))
+                    con.execute("insert into gpkg_contents (table_name, data_type, identifier, srs_id) values "
+                                "(?, 'features', ?, ?);", (name, name, srs_id))
+                    con.execute("insert into gpkg_geometry_columns values (?, 'geom', ?, ?, ?, 0);",
+                                (name, geom_type, srs_id, int(shapely.has_z(geoms).any())))
 
-                    # Write to GeoPackage.
-                    gpkg.writerecords(gdf.iterfeatures())
+                # Write to GeoPackage, retrieving the fids assigned to the inserted records.
+                seq = con.execute("select seq from sqlite_sequence where name = ?;", (name,)).fetchone()
+                seq = seq[0] if seq else 0
+                gpkg_insert(con, name, ["geom"] + fields,
+                            pd.concat([pd.Series(gpkg_geometry_blobs(geoms, srs_id), index=gdf.index, name="geom"),
+                                       gdf[fields]], axis=1))
+
+                # Update layer extent.
+                gpkg_update_extent(con, name, geoms)
+                spatial_indexes[name] = (np.arange(seq + 1, seq + 1 + len(gdf)), geoms)
 
             # Tabular data.
             else:
-                # Create sqlite connection.
-                con = sqlite3.connect(gpkg_path)
+
+                # Create layer.
+                if not exists:
+                    con.execute("create table \"{}\" ({});".format(name, ", ".join(columns)))
+                    con.execute("insert into gpkg_contents (table_name, data_type, identifier) values "
+                                "(?, 'attributes', ?);", (name, name))
 
                 # Write to GeoPackage.
-                gdf.to_sql(name, con)
+                gpkg_insert(con, name, fields, gdf[fields])
 
-                # Insert record into gpkg_contents metadata table.
-                con.cursor().execute("insert into 'gpkg_contents' ('table_name', 'data_type') values "
-                                     "('{}', 'attributes');".format(name))
+            logger.info("Successfully exported layer.")
 
-                # Commit and close db connection.
-                con.commit()
-                con.close()
+        # Create or update spatial indexes once all records are loaded.
+        for name, (fids, geoms) in spatial_indexes.items():
+            logger.info("Creating spatial index for GeoPackage layer={}.".format(name))
+            gpkg_spatial_index(con, name, fids, geoms)
 
-            logger.info("Successfully exported layer.")
+        # Commit.
+        con.execute("commit;")
+
+    except (sqlite3.Error, ValueError):
+        logger.exception("Error raised when writing GeoPackage layer.")
+        sys.exit(1)
+
+    finally:
+
+        # Roll back any uncommitted records, revert to a rollback journal (checkpointing the write-ahead log) and close
+        # db connection.
+        if con is not None:
+            with suppress(sqlite3.Error):
+                if con.in_transaction:
+                    con.execute("rollback;")
+                con.execute("pragma journal_mode = DELETE;")
+            con.close()
+
+
+def export_interim(dataframes, path, schemas=None, append=False):
+    """
+    Exports dataframes to interim storage: GeoPackage layers if the path is a .gpkg file, otherwise GeoParquet datasets
+    within the path directory. See export_gpkg and export_parquet.
+    """
+
+    if path.endswith(".gpkg"):
+        export_gpkg(dataframes, path, schemas=schemas, append=append)
+    else:
+        export_parquet(dataframes, path, schemas=schemas, append=append)
+
+
+def export_parquet(dataframes, path, schemas=None, append=False):
+    """
+    Exports dataframes as GeoParquet datasets, one {path}/{table} directory of part files per dataframe. Geometries are
+    stored as WKB. Appending adds a part file to the existing dataset, otherwise the dataset is replaced.
+    Optional schemas ({table: {field: field type}}) cast fields to the given types, such that all parts share the
+    distribution format schema.
+    """
+
+    if pq is None:
+        logger.error("pyarrow is required to export GeoParquet interim data.")
+        sys.exit(1)
+
+    for name, df in dataframes.items():
+        logger.info("Writing to GeoParquet {}, table={}.".format(path, name))
+        table_path = os.path.join(path, name)
+
+        try:
+
+            # Replace or extend dataset.
+            if not append:
+                shutil.rmtree(table_path, ignore_errors=True)
+            os.makedirs(table_path, exist_ok=True)
+            part = len([f for f in os.listdir(table_path) if f.endswith(".parquet")])
+
+            # Cast fields to schema types.
+            if schemas is not None and name in schemas:
+                df = parquet_cast(df, schemas[name])
+
+            # Write part, via a temporary file such that readers never see a partial part.
+            part_path = os.path.join(table_path, "part-{:05d}.parquet".format(part))
+            df.to_parquet("{}.tmp".format(part_path), index=False)
+            os.replace("{}.tmp".format(part_path), part_path)
+
+        except (OSError, ValueError):
+            logger.exception("Unable to export GeoParquet table: {}.".format(name))
+            sys.exit(1)
+
+        logger.info("Successfully exported table.")
+
+
+def gen_nodes(points, tolerance=0, tile_size=None, workers=1):
+    """
+    Groups an (n, 2) coordinate array into nodes, such that coordinates within the tolerance of each other share a node.
+    Every distinct coordinate is queried against all others via a bulk STRtree query, and coordinates are merged into
+    nodes as the connected components of the pairs within the tolerance. If a tile size is given, the STRtree queries
+    are run per tile (extended by the tolerance) across a process pool of the given number of workers. Coordinates are
+    assigned to their own and neighbouring tiles in a single vectorized pass and grouped by tile with one sort.
+    Returns the node index of each coordinate and the (node count, 2) node coordinates (lowest member coordinate).
+    """
+
+    points = np.asarray(points, dtype=float)
+
+    # Group identical coordinates.
+    _, firsts, distinct = np.unique(points, axis=0, return_index=True, return_inverse=True)
+    distinct = distinct.ravel()
+    coords = points[firsts]
+
+    if not tolerance or not len(points):
+        return distinct, coords
+
+    # Compile distinct coordinate pairs within tolerance.
+    if tile_size:
+        tiles = np.floor(coords / tile_size).astype(np.int64)
+        low, width = tiles.min(axis=0), tiles.max(axis=0) - tiles.min(axis=0) + 1
+        tile_keys = np.unique((tiles[:, 0] - low[0]) * width[1] + (tiles[:, 1] - low[1]))
+
+        # Compile the candidate tiles of each coordinate: its own tile and the neighbouring tiles within the tolerance.
+        # Candidates span one extra tile on each side, such that rounding cannot exclude a tile.
+        first = np.floor((coords - tolerance) / tile_size).astype(np.int64) - 1
+        spans = np.floor((coords + tolerance) / tile_size).astype(np.int64) + 2 - first
+        counts = spans[:, 0] * spans[:, 1]
+        indexes = np.repeat(np.arange(len(coords)), counts)
+        offsets = np.arange(len(indexes)) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates = first[indexes] + np.column_stack([offsets // spans[indexes, 1], offsets % spans[indexes, 1]])
+
+        # Keep the candidate tiles whose extent, extended by the tolerance, contains the coordinate and which contain
+        # a coordinate of their own.
+        within = ((coords[indexes] >= candidates * tile_size - tolerance) &
+                  (coords[indexes] <= (candidates + 1) * tile_size + tolerance)).all(axis=1)
+        indexes, candidates = indexes[within], candidates[within]
+        keys = (candidates[:, 0] - low[0]) * width[1] + (candidates[:, 1] - low[1])
+        positions = np.clip(np.searchsorted(tile_keys, keys), 0, len(tile_keys) - 1)
+        occupied = (tile_keys[positions] == keys) & (candidates >= low).all(axis=1) & \
+            (candidates < low + width).all(axis=1)
+        indexes, positions = indexes[occupied], positions[occupied]
+
+        # Group coordinates by tile.
+        order = np.argsort(positions, kind="stable")
+        indexes, positions = indexes[order], positions[order]
+        splits = np.flatnonzero(np.diff(positions)) + 1
+        tasks = [(coords[tile_indexes], tile_indexes, tolerance) for tile_indexes in np.split(indexes, splits)]
+
+        logger.info("Querying {} node coordinates within tolerance across {} tiles.".format(len(coords), len(tasks)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pairs = np.concatenate(list(executor.map(query_within, *zip(*tasks))))
+
+    else:
+        pairs = query_within(coords, np.arange(len(coords)), tolerance)
+
+    # Merge coordinates into nodes.
+    labels = cluster_labels(len(coords), pairs)
+    roots, nodes = np.unique(labels, return_inverse=True)
+
+    return nodes.ravel()[distinct], coords[roots]
+
+
+def gen_uuids(count):
+    """
+    Generates random (version 4) UUIDs from a single buffer of random bytes.
+    Returns a (count, 16) uint8 array, see uuid_hex for the string representation.
+    """
+
+    uuids = np.frombuffer(os.urandom(16 * count), dtype=np.uint8).reshape(count, 16).copy()
+
+    return set_uuid_version(uuids, 4)
+
+
+def gen_uuids_v5(namespace, names):
+    """
+    Generates name-based (version 5, SHA-1) UUIDs for a sequence of bytes names within a uuid.UUID namespace, such that
+    the same names always produce the same UUIDs. Repeated names are disambiguated by their occurrence number.
+    Returns a (count, 16) uint8 array, see uuid_hex for the string representation.
+    """
+
+    # Disambiguate repeated names.
+    names = pd.Series(names, dtype=object)
+    occurrence = names.groupby(names, sort=False).cumcount().to_numpy()
+    names = [name + b"#%d" % n if n else name for name, n in zip(names, occurrence)]
+
+    # Hash namespace and names.
+    digests = b"".join(hashlib.sha1(namespace.bytes + name).digest()[:16] for name in names)
+    uuids = np.frombuffer(digests, dtype=np.uint8).reshape(len(names), 16).copy()
+
+    return set_uuid_version(uuids, 5)
 
-    except (ValueError, fiona.errors.FionaValueError):
-        logger.exception("ValueError raised when writing GeoPackage layer.")
+
+def gpkg_drop_layer(con, name):
+    """Drops a GeoPackage layer, its spatial index and its metadata records, if they exist."""
+
+    con.execute("drop table if exists \"rtree_{}_geom\";".format(name))
+    con.execute("drop table if exists \"{}\";".format(name))
+    for table in ("gpkg_extensions", "gpkg_geometry_columns", "gpkg_contents"):
+        con.execute("delete from {} where table_name = ?;".format(table), (name,))
+
+
+def gpkg_drop_rtree_triggers(con, name):
+    """Drops the rtree maintenance triggers of a GeoPackage layer, if they exist."""
+
+    for suffix in gpkg_rtree_triggers:
+        con.execute("drop trigger if exists \"rtree_{}_geom_{}\";".format(name, suffix))
+
+
+def gpkg_geometry_blobs(geoms, srs_id):
+    """
+    Returns an object array of GeoPackage binary geometries: a GeoPackage header (magic, version, flags, srs_id and
+    xy envelope) followed by little endian ISO WKB. Missing geometries are returned as None.
+    """
+
+    blobs = np.full(len(geoms), None, dtype=object)
+    valid = ~shapely.is_missing(geoms)
+    if not valid.any():
+        return blobs
+
+    geoms = np.asarray(geoms)[valid]
+    empty = shapely.is_empty(geoms)
+    bounds = shapely.bounds(geoms)
+
+    # Compile headers: envelope flag (xy) for non-empty geometries, empty flag otherwise, little endian.
+    header = np.zeros(len(geoms), dtype=[("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("srs_id", "<i4"),
+                                         ("envelope", "<f8", 4)])
+    header["magic"] = b"GP"
+    header["flags"] = np.where(empty, 0b00010001, 0b00000011)
+    header["srs_id"] = srs_id
+    header["envelope"] = bounds[:, [0, 2, 1, 3]]
+    header = header.view(np.uint8).reshape(len(geoms), -1)
+
+    wkbs = shapely.to_wkb(geoms, byte_order=1, flavor="iso")
+    blobs[valid] = [bytes(h[:8]) + w if e else bytes(h) + w for h, w, e in zip(header, wkbs, empty)]
+
+    return blobs
+
+
+def gpkg_geometry_type(geoms):
+    """Returns the GeoPackage geometry type name for an array of geometries."""
+
+    geom_types = set(shapely.get_type_id(geoms[~shapely.is_missing(geoms)]).tolist())
+    names = {0: "POINT", 1: "LINESTRING", 2: "LINESTRING", 3: "POLYGON", 4: "MULTIPOINT", 5: "MULTILINESTRING",
+             6: "MULTIPOLYGON", 7: "GEOMETRYCOLLECTION"}
+    multi = {0: 4, 1: 5, 2: 5, 3: 6}
+
+    # Single geometry type.
+    if len(geom_types) == 1:
+        return names[geom_types.pop()]
+
+    # Single and multi part variants of the same geometry type.
+    multi_types = {multi.get(geom_type, geom_type) for geom_type in geom_types}
+    if len(multi_types) == 1:
+        return names[multi_types.pop()]
+
+    return "GEOMETRY"
+
+
+def gpkg_insert(con, name, fields, df):
+    """
+    Inserts the records of a dataframe into a GeoPackage table in batches, converting null values to None. Records
+    without fields are inserted with default values (fid only).
+    """
+
+    query = "insert into \"{}\" ({}) values ({});".format(
+        name, ", ".join("\"{}\"".format(field) for field in fields), ", ".join("?" * len(fields)))
+    if not fields:
+        con.executemany("insert into \"{}\" default values;".format(name), [()] * len(df))
+        return
+
+    for start in range(0, len(df), gpkg_batch_size):
+        batch = df.iloc[start: start + gpkg_batch_size].astype(object)
+        batch = batch.where(batch.notna(), None)
+        con.executemany(query, batch.itertuples(index=False, name=None))
+
+
+def gpkg_spatial_index(con, name, fids, geoms):
+    """
+    Creates the rtree spatial index of a GeoPackage layer, if required, and indexes the given fids from the bounds of
+    their geometries. Creates the rtree maintenance triggers.
+    """
+
+    rtree = "rtree_{}_geom".format(name)
+
+    # Create rtree and register extension.
+    con.execute("create virtual table if not exists \"{}\" using rtree(id, minx, maxx, miny, maxy);".format(rtree))
+    con.execute("insert or ignore into gpkg_extensions values (?, 'geom', 'gpkg_rtree_index', "
+                "'http://www.geopackage.org/spec120/#extension_rtree', 'write-only');", (name,))
+
+    # Bulk load rtree, excluding missing and empty geometries.
+    keep = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    bounds = shapely.bounds(geoms[keep])
+    con.executemany("insert or replace into \"{}\" values (?, ?, ?, ?, ?);".format(rtree),
+                    zip(fids[keep].tolist(), *bounds[:, [0, 2, 1, 3]].T.tolist()))
+
+    # Create rtree maintenance triggers.
+    for suffix, trigger in gpkg_rtree_triggers.items():
+        con.execute("create trigger \"{}_{}\" {}".format(rtree, suffix, trigger.format(t=name, c="geom", i="fid")))
+
+
+def gpkg_sql_type(series):
+    """Returns the GeoPackage SQL field type inferred from the dtype of a pandas series."""
+
+    if pd.api.types.is_bool_dtype(series):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(series):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(series):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "DATETIME"
+
+    return "TEXT"
+
+
+def gpkg_srs_id(con, crs):
+    """Returns the GeoPackage srs_id of a coordinate reference system, registering it if required."""
+
+    # Undefined SRS.
+    if crs is None:
+        return -1
+
+    epsg = crs.to_epsg()
+    if epsg is not None:
+        srs_id, organization, coordsys_id = epsg, "EPSG", epsg
+    else:
+        srs_id = con.execute("select max(max(srs_id) + 1, 100000) from gpkg_spatial_ref_sys;").fetchone()[0]
+        organization, coordsys_id = "NONE", srs_id
+
+    if not con.execute("select 1 from gpkg_spatial_ref_sys where srs_id = ?;", (srs_id,)).fetchone():
+        con.execute("insert into gpkg_spatial_ref_sys values (?, ?, ?, ?, ?, NULL);",
+                    (crs.name, srs_id, organization, coordsys_id, crs.to_wkt(version="WKT1_GDAL")))
+
+    return srs_id
+
+
+def gpkg_update_extent(con, name, geoms):
+    """Updates the gpkg_contents extent of a layer to include the given geometries."""
+
+    bounds = shapely.bounds(geoms[~(shapely.is_missing(geoms) | shapely.is_empty(geoms))])
+    if not len(bounds):
+        return
+
+    con.execute("update gpkg_contents set min_x = min(coalesce(min_x, ?1), ?1), min_y = min(coalesce(min_y, ?2), ?2), "
+                "max_x = max(coalesce(max_x, ?3), ?3), max_y = max(coalesce(max_y, ?4), ?4), "
+                "last_change = strftime('%Y-%m-%dT%H:%M:%fZ', 'now') where table_name = ?5;",
+                (*np.nanmin(bounds[:, :2], axis=0).tolist(), *np.nanmax(bounds[:, 2:], axis=0).tolist(), name))
+
+
+def hash_rows(df, fields):
+    """
+    Returns the uint64 hash of the given fields of each dataframe record. Numeric fields are hashed as float64, such
+    that integer fields containing nulls (loaded as float) hash equally to their integer counterparts.
+    """
+
+    if not len(fields):
+        return np.zeros(len(df), dtype=np.uint64)
+
+    frame = pd.DataFrame({field: df[field].astype("float64") if pd.api.types.is_numeric_dtype(df[field]) and not
+                          pd.api.types.is_bool_dtype(df[field]) else df[field] for field in fields})
+
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def interim_path(source):
+    """
+    Returns the interim storage path of a source: the GeoParquet directory or GeoPackage, whichever was modified most
+    recently, or None if neither exists.
+    """
+
+    paths = [os.path.abspath(os.path.join(interim_data_path, name)) for name in (source, "{}.gpkg".format(source))]
+    paths = [path for path in paths if os.path.exists(path)]
+
+    return max(paths, key=os.path.getmtime, default=None)
+
+
+def interim_tables(path):
+    """Returns the table names of interim storage: GeoPackage layers or GeoParquet dataset directories."""
+
+    if path.endswith(".gpkg"):
+        with sqlite3.connect(path) as con:
+            return [name for name, in con.execute("select table_name from gpkg_contents;")]
+
+    return sorted(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+
+
+def load_config_cache(name, paths):
+    """
+    Returns the cached compiled configuration for the given name if it was compiled from the current contents of the
+    given files, otherwise None. Unreadable caches (i.e. truncated, or pickled by an incompatible version of the code or
+    its dependencies) are also ignored, such that the configuration is recompiled and the cache rewritten.
+    """
+
+    path = os.path.join(config_cache_path, "{}.pickle".format(name))
+
+    if os.path.exists(path):
+        try:
+            with open(path, "rb") as f:
+                cache = pickle.load(f)
+
+            if cache["fingerprint"] == config_fingerprint(paths):
+                logger.info("Loaded compiled configuration from cache: {}.".format(name))
+                return cache["config"]
+
+        except (AttributeError, EOFError, ImportError, KeyError, OSError, TypeError, ValueError,
+                pickle.UnpicklingError):
+            logger.warning("Unable to load compiled configuration cache, recompiling: {}.".format(path))
+
+    return None
+
+
+def load_interim(path, table, columns=None, geometry=True):
+    """
+    Loads a table from interim storage, optionally restricted to the given columns (existing columns only) and without
+    geometry. GeoParquet datasets are memory mapped and only the requested columns are read. GeoPackage layers are read
+    whole.
+    Returns a geopandas dataframe for spatial tables loaded with geometry, otherwise a pandas dataframe.
+    """
+
+    # GeoPackage.
+    if path.endswith(".gpkg"):
+        df = gpd.read_file(path, layer=table)
+        if isinstance(df, gpd.GeoDataFrame) and (not geometry or df.geometry.isna().all()):
+            df = pd.DataFrame(df.drop(columns=df.geometry.name))
+        if columns is not None:
+            df = df[[column for column in df.columns if column in columns or
+                     (isinstance(df, gpd.GeoDataFrame) and column == df.geometry.name)]]
+
+        return df
+
+    # GeoParquet.
+    if pq is None:
+        logger.error("pyarrow is required to load GeoParquet interim data.")
         sys.exit(1)
 
+    table_path = os.path.join(path, table)
+    schema = pq.read_schema(os.path.join(table_path, sorted(os.listdir(table_path))[0]))
+    geo = json.loads(schema.metadata.get(b"geo", b"null")) if schema.metadata else None
+
+    if columns is not None:
+        columns = [column for column in schema.names if column in columns or
+                   (geometry and geo is not None and column == geo["primary_column"])]
+
+    if geometry and geo is not None:
+        return gpd.read_parquet(table_path, columns=columns, memory_map=True)
+
+    if geo is not None and columns is None:
+        columns = [column for column in schema.names if column not in geo["columns"]]
+
+    return pd.read_parquet(table_path, columns=columns, memory_map=True)
+
 
 def load_yaml(path):
     """Loads and returns a yaml file."""
@@ -65,3 +740,84 @@ def load_yaml(path):
             return yaml.safe_load(f)
         except (ValueError, yaml.YAMLError):
             logger.exception("Unable to load yaml file: {}.".format(path))
+
+
+def parquet_cast(df, fields):
+    """
+    Returns a copy of a dataframe with its fields cast to the given schema field types: nullable integers (int),
+    floats (float) or strings (str). Values which cannot be cast to numbers are set to null. Categorical fields are cast
+    as their plain values, such that all parts share the same column types regardless of their categories.
+    """
+
+    casts = dict()
+
+    for field, dtype in fields.items():
+        if field in df.columns:
+            series = df[field]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                series = series.astype(object)
+
+            if dtype == "int":
+                casts[field] = pd.to_numeric(series, errors="coerce").round().astype("Int64")
+            elif dtype == "float":
+                casts[field] = pd.to_numeric(series, errors="coerce").astype("float64")
+            elif dtype == "str":
+                casts[field] = series.where(series.isna(), series.astype(str)).astype(object)
+
+    return df.assign(**casts)
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the current process in MB, or None if unavailable on this platform."""
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def query_within(coords, indexes, tolerance):
+    """
+    Returns the (n, 2) array of index pairs (lower index first) of the coordinates within the tolerance of each other,
+    via a bulk STRtree query. Indexes map coordinate positions to the returned indexes.
+    """
+
+    geoms = shapely.points(coords)
+    pairs = shapely.STRtree(geoms).query(geoms, predicate="dwithin", distance=tolerance).T
+    pairs = indexes[pairs[pairs[:, 0] < pairs[:, 1]]]
+
+    return pairs.reshape(-1, 2)
+
+
+def save_config_cache(name, paths, config):
+    """
+    Caches a compiled configuration under the given name, keyed by the fingerprint of the files it was compiled from.
+    """
+
+    os.makedirs(config_cache_path, exist_ok=True)
+    path = os.path.join(config_cache_path, "{}.pickle".format(name))
+
+    # Write to a temporary file and replace, such that concurrent processes never read a partial cache.
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"fingerprint": config_fingerprint(paths), "config": config}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def set_uuid_version(uuids, version):
+    """Sets the RFC 4122 version and variant bits of a (count, 16) uint8 UUID array, in place."""
+
+    uuids[:, 6] = (uuids[:, 6] & 0x0F) | (version << 4)
+    uuids[:, 8] = (uuids[:, 8] & 0x3F) | 0x80
+
+    return uuids
+
+
+def uuid_hex(uuids):
+    """Returns the 32 character hexadecimal strings of a (count, 16) uint8 UUID array as an object array."""
+
+    hexed = binascii.hexlify(np.ascontiguousarray(uuids, dtype=np.uint8).tobytes())
+
+    return np.frombuffer(hexed, dtype="S32").astype(str).astype(object)
@@ -0,0 +1,256 @@
+import json
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shapely
+import shutil
+import sys
+
+import helpers
+
+
+logger = logging.getLogger()
+
+# Edge tables, indexed by edge table code.
+edge_tables = ["roadseg", "ferryseg"]
+
+# Network arrays, stored as one .npy file each.
+network_arrays = ["node_coords", "edge_nodes", "edge_table", "edge_row", "edge_length", "edge_trafficdir", "indptr",
+                  "indices", "arcs", "traversable"]
+
+
+class Network:
+    """
+    Road network graph of roadseg and ferryseg edges between junction nodes, in compressed sparse row (CSR) form.
+
+    Nodes are the segment endpoints, snapped within a tolerance (see helpers.gen_nodes). Edges follow the record order
+    of the input tables, excluding missing geometries:
+    node_coords: (nodes, 2) node coordinates.
+    edge_nodes: (edges, 2) first and last node of each edge, in digitized direction.
+    edge_table / edge_row: edge table code (see edge_tables) and record position within the table.
+    edge_length: edge length, in coordinate system units.
+    edge_trafficdir: trafficdir domain code (1: both, 2: same, 3: opposite direction) or 0 if unknown.
+    The adjacency of node i is held at positions indptr[i]:indptr[i + 1] of indices (neighbour nodes), arcs (edges) and
+    traversable (whether trafficdir allows travel from node i to the neighbour along the edge).
+    """
+
+    def __init__(self, **arrays):
+        for name in network_arrays:
+            setattr(self, name, arrays[name])
+
+    @property
+    def edge_count(self):
+        """Returns the number of edges."""
+
+        return len(self.edge_nodes)
+
+    @property
+    def node_count(self):
+        """Returns the number of nodes."""
+
+        return len(self.node_coords)
+
+    def component_stats(self):
+        """
+        Returns a dataframe of the connected components: node count, edge count, ferry edge count and total length,
+        indexed by component label (see components).
+        """
+
+        nodes = self.components()
+        edges = nodes[self.edge_nodes[:, 0]]
+        count = nodes.max() + 1 if len(nodes) else 0
+
+        return pd.DataFrame({
+            "nodes": np.bincount(nodes, minlength=count),
+            "edges": np.bincount(edges, minlength=count),
+            "ferry_edges": np.bincount(edges, weights=self.edge_table == edge_tables.index("ferryseg"),
+                                       minlength=count).astype(np.int64),
+            "length": np.bincount(edges, weights=self.edge_length, minlength=count)
+        }).rename_axis("component")
+
+    def components(self):
+        """
+        Labels the connected components of the undirected graph via vectorized union-find. Returns the component label
+        of each node, numbered from 0 by lowest node.
+        """
+
+        labels = helpers.cluster_labels(self.node_count, self.edge_nodes)
+
+        return np.unique(labels, return_inverse=True)[1].ravel()
+
+    def degree(self):
+        """Returns the degree (number of edge endpoints) of each node. Closed loops count twice."""
+
+        return np.diff(self.indptr)
+
+    def degree_stats(self):
+        """Returns a dataframe of the node count and share of nodes by degree."""
+
+        counts = np.bincount(self.degree())
+        counts = pd.Series(counts, name="nodes").rename_axis("degree")[counts > 0]
+
+        return counts.to_frame().assign(share=counts / max(self.node_count, 1))
+
+    def islands(self):
+        """
+        Returns a boolean array flagging the edges disconnected from the main network: the edges outside the connected
+        component of greatest total length.
+        """
+
+        if not self.edge_count:
+            return np.zeros(0, dtype=bool)
+
+        nodes = self.components()
+        edges = nodes[self.edge_nodes[:, 0]]
+
+        return edges != np.argmax(np.bincount(edges, weights=self.edge_length))
+
+    def neighbours(self, node, traversable=False):
+        """
+        Returns the neighbour nodes and connecting edges of a node, optionally restricted to the edges which trafficdir
+        allows to travel from the node.
+        """
+
+        adjacency = slice(self.indptr[node], self.indptr[node + 1])
+        neighbours, arcs = self.indices[adjacency], self.arcs[adjacency]
+
+        if traversable:
+            allowed = self.traversable[adjacency]
+            return neighbours[allowed], arcs[allowed]
+
+        return neighbours, arcs
+
+    def save(self, path, meta=None):
+        """
+        Stores the network arrays as .npy files within the path directory, with optional json metadata. The directory is
+        replaced via a temporary directory, such that readers never see a partial network.
+        """
+
+        tmp_path = "{}.tmp".format(path)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        for name in network_arrays:
+            np.save(os.path.join(tmp_path, "{}.npy".format(name)), np.asarray(getattr(self, name)))
+
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf8") as f:
+            json.dump(meta or dict(), f, indent=2, sort_keys=True)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads the network arrays stored by save as read-only memory-mapped arrays."""
+
+        return cls(**{name: np.load(os.path.join(path, "{}.npy".format(name)), mmap_mode="r")
+                      for name in network_arrays})
+
+
+def build_network(dframes, tolerance=0, tile_size=None, workers=1):
+    """
+    Builds the network of the roadseg and ferryseg dataframes of a dictionary of dataframes, snapping endpoints within
+    the tolerance into nodes. See helpers.gen_nodes for the tile size and workers. Edge trafficdir codes are read from
+    the optional roadseg trafficdir field, as field domain codes or values (English or French).
+    """
+
+    coords, edge_table, edge_row, edge_length, edge_trafficdir = list(), list(), list(), list(), list()
+    domain = helpers.domain_codes("roadseg", "trafficdir")
+
+    for code, table in enumerate(edge_tables):
+        if table not in dframes:
+            continue
+
+        df = dframes[table]
+        first, last = helpers.endpoints(df.geometry.values)
+
+        # Exclude missing geometries.
+        valid = np.flatnonzero(~(np.isnan(first).any(axis=1) | np.isnan(last).any(axis=1)))
+        coords.append(np.stack([first[valid], last[valid]], axis=1))
+        edge_table.append(np.full(len(valid), code, dtype=np.int8))
+        edge_row.append(valid)
+        edge_length.append(shapely.length(df.geometry.values[valid]))
+
+        # Compile traffic direction codes.
+        if "trafficdir" in df.columns:
+            values = pd.Series(df["trafficdir"].to_numpy(dtype=object)[valid]).astype(str).str.strip().str.lower()
+            edge_trafficdir.append(values.map(domain).fillna(0).to_numpy(dtype=np.int8))
+        else:
+            edge_trafficdir.append(np.zeros(len(valid), dtype=np.int8))
+
+    coords = np.concatenate(coords) if coords else np.empty((0, 2, 2))
+    nodes, node_coords = helpers.gen_nodes(coords.reshape(-1, 2), tolerance, tile_size=tile_size, workers=workers)
+    edge_nodes = nodes.reshape(-1, 2)
+    edge_trafficdir = np.concatenate(edge_trafficdir) if edge_trafficdir else np.empty(0, dtype=np.int8)
+
+    # Compile adjacency entries in both directions, sorted by node.
+    edges = np.arange(len(edge_nodes))
+    sources = np.concatenate([edge_nodes[:, 0], edge_nodes[:, 1]])
+    order = np.argsort(sources, kind="stable")
+
+    # Traffic direction: same direction edges may only be travelled forward, opposite direction edges backward.
+    traversable = np.concatenate([edge_trafficdir != 3, edge_trafficdir != 2])[order]
+
+    network = Network(
+        node_coords=node_coords,
+        edge_nodes=edge_nodes,
+        edge_table=np.concatenate(edge_table) if edge_table else np.empty(0, dtype=np.int8),
+        edge_row=np.concatenate(edge_row) if edge_row else np.empty(0, dtype=np.int64),
+        edge_length=np.concatenate(edge_length) if edge_length else np.empty(0),
+        edge_trafficdir=edge_trafficdir,
+        indptr=np.append(0, np.cumsum(np.bincount(sources, minlength=len(node_coords)))),
+        indices=np.concatenate([edge_nodes[:, 1], edge_nodes[:, 0]])[order],
+        arcs=np.concatenate([edges, edges])[order],
+        traversable=traversable
+    )
+
+    logger.info("Built network: {} nodes, {} edges.".format(network.node_count, network.edge_count))
+
+    return network
+
+
+def interim_mtime(path):
+    """Returns the latest modification time (ns) of an interim GeoPackage or of the files of a GeoParquet directory."""
+
+    if not os.path.isdir(path):
+        return os.stat(path).st_mtime_ns
+
+    return max([os.stat(root).st_mtime_ns for root, _, _ in os.walk(path)] +
+               [os.stat(os.path.join(root, f)).st_mtime_ns for root, _, files in os.walk(path) for f in files])
+
+
+def load_network(source, tolerance=1e-7, tile_size=None, workers=1, cache=True):
+    """
+    Returns the network of the roadseg and ferryseg interim tables of a source (see build_network). With cache=True,
+    the network is stored in the {source}_network interim directory and memory mapped on later calls, until the interim
+    data or the tolerance changes.
+    """
+
+    data_path = helpers.interim_path(source)
+    if data_path is None:
+        logger.error("Input data not found: \"{}\".".format(os.path.join(helpers.interim_data_path, source)))
+        sys.exit(1)
+
+    cache_path = os.path.join(helpers.interim_data_path, "{}_network".format(source))
+    meta = {"input": os.path.basename(data_path), "mtime_ns": interim_mtime(data_path), "tolerance": tolerance}
+
+    # Load cached network.
+    if cache and os.path.exists(os.path.join(cache_path, "meta.json")):
+        with open(os.path.join(cache_path, "meta.json"), "r", encoding="utf8") as f:
+            if json.load(f) == meta:
+                logger.info("Loading cached network: {}.".format(cache_path))
+                return Network.load(cache_path)
+
+    # Build network from the interim tables.
+    logger.info("Building network from interim data: {}.".format(data_path))
+    tables = helpers.interim_tables(data_path)
+    dframes = {table: helpers.load_interim(data_path, table, columns=["trafficdir"]) for table in edge_tables
+               if table in tables}
+
+    network = build_network(dframes, tolerance, tile_size=tile_size, workers=workers)
+    if cache:
+        network.save(cache_path, meta)
+        network = Network.load(cache_path)
+
+    return network
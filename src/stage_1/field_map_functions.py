@@ -1,10 +1,13 @@
 import logging
 import numpy as np
+import pandas as pd
 import re
 import sys
 from copy import deepcopy
+from functools import lru_cache
+from itertools import chain
 from numpy import nan
-from operator import attrgetter, itemgetter
+from operator import attrgetter
 
 
 logger = logging.getLogger()
@@ -34,10 +37,29 @@ def apply_domain(val, domain):
     return nan
 
 
+@lru_cache(maxsize=None)
+def compile_regex(pattern, domain=None):
+    """
+    Validates and compiles a regular expression, case ignored.
+    Replaces keyword 'domain' with the domain pattern of the given field, if provided (must be hashable, i.e. a tuple of
+    values or a domain_regex pattern).
+    Results are cached such that each pattern-domain combination is only expanded and compiled once.
+    """
+
+    pattern = validate_regex(pattern, domain)
+
+    try:
+        return re.compile(pattern, flags=re.IGNORECASE)
+    except re.error:
+        logger.exception("Validation failed. Invalid regular expression: \"{}\".".format(pattern))
+        sys.exit(1)
+
+
 def copy_attribute_functions(field_mapping_attributes, params):
     """
     Compiles the field mapping functions for each of the given field mapping attributes (target table columns).
     Adds / updates any parameters provided for those functions.
+    Returns a list of (attribute, function-parameter dictionary) tuples.
 
     Possible yaml construction of copy_attribute_functions:
 
@@ -88,7 +110,7 @@ def copy_attribute_functions(field_mapping_attributes, params):
                 attribute_func_dict[attribute_func][attribute_param] = attribute_param_value
 
         # Store result.
-        attribute_func_dicts.append(attribute_func_dict)
+        attribute_func_dicts.append((attribute, attribute_func_dict))
 
     return attribute_func_dicts
 
@@ -96,6 +118,7 @@ def copy_attribute_functions(field_mapping_attributes, params):
 def direct(val, **kwargs):
     """
     Returns the given value. Intended to provide a function call for direct (1:1) field mapping.
+    If val = pandas series or dataframe: Returns the values with empty values replaced by numpy nan.
 
     Possible yaml construction of direct field mapping:
 
@@ -106,26 +129,58 @@ def direct(val, **kwargs):
              parameter: None
     """
 
+    # Apply to series or dataframe.
+    if isinstance(val, (pd.Series, pd.DataFrame)):
+        return val.where(~(val.isna() | (val == "")), nan)
+
     return nan if val in (None, "", nan) else val
 
 
+@lru_cache(maxsize=None)
+def domain_regex(domain):
+    """
+    Compiles the values of a field domain (a tuple) into a regular expression pattern matching any one of the values,
+    case ignored. The values are merged into a prefix trie, such that each position is matched in a single pass over
+    shared prefixes instead of trying every value in turn, and the longest value matching at a position takes
+    precedence. Values are matched literally.
+    """
+
+    # Build prefix trie of lowercase values. The empty key marks the end of a value.
+    trie = dict()
+    for value in set(str(value).lower() for value in domain if str(value)):
+        node = trie
+        for char in value:
+            node = node.setdefault(char, dict())
+        node[""] = dict()
+
+    def compile_node(node):
+        """Compiles a trie node, trying longer values before the value ending at the node."""
+
+        branches = [re.escape(char) + compile_node(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+
+        pattern = branches[0] if len(branches) == 1 else "(?:{})".format("|".join(branches))
+        return "(?:{})?".format(pattern) if "" in node else pattern
+
+    return compile_node(trie)
+
+
 def regex_find(val, pattern, match_index, group_index, domain=None, strip_result=False):
     """
     Extracts a value's nth match (index) from the nth match group (index) based on a regular expression pattern.
     Case ignored by default.
-    Parameter 'group_index' can be an int or list of ints, the returned value will be at the first index with a match.
+    Parameter 'group_index' can be an int or list of ints, the returned value will be the whole group at the first index
+    with a match.
     Parameter 'strip_result' returns the entire value except for the extracted substring.
+    If val = pandas series: The pattern is compiled once and the unique series values are split on all matches in a
+    single pass (Series.str.split), yielding the text preceding each match, the match and its groups, such that the
+    match positions are known. The nth match of each value is then selected and stripped as arrays (see strip_spans),
+    and results are broadcast to the full series.
     """
 
-    # Return numpy nan.
-    if val in (None, "", nan):
-        return nan
-
-    if str(val).lower() in ("route 515 highway", "chemin gauthier"):
-        print("ONE")
-
     # Validate inputs.
-    pattern = validate_regex(pattern, domain)
+    regex = compile_regex(pattern, domain if domain is None or isinstance(domain, str) else tuple(domain))
     validate_dtypes("match_index", match_index, [int, np.int_])
     if not isinstance(group_index, list):
         group_index = [group_index]
@@ -133,48 +188,66 @@ def regex_find(val, pattern, match_index, group_index, domain=None, strip_result
         validate_dtypes("group_index[{}]".format(index), i, [int, np.int_])
     validate_dtypes('strip_result', strip_result, [bool, np.bool_])
 
-    if str(val).lower() in ("route 515 highway", "chemin gauthier"):
-        print("TWO")
-        print("DOMAIN:", type(domain), domain)
-        print("PATTERN:", type(pattern), pattern)
-        print("GROUP_INDEX:", type(group_index), group_index)
-        print("MATCH_INDEX:", type(match_index), match_index)
+    # Apply to series.
+    if isinstance(val, pd.Series):
+
+        # Return numpy nan for empty values and, if no match is found, the value if stripping, otherwise numpy nan.
+        codes, uniques = pd.factorize(val)
+        uniques = pd.Series(np.asarray(uniques, dtype=object), dtype=object)
+        results = uniques.where(uniques.ne("")) if strip_result else pd.Series(nan, index=uniques.index, dtype=object)
+        values = uniques[uniques.ne("")].astype(str)
+
+        # Split values on all matches: the text preceding each match, the match and its groups, then the trailing text.
+        # Group indexes must all be valid.
+        if len(values) and all(-regex.groups <= i < regex.groups for i in group_index):
+            width = regex.groups + 2
+            tokens = values.str.split(re.compile("({})".format(regex.pattern), flags=regex.flags), regex=True)
+            counts = (tokens.str.len().to_numpy(dtype=np.int64) - 1) // width
+            tokens = np.array(list(chain.from_iterable(tokens)), dtype=object)
+
+            # Compile the token position of each match, and the match positions within each value.
+            firsts = np.repeat(np.cumsum(counts) - counts, counts)
+            numbers = np.arange(counts.sum()) - firsts
+            positions = np.repeat(np.cumsum(counts * width + 1) - (counts * width + 1), counts) + numbers * width
+            lengths = pd.Series(tokens).str.len().to_numpy(dtype=np.int64, na_value=0)
+            ends = np.cumsum(lengths[positions] + lengths[positions + 1])
+            ends -= np.append(0, ends)[firsts]
+            starts = ends - lengths[positions + 1]
+
+            # Select the nth match of each value and its first non-empty group from the group indexes.
+            selected = numbers == (match_index if match_index >= 0 else np.repeat(counts, counts) + match_index)
+            groups = tokens[positions[selected][:, None] + [i % regex.groups + 2 for i in group_index]]
+            found = pd.notna(groups) & (groups != "")
+            result = groups[np.arange(len(groups)), found.argmax(axis=1)]
+            found = found.any(axis=1)
+            records = np.repeat(values.index.to_numpy(), counts)[selected][found]
+
+            # Strip result if required.
+            if strip_result:
+                results.loc[records] = strip_spans(values.loc[records], starts[selected][found],
+                                                   ends[selected][found]).to_numpy()
+            else:
+                results.loc[records] = result[found]
+
+        return pd.Series(np.append(results.to_numpy(dtype=object), nan)[codes], index=val.index)
+
+    # Return numpy nan.
+    if val in (None, "", nan):
+        return nan
 
     # Apply and return regex value, or numpy nan.
     try:
 
-        # Single group index.
-        if isinstance(group_index, int):
-            matches = re.finditer(pattern, val, flags=re.IGNORECASE)
-            result = [[m.groups()[group_index], m.start(), m.end()] for m in matches][match_index]
-
-            if str(val).lower() in ("route 515 highway", "chemin gauthier"):
-                print("THREE")
-                print("MATCHES:", matches)
-                print("RESULT:", result)
-
-        # Multiple group indexes.
-        else:
-            matches = re.finditer(pattern, val, flags=re.IGNORECASE)
-            result = [[itemgetter(*group_index)(m.groups()), m.start(), m.end()] for m in matches][match_index]
-            result[0] = [grp for grp in result[0] if grp not in (None, "", nan)][0]
-
-            if str(val).lower() in ("route 515 highway", "chemin gauthier"):
-                print("FOUR")
-                print("MATCHES:", [i for i in matches])
-                print("RESULT:", result)
-
-        if str(val).lower() in ("route 515 highway", "chemin gauthier"):
-            print("FIVE")
-            print("STRIP_RESULT:", strip_result)
-            sys.exit(1)
+        # Retrieve nth match and the first non-empty group from the group indexes.
+        match = list(regex.finditer(val))[match_index]
+        groups = match.groups()
+        result = [groups[i] for i in group_index if groups[i] not in (None, "", nan)][0]
 
         # Strip result if required.
         if strip_result:
-            start, end = result[1:]
-            return " ".join(map(str, [val[:start], val[end:]])).strip()
+            return " ".join(map(str, [val[:match.start()], val[match.end():]])).strip()
         else:
-            return result[0]
+            return result
 
     except (IndexError, ValueError):
         return val if strip_result else nan
@@ -184,24 +257,31 @@ def regex_sub(val, pattern_from, pattern_to, domain=None):
     """
     Substitutes one regular expression pattern with another.
     Case ignored by default.
+    If val = pandas series: The pattern is compiled once and substituted across the entire series.
     """
 
+    # Validate inputs.
+    domain = domain if domain is None or isinstance(domain, str) else tuple(domain)
+    regex = compile_regex(pattern_from, domain)
+    pattern_to = validate_regex(pattern_to, domain)
+
+    # Apply to series, returning numpy nan for empty values.
+    if isinstance(val, pd.Series):
+        return val.where(val != "").str.replace(regex, pattern_to, regex=True)
+
     # Return numpy nan.
     if val in (None, "", nan):
         return nan
 
-    # Validate inputs.
-    pattern_from = validate_regex(pattern_from, domain)
-    pattern_to = validate_regex(pattern_to, domain)
-
     # Apply and return regex value.
-    return re.sub(pattern_from, pattern_to, val, flags=re.IGNORECASE)
+    return regex.sub(pattern_to, val)
 
 
 def split_record(vals, field=None):
     """
-    If vals = pandas dataframe: Splits records on the given field.
-    If vals = numpy ndarray: Returns value.
+    If vals = pandas dataframe and field = target field name(s) or dict of target field names to pandas dataframes of
+    candidate values (one column per source field): Splits records on the given field(s).
+    Otherwise (numpy ndarray, pandas series or pandas dataframe of mapped source fields): Returns value.
 
     This function is executed in two separate parts due to the functionality of stage_1.apply_functions, which operates
     on a series. Since splitting records in a series would not affect the original dataframe, the input series is simply
@@ -210,31 +290,88 @@ def split_record(vals, field=None):
 
     It was decided to keep split_record as a callable field mapping function instead of creating a separate function
     within stage_1 such that split_record can exist within a chain of other field mapping functions.
+
+    Each record is split into one record per distinct candidate value (nulls compare equal), in candidate order. Fields
+    given by name are expected to contain a sequence of candidate values per record. Where multiple fields are split,
+    the number of records is the maximum number of distinct values across the fields, with exhausted fields repeating
+    their last distinct value. Original records are kept in place, holding the first distinct value, followed by the
+    split records grouped by split order. Indexes, including uuid linkage, are repeated for split records.
     """
 
     # Return values.
-    if isinstance(vals, np.ndarray):
+    if not isinstance(vals, pd.DataFrame) or not field:
 
         return vals
 
     # Split records.
     else:
 
-        # Identify records to be split.
-        vals_split = vals.loc[vals[field].map(lambda val: val[0] != val[1])].copy(deep=True)
+        # Compile candidate values as a 2-dimensional array per field.
+        if isinstance(field, dict):
+            candidates = {name: np.asarray(values, dtype=object) for name, values in field.items()}
+        else:
+            candidates = {name: np.array(vals[name].tolist(), dtype=object, ndmin=2).reshape(len(vals), -1)
+                          for name in ([field] if isinstance(field, str) else field) if name in vals.columns}
+
+        if not candidates or not len(vals):
+            return vals
+
+        rows = np.arange(len(vals))
+        ranked, counts = dict(), np.ones(len(vals), dtype=int)
+
+        for name, values in candidates.items():
+
+            # Flag the first instance of each distinct value per record.
+            nulls = pd.isna(values)
+            keep = np.ones(values.shape, dtype=bool)
+            for index in range(1, values.shape[1]):
+                for prior in range(index):
+                    keep[:, index] &= ~((values[:, index] == values[:, prior]) | (nulls[:, index] & nulls[:, prior]))
+
+            # Rank distinct values per record, padding exhausted ranks with the last distinct value.
+            rank = np.cumsum(keep, axis=1) - 1
+            field_counts = rank[:, -1] + 1
+            compact = np.empty(values.shape, dtype=object)
+            compact[np.nonzero(keep)[0], rank[keep]] = values[keep]
+            ranked[name] = (compact, field_counts)
+            counts = np.maximum(counts, field_counts)
+
+        # Repeat record positions by split order: originals first, then each successive split.
+        positions = np.concatenate([rows[counts > index] for index in range(counts.max())])
+        split_rank = np.repeat(np.arange(counts.max()), [np.count_nonzero(counts > index)
+                                                         for index in range(counts.max())])
+
+        # Duplicate records and assign split values in a single pass.
+        vals = vals.take(positions)
+        for name, (compact, field_counts) in ranked.items():
+            vals[name] = compact[positions, np.minimum(split_rank, field_counts[positions] - 1)]
+
+        return vals
 
-        if len(vals_split):
 
-            # Keep first instance for original records.
-            vals[field] = vals[field].map(lambda val: val[0])
+def strip_spans(vals, starts, ends):
+    """
+    Removes a span (start and end position) from each value of a sequence of strings, joining the remaining text before
+    and after the span with a space, stripped. Values are compiled into a numpy character array, such that all spans are
+    removed at once. Returns a pandas series.
+    """
 
-            # Keep second instance for split records.
-            vals_split[field] = vals_split[field].map(lambda val: val[1])
+    # Compile character codes of the values.
+    chars = np.asarray(vals, dtype=str)
+    width = chars.dtype.itemsize // 4
+    codes = chars.view(np.uint32).reshape(len(chars), width)
+    starts, ends = np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
 
-            # Append split records to dataframe.
-            vals = vals.append(vals_split, ignore_index=False)
+    # Copy the characters before each span, a space, and the characters after each span.
+    result = np.zeros((len(chars), width + 1), dtype=np.uint32)
+    positions = np.arange(width)
+    before = positions < starts[:, None]
+    result[:, :width][before] = codes[before]
+    result[np.arange(len(chars)), starts] = ord(" ")
+    rows, columns = np.nonzero(positions >= ends[:, None])
+    result[rows, columns - ends[rows] + starts[rows] + 1] = codes[rows, columns]
 
-        return vals
+    return pd.Series(result.view("U{}".format(width + 1)).ravel(), dtype=object).str.strip()
 
 
 def validate_dtypes(val_name, val, dtypes):
@@ -254,7 +391,8 @@ def validate_dtypes(val_name, val, dtypes):
 def validate_regex(pattern, domain=None):
     """
     Validates a regular expression.
-    Replaces keyword 'domain' with the domain values of the given field, if provided.
+    Replaces keyword 'domain' with the domain pattern of the given field, if provided: either a domain_regex pattern or
+    the domain values.
     """
 
     try:
@@ -262,9 +400,9 @@ def validate_regex(pattern, domain=None):
         # Compile regular expression.
         re.compile(pattern)
 
-        # Load domain values.
+        # Load domain pattern.
         if pattern.find("domain") >= 0 and domain is not None:
-            pattern = pattern.replace("domain", "|".join(map(str, domain)))
+            pattern = pattern.replace("domain", domain if isinstance(domain, str) else domain_regex(tuple(domain)))
 
         return pattern
 
@@ -1,16 +1,25 @@
-import ast
 import click
+import cProfile
 import fiona
 import geopandas as gpd
+import glob
+import hashlib
+import json
 import logging
+import numpy as np
 import os
 import pandas as pd
+import shapely
 import sys
 import uuid
-from inspect import getmembers, isfunction
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from functools import partial
+from inspect import getmembers, isfunction, signature
 from numpy import nan
 
 sys.path.insert(1, os.path.join(sys.path[0], ".."))
+import dates
 import field_map_functions
 import helpers
 
@@ -23,13 +32,35 @@ handler.setLevel(logging.INFO)
 handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
 logger.addHandler(handler)
 
+# Nullable integer dtypes by maximum field width (digits).
+int_dtypes = {2: "Int8", 4: "Int16", 9: "Int32", 18: "Int64"}
+
+# Fields identifying a unique strplaname record.
+strplaname_fields = ["dirprefix", "strtypre", "starticle", "namebody", "strtysuf", "dirsuffix", "placename", "province"]
+
+# strplaname nid reference fields by table, referencing the first (left) or last (right) name split from the same
+# source record.
+strplaname_links = {"addrange": {"l_offnanid": "first", "r_offnanid": "last"}, "altnamlink": {"strnamenid": "first"}}
+
 
 class Stage:
     """Defines an NRN stage."""
 
-    def __init__(self, source):
+    def __init__(self, source, chunk_size=None, workers=1, cprofile=False, factorize=True, deterministic=False,
+                 incremental=False, interim_format="gpkg"):
         self.stage = 1
         self.source = source.lower()
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.cprofile = cprofile
+        self.factorize = factorize
+        self.deterministic = deterministic
+        self.incremental = incremental
+        self.interim_format = interim_format
+        self.profiler = helpers.RunProfiler()
+
+        # strplaname nids by name hash, across chunks.
+        self.strplaname_nids = pd.Series(dtype=object, index=pd.Index([], dtype=np.uint64))
 
         # Configure raw data path.
         self.data_path = os.path.abspath("../../data/raw/{}".format(self.source))
@@ -37,21 +68,24 @@ class Stage:
         # Configure source attribute path.
         self.source_attribute_path = os.path.abspath("sources/{}".format(self.source))
 
-        # Validate output namespace.
-        self.output_path = os.path.join(os.path.abspath("../../data/interim"), "{}.gpkg".format(self.source))
-        if os.path.exists(self.output_path):
-            logger.error("Output namespace already occupied: \"{}\".".format(self.output_path))
-            sys.exit(1)
+        # Configure output namespace: a GeoPackage or a directory of GeoParquet datasets.
+        self.output_path = os.path.join(os.path.abspath("../../data/interim"), self.source)
+        if self.interim_format == "gpkg":
+            self.output_path = "{}.gpkg".format(self.output_path)
+        self.fingerprints_path = "{}_fingerprints.json".format(os.path.splitext(self.output_path)[0])
 
-    def apply_domains(self):
-        """Applies the field domains to each column in the target dataframes."""
+    def apply_domains(self, tables=None):
+        """
+        Applies the field domains to each column in the target dataframes, optionally restricted to the given tables.
+        Logs the records with invalid, future or inconsistent creation and revision dates.
+        """
 
         logging.info("Applying field domains.")
         table = field = None
 
         try:
 
-            for table in self.target_gdframes:
+            for table in self.target_gdframes if tables is None else tables:
                 logger.info("Applying field domains to {}.".format(table))
 
                 for field, domains in self.domains[table].items():
@@ -62,127 +96,239 @@ class Stage:
                     else:
                         logger.info("Target field \"{}\": Applying domain.".format(field))
 
-                        # Apply domains via apply_functions.
+                        # Apply domain via the compiled lowercase lookup index, as a categorical of the domain values.
                         series = self.target_gdframes[table][field]
-                        self.target_gdframes[table][field] = series.map(
-                            lambda val: eval("field_map_functions.apply_domain")(val, domain=domains["all"]))
+                        self.target_gdframes[table][field] = pd.Categorical(
+                            series.astype(str).str.lower().map(domains["lookup"]), categories=domains["categories"])
+
+                # Validate creation and revision dates.
+                gdf = self.target_gdframes[table]
+                if {"credate", "revdate"}.issubset(gdf.columns):
+                    flags = dates.validate_dates(gdf["credate"], gdf["revdate"])[dates.date_flags].sum()
+                    for flag, count in flags[flags > 0].items():
+                        logger.warning("Target table {}: {} record(s) with {}.".format(table, count,
+                                                                                      flag.replace("_", " ")))
 
         except (AttributeError, KeyError, ValueError):
             logger.exception("Invalid schema definition for table: {}, field: {}.".format(table, field))
             sys.exit(1)
 
+    def apply_dtypes(self, tables=None):
+        """
+        Casts the target dataframe fields to compact dtypes, optionally restricted to the given tables: int fields to
+        the smallest nullable integer dtype holding their width, str fields (other than domain categoricals) to strings
+        bounded by their width, dictionary encoded as categoricals unless mostly unique.
+        Invalid or out of range integers are set to null and overlong strings are truncated.
+        """
+
+        logging.info("Applying compact field dtypes.")
+
+        for table in self.target_gdframes if tables is None else tables:
+            gdf = self.target_gdframes[table]
+
+            for field, dtype in self.target_attributes[table]["dtypes"].items():
+                series, width = gdf[field], self.target_attributes[table]["widths"][field]
+                field_type = self.target_attributes[table]["fields"][field]
+
+                # Integers.
+                if field_type == "int":
+                    values = pd.to_numeric(series, errors="coerce").round()
+                    invalid = (values.isna() & series.notna()) | (values.abs() >= 10 ** width)
+                    if invalid.any():
+                        logger.warning("Target field \"{}\": {} invalid or out of range integer(s) set to null."
+                                       .format(field, invalid.sum()))
+
+                    gdf[field] = values.mask(invalid).astype(dtype)
+
+                # Strings, excluding domain categoricals.
+                elif field_type == "str" and not isinstance(series.dtype, pd.CategoricalDtype):
+                    codes, uniques = pd.factorize(series)
+
+                    # Bound unique values to the field width, merging values which become equal.
+                    uniques = pd.Index(uniques.astype(str), dtype=object)
+                    overlong = uniques.str.len().to_numpy() > width
+                    if overlong.any():
+                        logger.warning("Target field \"{}\": {} value(s) truncated to width {}.".format(
+                            field, np.count_nonzero(overlong[codes[codes >= 0]]), width))
+
+                    merged, categories = pd.factorize(uniques.str.slice(0, width))
+                    codes = np.append(merged, -1)[codes]
+
+                    # Dictionary encode repeated values.
+                    if len(categories) * 2 <= len(codes):
+                        gdf[field] = pd.Categorical.from_codes(codes, categories=categories)
+                    else:
+                        gdf[field] = np.append(categories.to_numpy(dtype=object), None)[codes]
 
-    def apply_field_mapping(self):
-        """Maps the source dataframes to the target dataframes via user-specific field mapping functions."""
+    def apply_field_mapping(self, tables=None):
+        """
+        Maps the source dataframes to the target dataframes via the compiled field mapping plan, optionally restricted
+        to the given target tables.
+        """
 
         logger.info("Applying field mapping.")
 
-        # Retrieve source attributes and dataframe.
-        for source_name, source_attributes in self.source_attributes.items():
-            source_gdf = self.source_gdframes[source_name]
-
-            # Retrieve target attributes.
-            for target_name in source_attributes["conform"]:
-                logger.info("Applying field mapping from {} to {}.".format(source_name, target_name))
-
-                # Retrieve table field mapping attributes.
-                maps = source_attributes["conform"][target_name]
+        # Reset factorization caches, which are only valid for the current source dataframes.
+        self.factorized, self.function_results = dict(), dict()
 
-                # Field mapping.
-                for target_field, source_field in maps.items():
-
-                    # Retrieve target dataframe.
-                    target_gdf = self.target_gdframes[target_name]
-
-                    # No mapping.
-                    if source_field is None:
-                        logger.info("Target field \"{}\": No mapping provided.".format(target_field))
-
-                    # Raw value mapping.
-                    elif isinstance(source_field, str) and (source_field not in source_gdf.columns):
-                            logger.info("Target field \"{}\": Applying raw value field mapping.".format(target_field))
-
-                            # Update target dataframe with raw value.
-                            target_gdf[target_field] = source_field
+        # Retrieve source field mapping plan, dataframe and uuid index.
+        for source_name, source_plan in self.field_mapping.items():
+            source_gdf = self.source_gdframes[source_name]
+            source_uuids = pd.Index(source_gdf["uuid"])
 
-                    # Function mapping.
-                    else:
-                        logger.info("Target field \"{}\": Identifying function chain.".format(target_field))
+            # Retrieve target field mapping plan and dataframe.
+            for target_name, target_plan in source_plan.items():
+                if tables is not None and target_name not in tables:
+                    continue
 
-                        # Restructure dict for direct field mapping in case of string input.
-                        if isinstance(source_field, str):
-                                source_field = {"fields": [source_field], "functions": {"direct": {"param": None}}}
-
-                        # Convert single field attribute to list.
-                        if isinstance(source_field["fields"], str):
-                            source_field["fields"] = [source_field["fields"]]
+                logger.info("Applying field mapping from {} to {}.".format(source_name, target_name))
+                target_gdf = self.target_gdframes[target_name]
 
-                        # Create mapped dataframe from source and target dataframes, keeping only source fields.
-                        # Convert to series.
-                        mapped_series = pd.DataFrame({field: target_gdf["uuid"].map(source_gdf.set_index("uuid")[field])
-                                                      for field in source_field["fields"]})
-                        mapped_series = mapped_series.apply(lambda row: row[0] if len(row) == 1 else row.values, axis=1)
+                with self.profiler.record("apply_field_mapping", table=target_name, rows=len(target_gdf)):
 
-                        # Apply field mapping functions to mapped series.
-                        field_mapping_results = self.apply_functions(
-                            maps, mapped_series, source_field["functions"],
-                            domain=self.domains[target_name][target_field]["values"])
+                    # Align source records to target records once per source-target pair.
+                    indexer = source_uuids.get_indexer(target_gdf["uuid"])
 
-                        # Update target dataframe.
-                        target_gdf[target_field] = field_mapping_results["series"]
+                    # Candidate values of fields flagged for record splitting.
+                    splits = dict()
 
-                        # Split records if required.
-                        if field_mapping_results["split_record"]:
-                            # Duplicate records that were split.
-                            target_gdf = field_map_functions.split_record(target_gdf, target_field)
+                    # Field mapping.
+                    for target_field, field_plan in target_plan.items():
+                        with self.profiler.record("apply_field_mapping", table=target_name, field=target_field,
+                                                  rows=len(target_gdf)):
 
-                    # Store updated target dataframe.
-                    self.target_gdframes[target_name] = target_gdf
+                            # No mapping.
+                            if field_plan is None:
+                                logger.info("Target field \"{}\": No mapping provided.".format(target_field))
 
-    def apply_functions(self, maps, series, func_dict, domain, split_record=False):
-        """Iterates and applies field mapping function(s) to a pandas series."""
+                            # Raw value mapping.
+                            elif "raw" in field_plan:
+                                logger.info("Target field \"{}\": Applying raw value field mapping.".format(
+                                    target_field))
 
-        # Iterate functions.
-        for func, params in func_dict.items():
+                                # Update target dataframe with raw value.
+                                target_gdf[target_field] = field_plan["raw"]
 
-            if func == "split_record":
-                split_record = True
+                            # Function mapping.
+                            else:
+                                logger.info("Target field \"{}\": Applying function chain.".format(target_field))
+
+                                # Factorized mode: apply field mapping functions to the unique source values and
+                                # broadcast the results to the target records by codes.
+                                if self.factorize:
+                                    codes, uniques = self.factorize_fields(source_name, field_plan["fields"])
+                                    results = self.apply_functions(uniques, field_plan["functions"], target_name,
+                                                                   target_field,
+                                                                   cache_key=(source_name, *field_plan["fields"]))
+                                    results = results.take(codes[indexer]).set_axis(target_gdf.index, axis=0)
+
+                                else:
+
+                                    # Create mapped dataframe of the aligned source fields.
+                                    # Convert to series for single field input, multiple fields are kept as columns.
+                                    mapped = source_gdf[field_plan["fields"]].take(indexer).set_axis(
+                                        target_gdf.index, axis=0)
+                                    if len(field_plan["fields"]) == 1:
+                                        mapped = mapped.iloc[:, 0]
+
+                                    # Apply field mapping functions to mapped series.
+                                    results = self.apply_functions(mapped, field_plan["functions"], target_name,
+                                                                   target_field)
+
+                                # Store multiple field results as split candidates if required.
+                                if isinstance(results, pd.DataFrame) and field_plan["split_record"]:
+                                    splits[target_field] = results
+                                    continue
+
+                                # Combine multiple field results into a value tuple per record.
+                                if isinstance(results, pd.DataFrame):
+                                    results = pd.Series(list(zip(*map(results.get, results.columns))),
+                                                        index=results.index)
+
+                                # Update target dataframe.
+                                target_gdf[target_field] = results.values
+
+                    # Split records once all fields are mapped.
+                    if splits:
+                        with self.profiler.record("split_record", table=target_name, rows=len(target_gdf)):
+                            logger.info("Splitting records on field(s): {}.".format(", ".join(splits)))
+                            target_gdf = field_map_functions.split_record(target_gdf, splits)
+
+                # Store updated target dataframe.
+                self.target_gdframes[target_name] = target_gdf
+
+    def apply_functions(self, series, functions, table=None, field=None, cache_key=None):
+        """
+        Applies a compiled chain of field mapping functions to a pandas series, one whole-column call each.
+        Multiple field inputs are passed as a pandas dataframe of source columns.
+        The table and field are only used to label the run profile records.
+
+        If a cache key (identifying the input series) is given, the result of each chain prefix is memoized for the
+        run, such that chains shared between attributes (i.e. via copy_attribute_functions) are only evaluated once.
+        """
+
+        # Iterate bound functions.
+        for func, bound_func in functions:
+
+            # Reuse memoized chain prefix result.
+            if cache_key is not None:
+                cache_key = (*cache_key, func, repr(sorted(bound_func.keywords.items())))
+                if cache_key in self.function_results:
+                    logger.info("Reusing field mapping function result: {}.".format(func))
+                    series = self.function_results[cache_key]
+                    continue
 
             logger.info("Applying field mapping function: {}.".format(func))
 
-            # Advanced function mapping - copy_attribute_functions.
-            if func == "copy_attribute_functions":
-
-                # Retrieve and iterate attribute functions and parameters.
-                for attr_func_dict in field_map_functions.copy_attribute_functions(maps, params):
-                    split_record, series = self.apply_functions(maps, series, attr_func_dict, domain,
-                                                                split_record).values()
-
-            else:
-
-                # For regex functions, add field name to parameters.
-                if func in self.domains_funcs and domain is not None:
-                    params["domain"] = domain
-
-                # Generate expression.
-                expr = "field_map_functions.{}(\"val\", **{})".format(func, params)
-
-                try:
-                    # Sanitize expression.
-                    parsed = ast.parse(expr, mode="eval")
-                    fixed = ast.fix_missing_locations(parsed)
-                    compiled = compile(fixed, "<string>", "eval")
-
-                    # Execute vectorized expression.
-                    series = series.map(lambda val: eval("field_map_functions.{}".format(func))(val, **params))
-                except (SyntaxError, ValueError):
-                    logger.exception("Invalid expression: \"{}\".".format(expr))
-                    sys.exit(1)
-
-        return {"split_record": split_record, "series": series}
+            with self.profiler.record("apply_functions", table=table, field=field, function=func, rows=len(series)):
+                series = bound_func(series)
+
+            if cache_key is not None:
+                self.function_results[cache_key] = series
+
+        return series
+
+    def apply_target_mapping(self):
+        """
+        Applies field mapping, field domains and compact field dtypes to the target dataframes.
+        If multiple workers are configured, each target table is processed as an independent process pool task. Workers
+        receive only the source name, stage options and paths, and each task the source, rows and uuid offset of its
+        table, such that workers load their own inputs rather than receiving the stage dataframes. Results are collected
+        in field mapping plan order, so output does not depend on task completion order.
+        """
+
+        if self.workers <= 1:
+            self.apply_field_mapping()
+            self.apply_domains()
+            self.apply_dtypes()
+            return
+
+        logger.info("Applying field mapping, field domains and field dtypes to target tables with {} workers.".format(
+            self.workers))
+        options = {"factorize": self.factorize, "deterministic": self.deterministic, "incremental": self.incremental,
+                   "interim_format": self.interim_format}
+        paths = {"data_path": self.data_path, "output_path": self.output_path}
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                 initargs=(self.source, options, paths)) as executor:
+            futures = {table: executor.submit(map_target_table, table, source_name, self.source_rows,
+                                              self.source_offsets[source_name])
+                       for source_name, source_plan in self.field_mapping.items() for table in source_plan}
+
+            for table, future in futures.items():
+                self.target_gdframes[table], records = future.result()
+                self.profiler.records.extend(records)
 
     def compile_domains(self):
-        """Compiles field domains for the target dataframes."""
+        """Compiles field domains for the target dataframes. Reuses the cached compilation if no input has changed."""
+
+        # Load from compiled configuration cache.
+        cache_paths = [os.path.abspath("../field_domains_{}.yaml".format(suffix)) for suffix in ("en", "fr")] + \
+                      [os.path.abspath(__file__), field_map_functions.__file__]
+        cached = helpers.load_config_cache("domains", cache_paths)
+        if cached is not None:
+            self.domains, self.domains_funcs = cached
+            return
 
         logging.info("Compiling field domains.")
         self.domains = dict()
@@ -204,7 +350,8 @@ class Stage:
                 for field, vals in domains_yaml[table].items():
                     # Register field.
                     if field not in self.domains[table].keys():
-                        self.domains[table][field] = {"values": list(), "all": None}
+                        self.domains[table][field] = {"values": list(), "all": None, "lookup": None,
+                                                      "categories": None, "regex": None}
 
                     try:
 
@@ -244,6 +391,32 @@ class Stage:
                         logger.exception("Invalid schema definition for table: {}, field: {}.".format(table, field))
                         sys.exit(1)
 
+        logging.info("Compiling field domain lookup indexes.")
+
+        # Index each lowercase domain key and value against its first (en) value, preserving apply_domain precedence:
+        # keys first, then values in domain order. The distinct first values form the categories of the domain field.
+        for table in self.domains:
+            for field, domains in self.domains[table].items():
+                if domains["all"] is not None:
+                    lookup = dict()
+
+                    if isinstance(domains["all"], dict):
+                        for key, values in domains["all"].items():
+                            lookup.setdefault(str(key).lower(), values[0])
+                        values_list = domains["all"].values()
+                    else:
+                        values_list = domains["all"]
+
+                    for values in values_list:
+                        for value in values:
+                            lookup.setdefault(str(value).lower(), values[0])
+
+                    domains["lookup"] = lookup
+                    domains["categories"] = list(dict.fromkeys(lookup.values()))
+
+                    # Compile domain values into the prefix trie pattern substituted into regex function patterns.
+                    domains["regex"] = field_map_functions.domain_regex(tuple(domains["values"]))
+
         logging.info("Identifying field domain functions.")
         self.domains_funcs = list()
 
@@ -252,12 +425,157 @@ class Stage:
             if "domain" in func[1].__code__.co_varnames:
                 self.domains_funcs.append(func[0])
 
+        # Store compiled configuration cache.
+        helpers.save_config_cache("domains", cache_paths, (self.domains, self.domains_funcs))
+
+    def compile_field_mapping(self, sources=None):
+        """
+        Compiles the source attribute conform sections into a field mapping plan, once per run, optionally restricted to
+        the given sources.
+        Each target field resolves to None (no mapping), a raw value, or a chain of bound field mapping functions.
+        """
+
+        logger.info("Compiling field mapping plan.")
+        self.field_mapping = dict()
+
+        for source_name, source_attributes in self.source_attributes.items():
+            if sources is not None and source_name not in sources:
+                continue
+
+            source_fields = set(self.source_gdframes[source_name].columns)
+            self.field_mapping[source_name] = dict()
+
+            for target_name, maps in source_attributes["conform"].items():
+                self.field_mapping[source_name][target_name] = dict()
+
+                for target_field, source_field in maps.items():
+
+                    # No mapping.
+                    if source_field is None:
+                        field_plan = None
+
+                    # Raw value mapping.
+                    elif isinstance(source_field, str) and (source_field not in source_fields):
+                        field_plan = {"raw": source_field}
+
+                    # Function mapping.
+                    else:
+
+                        # Restructure dict for direct field mapping in case of string input.
+                        if isinstance(source_field, str):
+                            source_field = {"fields": [source_field], "functions": {"direct": {"param": None}}}
+
+                        # Convert single field attribute to list.
+                        fields = source_field["fields"]
+                        if isinstance(fields, str):
+                            fields = [fields]
+
+                        functions = self.compile_functions(maps, source_field["functions"], target_name, target_field)
+                        field_plan = {"fields": fields, "functions": functions,
+                                      "split_record": any(func == "split_record" for func, _ in functions)}
+
+                    self.field_mapping[source_name][target_name][target_field] = field_plan
+
+    def compile_fingerprints(self):
+        """
+        Compiles a sha256 fingerprint of the inputs of each target table: the raw files, data section and table conform
+        section of each source mapped to the table, the distribution format and field domain yamls, the stage code and
+        the uuid mode.
+        """
+
+        logger.info("Compiling target table input fingerprints.")
+
+        # Fingerprint configuration shared by all tables.
+        config_paths = [os.path.abspath("../distribution_format.yaml")] + \
+                       [os.path.abspath("../field_domains_{}.yaml".format(suffix)) for suffix in ("en", "fr")] + \
+                       [os.path.abspath(__file__), field_map_functions.__file__]
+        config = "{}:{}".format(helpers.config_fingerprint(config_paths), self.deterministic)
+
+        self.fingerprints = dict()
+
+        for source_name, source_yaml in sorted(self.source_attributes.items()):
+
+            # Fingerprint raw files, including sidecar files (i.e. shapefile .dbf) or directory contents (i.e. .gdb).
+            filename = os.path.join(self.data_path, source_yaml["data"]["filename"])
+            if os.path.isdir(filename):
+                paths = sorted(os.path.join(root, f) for root, _, files in os.walk(filename) for f in files)
+            else:
+                paths = sorted(glob.glob("{}.*".format(glob.escape(os.path.splitext(filename)[0])))) or [filename]
+
+            try:
+                raw = helpers.config_fingerprint(paths)
+            except OSError:
+                logger.exception("Unable to fingerprint source data: {}.".format(filename))
+                sys.exit(1)
+
+            # Fingerprint each table conform section.
+            for table, maps in source_yaml["conform"].items():
+                digest = hashlib.sha256(self.fingerprints.get(table, config).encode("utf8"))
+                digest.update(json.dumps([source_name, raw, source_yaml["data"], maps], sort_keys=True,
+                                         default=str).encode("utf8"))
+                self.fingerprints[table] = digest.hexdigest()
+
+    def compile_functions(self, maps, func_dict, table, field):
+        """
+        Compiles a field mapping function dictionary into a list of (function name, bound function) tuples.
+        copy_attribute_functions are expanded in place using the domain of each copied attribute.
+        """
+
+        functions = list()
+
+        for func, params in func_dict.items():
+
+            # Advanced function mapping - copy_attribute_functions.
+            if func == "copy_attribute_functions":
+
+                # Retrieve and compile attribute functions and parameters.
+                for attribute, attr_func_dict in field_map_functions.copy_attribute_functions(maps, params):
+                    functions.extend(self.compile_functions(maps, attr_func_dict, table, attribute))
+
+            else:
+
+                # Retrieve function.
+                try:
+                    field_map_function = getattr(field_map_functions, func)
+                except AttributeError:
+                    logger.exception("Invalid field mapping function: \"{}\".".format(func))
+                    sys.exit(1)
+
+                # Freeze parameters.
+                params = deepcopy(params) if params is not None else dict()
+
+                # For domain functions, add field domain to parameters: the compiled domain pattern for regex functions,
+                # otherwise the domain values.
+                domain = self.domains[table][field]["values"]
+                if func in self.domains_funcs and domain is not None:
+                    params["domain"] = self.domains[table][field]["regex"] if func.startswith("regex_") else domain
+
+                # Validate parameters against function signature.
+                try:
+                    signature(field_map_function).bind(None, **params)
+                except TypeError:
+                    logger.exception("Invalid parameters for field mapping function \"{}\": {}.".format(func, params))
+                    sys.exit(1)
+
+                functions.append((func, partial(field_map_function, **params)))
+
+        return functions
+
     def compile_source_attributes(self):
-        """Compiles the yaml files in the sources' directory into a dictionary."""
+        """
+        Compiles the yaml files in the sources' directory into a dictionary. Reuses the cached compilation if no input
+        has changed.
+        """
 
         logger.info("Identifying source attribute files.")
-        files = [os.path.join(self.source_attribute_path, f) for f in os.listdir(self.source_attribute_path) if
-                 f.endswith(".yaml")]
+        files = sorted(os.path.join(self.source_attribute_path, f) for f in os.listdir(self.source_attribute_path) if
+                       f.endswith(".yaml"))
+
+        # Load from compiled configuration cache.
+        cache_name = "source_attributes_{}".format(self.source)
+        self.source_attributes = helpers.load_config_cache(cache_name, files)
+        if self.source_attributes is not None:
+            return
 
         logger.info("Compiling source attribute yamls.")
         self.source_attributes = dict()
@@ -266,8 +584,20 @@ class Stage:
             # Load yaml and store contents.
             self.source_attributes[os.path.splitext(os.path.basename(f))[0]] = helpers.load_yaml(f)
 
+        # Store compiled configuration cache.
+        helpers.save_config_cache(cache_name, files, self.source_attributes)
+
     def compile_target_attributes(self):
-        """Compiles the target (distribution format) yaml file into a dictionary."""
+        """
+        Compiles the target (distribution format) yaml file into a dictionary. Reuses the cached compilation if no input
+        has changed.
+        """
+
+        # Load from compiled configuration cache.
+        cache_paths = [os.path.abspath("../distribution_format.yaml"), os.path.abspath(__file__)]
+        self.target_attributes = helpers.load_config_cache("target_attributes", cache_paths)
+        if self.target_attributes is not None:
+            return
 
         logger.info("Compiling target attribute yaml.")
         self.target_attributes = dict()
@@ -279,72 +609,247 @@ class Stage:
         logger.info("Compiling attributes for target tables.")
 
         for table in target_attributes_yaml:
-            self.target_attributes[table] = {"spatial": target_attributes_yaml[table]["spatial"], "fields": dict()}
+            self.target_attributes[table] = {"spatial": target_attributes_yaml[table]["spatial"], "fields": dict(),
+                                             "dtypes": dict(), "widths": dict()}
 
             for field, vals in target_attributes_yaml[table]["fields"].items():
-                # Compile field attributes.
+                # Compile field attributes: type, width and compact dtype (smallest nullable integer for int fields).
                 try:
                     self.target_attributes[table]["fields"][field] = str(vals[0])
-                except (AttributeError, KeyError, ValueError):
+                    self.target_attributes[table]["widths"][field] = int(vals[1])
+                    self.target_attributes[table]["dtypes"][field] = str(vals[0])
+                    if str(vals[0]) == "int":
+                        self.target_attributes[table]["dtypes"][field] = next(
+                            (dtype for digits, dtype in int_dtypes.items() if int(vals[1]) <= digits), "Int64")
+                except (AttributeError, IndexError, KeyError, ValueError):
                     logger.exception("Invalid schema definition for table: {}, field: {}.".format(table, field))
                     sys.exit(1)
 
-    def export_gpkg(self):
-        """Exports the target dataframes as GeoPackage layers."""
-
-        logger.info("Exporting target dataframes to GeoPackage layers.")
-
-        # TEST
-        print(self.source_gdframes["geonb_nbrn-rrnb_road-route"].columns, "\n")
-        for i in [0, 1, 2, 66053]:
-            print(self.source_gdframes["geonb_nbrn-rrnb_road-route"].values[i], "\n")
-        print("SHAPE: {}; LEN: {}".format(
-            self.source_gdframes["geonb_nbrn-rrnb_road-route"].shape[0],
-            len(self.source_gdframes["geonb_nbrn-rrnb_road-route"].index)))
-
-        print(self.target_gdframes["strplaname"].columns, "\n")
-        for i in [0, 1, 2, 66053]:
-            print(self.target_gdframes["strplaname"].values[i], "\n")
-        print("SHAPE: {}; LEN: {}".format(
-            self.target_gdframes["strplaname"].shape[0],
-            len(self.target_gdframes["strplaname"].index)))
-        sys.exit()
-        # TEST
+        # Store compiled configuration cache.
+        helpers.save_config_cache("target_attributes", cache_paths, self.target_attributes)
 
-        # Export target dataframes to GeoPackage layers.
-        helpers.export_gpkg(self.target_gdframes, self.output_path)
+    def count_source_features(self):
+        """Returns the number of features in the largest source dataset."""
 
-    def gen_source_dataframes(self):
-        """Loads input data into a geopandas dataframe."""
+        counts = list()
 
-        logger.info("Loading input data as dataframes.")
-        self.source_gdframes = dict()
-
-        for source, source_yaml in self.source_attributes.items():
-            # Configure filename attribute absolute path.
-            source_yaml["data"]["filename"] = os.path.join(self.data_path, source_yaml["data"]["filename"])
+        for source_yaml in self.source_attributes.values():
+            filename = os.path.join(self.data_path, source_yaml["data"]["filename"])
 
-            # Load source into dataframe.
             try:
-                gdf = gpd.read_file(**source_yaml["data"])
+                with fiona.open(filename, layer=source_yaml["data"]["layer"]) as src:
+                    counts.append(len(src))
             except fiona.errors.FionaValueError:
                 logger.exception("ValueError raised when importing source {}, layer={}".format(
-                    source_yaml["data"]["filename"], source_yaml["data"]["layer"]))
+                    filename, source_yaml["data"]["layer"]))
                 sys.exit(1)
 
-            # Force lowercase field names.
-            gdf.columns = map(str.lower, gdf.columns)
+        return max(counts, default=0)
+
+    def dedup_strplaname(self):
+        """
+        Collapses the strplaname records sharing a name (the hash of the strplaname_fields) into a single record per
+        unique name, keeping the first record, and assigns one nid per unique name. The strplaname nid references of the
+        linked tables (strplaname_links) are then filled in a single join on the source uuid.
+        Names exported by a previous chunk keep their nid and are not exported again.
+        """
+
+        if "strplaname" not in self.target_gdframes:
+            return
+
+        logger.info("Deduplicating strplaname records.")
+        df = self.target_gdframes["strplaname"]
+
+        # Hash names and flag the first record of each name not exported by a previous chunk.
+        hashes = helpers.hash_rows(df, [field for field in strplaname_fields if field in df.columns])
+        new = ~pd.Index(hashes).duplicated() & ~np.isin(hashes, self.strplaname_nids.index.to_numpy())
+
+        # Generate nids for the new names: name-based if deterministic, otherwise random.
+        if self.deterministic:
+            namespace = uuid.uuid5(uuid.NAMESPACE_URL, "nrn-rrn/{}/strplaname".format(self.source))
+            nids = helpers.gen_uuids_v5(namespace, list(hashes[new].astype(">u8").view("S8")))
+        else:
+            nids = helpers.gen_uuids(np.count_nonzero(new))
+        self.strplaname_nids = pd.concat([self.strplaname_nids, pd.Series(helpers.uuid_hex(nids), index=hashes[new])])
+        record_nids = self.strplaname_nids.to_numpy()[self.strplaname_nids.index.get_indexer(hashes)]
+
+        # Compile the first and last name nid of each source uuid.
+        names = pd.Series(record_nids).groupby(df["uuid"].to_numpy(), sort=False).agg(["first", "last"])
+
+        # Fill nid references, keeping mapped values.
+        for table, links in strplaname_links.items():
+            if table in self.target_gdframes:
+                gdf = self.target_gdframes[table]
+                indexer = names.index.get_indexer(gdf["uuid"])
+                for field, side in links.items():
+                    if field in gdf.columns:
+                        logger.info("Filling strplaname nid references: {}.{}.".format(table, field))
+                        values = gdf[field].to_numpy(dtype=object)
+                        nids = np.append(names[side].to_numpy(dtype=object), None)[indexer]
+                        gdf[field] = np.where(pd.isna(values), nids, values)
+
+        # Collapse records.
+        logger.info("Collapsed {} strplaname records into {} new unique names.".format(len(df), np.count_nonzero(new)))
+        self.target_gdframes["strplaname"] = df[new].assign(nid=record_nids[new])
+
+    def export_interim(self, append=False):
+        """
+        Exports the target dataframes to interim storage (GeoPackage layers or GeoParquet datasets), optionally
+        appending to existing tables.
+        """
+
+        logger.info("Exporting target dataframes to interim storage: {}.".format(self.output_path))
+
+        # Configure target field types.
+        schemas = {table: self.target_attributes[table]["fields"] for table in self.target_gdframes}
+
+        # Convert uuid keys to hexadecimal uuid strings, in place since export is the final use of the dataframes.
+        for table, gdf in self.target_gdframes.items():
+            if pd.api.types.is_integer_dtype(gdf["uuid"]):
+                gdf["uuid"] = helpers.uuid_hex(self.uuids[gdf["uuid"].to_numpy()])
+
+        # Export target dataframes.
+        helpers.export_interim(self.target_gdframes, self.output_path, schemas=schemas, append=append)
+
+    def export_fingerprints(self):
+        """Stores the target table input fingerprints of the exported tables next to the interim output."""
+
+        fingerprints = dict()
+        if os.path.exists(self.fingerprints_path):
+            with open(self.fingerprints_path, "r", encoding="utf8") as f:
+                fingerprints = json.load(f)
+
+        fingerprints.update(self.fingerprints)
+
+        with open(self.fingerprints_path, "w", encoding="utf8") as f:
+            json.dump(fingerprints, f, indent=2, sort_keys=True)
+
+    def factorize_fields(self, source_name, fields):
+        """
+        Factorizes one or more source dataframe fields into integer codes per source record and the unique values (a
+        pandas series for a single field, otherwise a pandas dataframe of unique value combinations). Nulls are kept
+        as a unique value. Results are memoized for the run.
+        """
+
+        key = (source_name, *fields)
+
+        if key not in self.factorized:
+            source_gdf = self.source_gdframes[source_name]
+
+            # Single field.
+            if len(fields) == 1:
+                codes, uniques = pd.factorize(source_gdf[fields[0]], use_na_sentinel=False)
+                uniques = pd.Series(uniques, name=fields[0]).astype(source_gdf[fields[0]].dtype)
+
+            # Multiple fields - factorize value combinations.
+            else:
+                codes = source_gdf.groupby(list(fields), dropna=False, sort=False).ngroup().to_numpy()
+                uniques = pd.DataFrame(source_gdf[list(fields)].take(np.unique(codes, return_index=True)[1]))
+                uniques = uniques.reset_index(drop=True)
+
+            logger.info("Factorized field(s) {} of {}: {} unique values from {} records.".format(
+                ", ".join(fields), source_name, len(uniques), len(codes)))
+            self.factorized[key] = (np.asarray(codes), uniques)
+
+        return self.factorized[key]
+
+    def filter_unchanged_tables(self):
+        """
+        Restricts the source conform sections to the target tables whose input fingerprint changed since the last run
+        (or whose layer is missing), such that only those tables are recomputed and their layers replaced.
+        Unless uuids are deterministic, all tables of a source are recomputed together to keep their uuids linked.
+        strplaname and its linked tables are recomputed together to keep their strplaname nid references.
+        """
+
+        if not os.path.exists(self.fingerprints_path) or not os.path.exists(self.output_path):
+            return
+
+        with open(self.fingerprints_path, "r", encoding="utf8") as f:
+            fingerprints = json.load(f)
+
+        layers = set(helpers.interim_tables(self.output_path))
+        changed = {table for table, fingerprint in self.fingerprints.items() if fingerprints.get(table) != fingerprint
+                   or table not in layers}
+
+        # Propagate changes until stable: tables of the same source (unless uuids are deterministic) and strplaname
+        # records and their nid references (strplaname_links) are recomputed together.
+        linked = {"strplaname", *strplaname_links} & set(self.fingerprints)
+        propagated = None
+        while propagated != changed:
+            propagated = set(changed)
+
+            for source_yaml in self.source_attributes.values():
+                tables = set(source_yaml["conform"])
+                if not self.deterministic and tables & changed:
+                    changed |= tables
+
+            if linked & changed:
+                changed |= linked
+
+        # Drop unchanged tables and sources without changed tables.
+        for source_name, source_yaml in list(self.source_attributes.items()):
+            source_yaml["conform"] = {table: maps for table, maps in source_yaml["conform"].items() if table in changed}
+            if not source_yaml["conform"]:
+                del self.source_attributes[source_name]
+
+        self.fingerprints = {table: self.fingerprints[table] for table in changed}
+        logger.info("Changed target tables: {}.".format(", ".join(sorted(changed)) or "None"))
+
+    def gen_source_dataframes(self, rows=None):
+        """
+        Loads input data into a geopandas dataframe.
+        Optional rows (slice) restricts the loaded features to a single chunk.
+
+        Each record is assigned a uuid, stored in self.uuids as a (count, 16) uint8 array. The uuid field of the
+        dataframes holds the integer position of the record uuid within that array, which is converted to the
+        hexadecimal uuid string on export. The loaded rows and the uuid offset of each source are kept for process pool
+        workers, which load their own inputs (see map_target_table).
+        """
+
+        logger.info("Loading input data as dataframes.")
+        self.source_gdframes, self.source_offsets, self.source_rows = dict(), dict(), rows
+        uuids = list()
+
+        for source in self.source_attributes:
+            gdf = self.load_source_dataframe(source, rows=rows)
 
             # Add uuid field.
-            gdf["uuid"] = [uuid.uuid4().hex for _ in range(len(gdf))]
+            uuids.append(self.gen_uuids(source, gdf))
+            self.source_offsets[source] = sum(map(len, uuids[:-1]))
+            gdf["uuid"] = np.arange(self.source_offsets[source], self.source_offsets[source] + len(gdf), dtype=np.int64)
 
             # Store result.
             self.source_gdframes[source] = gdf
-            logger.info("Successfully loaded dataframe for {}, layer={}.".format(
-                os.path.basename(source_yaml["data"]["filename"]), source_yaml["data"]["layer"]))
 
-    def gen_target_dataframes(self):
-        """Creates empty dataframes for all applicable output tables based on the input data field mapping."""
+        self.uuids = np.concatenate(uuids) if uuids else np.empty((0, 16), dtype=np.uint8)
+
+    def gen_uuids(self, source, gdf):
+        """
+        Generates the uuids of a source dataframe as a (count, 16) uint8 array.
+        Random (version 4) by default. If deterministic, name-based (version 5) from the source geometry (WKB) and
+        attributes within a namespace of the source, such that re-runs of the same source reproduce the same uuids.
+        """
+
+        if not self.deterministic:
+            return helpers.gen_uuids(len(gdf))
+
+        # Compile names from geometry and attributes.
+        namespace = uuid.uuid5(uuid.NAMESPACE_URL, "nrn-rrn/{}/{}".format(self.source, source))
+        attributes = gdf.drop(columns=gdf.geometry.name)
+        if len(attributes.columns):
+            attributes = pd.util.hash_pandas_object(attributes, index=False).to_numpy().astype(">u8").view("S8")
+        else:
+            attributes = np.full(len(gdf), b"", dtype="S8")
+        wkbs = shapely.to_wkb(gdf.geometry.values, hex=False)
+        names = [(wkb or b"") + attrs for wkb, attrs in zip(wkbs, attributes)]
+
+        return helpers.gen_uuids_v5(namespace, names)
+
+    def gen_target_dataframes(self, tables=None):
+        """
+        Creates empty dataframes for all applicable output tables based on the input data field mapping, optionally
+        restricted to the given tables.
+        """
 
         logger.info("Creating target dataframes for applicable tables.")
         self.target_gdframes = dict()
@@ -352,6 +857,8 @@ class Stage:
         # Retrieve target table name from source attributes.
         for source, source_yaml in self.source_attributes.items():
             for table in source_yaml["conform"]:
+                if tables is not None and table not in tables:
+                    continue
 
                 logger.info("Creating target dataframe: {}.".format(table))
 
@@ -370,38 +877,268 @@ class Stage:
 
                 # Add target field schema.
                 gdf = gdf.assign(**{field: pd.Series(dtype=dtype) for field, dtype in
-                                    self.target_attributes[table]["fields"].items()})
+                                    self.target_attributes[table]["dtypes"].items()})
 
                 # Store result.
                 self.target_gdframes[table] = gdf
                 logger.info("Successfully created target dataframe: {}.".format(table))
 
+    def load_source_dataframe(self, source, rows=None):
+        """
+        Loads the input data of a single source into a geopandas dataframe with lowercase field names.
+        Optional rows (slice) restricts the loaded features to a single chunk.
+        """
+
+        source_yaml = self.source_attributes[source]
+
+        # Configure filename attribute absolute path.
+        source_yaml["data"]["filename"] = os.path.join(self.data_path, source_yaml["data"]["filename"])
+
+        # Load source into dataframe.
+        try:
+            gdf = gpd.read_file(**source_yaml["data"], rows=rows)
+        except fiona.errors.FionaValueError:
+            logger.exception("ValueError raised when importing source {}, layer={}".format(
+                source_yaml["data"]["filename"], source_yaml["data"]["layer"]))
+            sys.exit(1)
+
+        # Force lowercase field names.
+        gdf.columns = list(map(str.lower, gdf.columns))
+
+        logger.info("Successfully loaded dataframe for {}, layer={}.".format(
+            os.path.basename(source_yaml["data"]["filename"]), source_yaml["data"]["layer"]))
+
+        return gdf
+
     def execute(self):
-        """Executes an NRN stage."""
+        """
+        Executes an NRN stage.
+        Writes a run profile report ({source}_profile.json / .csv) and, if enabled, a cProfile dump ({source}.prof) next
+        to the interim output.
+        """
+
+        # Validate output namespace. Incremental runs replace the tables of an existing output.
+        if os.path.exists(self.output_path) and not self.incremental:
+            logger.error("Output namespace already occupied: \"{}\".".format(self.output_path))
+            sys.exit(1)
+
+        output_prefix = os.path.splitext(self.output_path)[0]
+
+        # Enable cProfile.
+        if self.cprofile:
+            cprofiler = cProfile.Profile()
+            cprofiler.enable()
+
+        try:
+
+            with self.profiler.record("execute"):
+                self.execute_step(self.compile_source_attributes)
+                self.execute_step(self.compile_target_attributes)
+                self.execute_step(self.compile_domains)
+                self.execute_step(self.compile_fingerprints)
+
+                # Incremental execution - restrict to changed target tables.
+                if self.incremental:
+                    self.execute_step(self.filter_unchanged_tables)
+                    if not self.source_attributes:
+                        logger.info("No target table inputs changed, output is up to date.")
+                        return
+
+                # Chunked execution.
+                if self.chunk_size:
+                    self.execute_chunks()
+
+                else:
+                    self.execute_step(self.gen_source_dataframes)
+                    self.execute_step(self.compile_field_mapping)
+                    self.execute_step(self.gen_target_dataframes)
+                    self.execute_step(self.apply_target_mapping)
+                    self.execute_step(self.dedup_strplaname)
+                    self.execute_step(self.export_interim)
+
+                self.execute_step(self.export_fingerprints)
+
+        finally:
+
+            # Export run profile report and cProfile stats.
+            self.profiler.export("{}_profile".format(output_prefix))
+            if self.cprofile:
+                cprofiler.disable()
+                cprofiler.dump_stats("{}.prof".format(output_prefix))
+                logger.info("Writing cProfile stats: {}.prof.".format(output_prefix))
+
+    def execute_chunks(self):
+        """
+        Executes the data steps of an NRN stage on fixed-size chunks of source features, appending each chunk to the
+        interim output tables. Peak memory is bounded by the chunk size rather than the source size.
+        """
+
+        count = self.count_source_features()
+        logger.info("Processing {} features in chunks of {}.".format(count, self.chunk_size))
+
+        for start in range(0, count, self.chunk_size):
+            logger.info("Processing chunk: features {} to {}.".format(start, min(start + self.chunk_size, count)))
+
+            self.execute_step(self.gen_source_dataframes, rows=slice(start, start + self.chunk_size))
+
+            # Compile field mapping plan from the first chunk.
+            if start == 0:
+                self.execute_step(self.compile_field_mapping)
+
+            self.execute_step(self.gen_target_dataframes)
+            self.execute_step(self.apply_target_mapping)
+            self.execute_step(self.dedup_strplaname)
+
+            # Drop target dataframes from exhausted sources.
+            self.target_gdframes = {table: gdf for table, gdf in self.target_gdframes.items() if len(gdf)}
+            self.execute_step(self.export_interim, append=start > 0)
+
+    def execute_step(self, step, **kwargs):
+        """Executes a single stage step, recording it in the run profile with the number of records processed."""
+
+        with self.profiler.record(step.__name__) as record:
+            step(**kwargs)
+
+            # Count target records, or source records if no target dataframes exist yet.
+            for gdframes in ("target_gdframes", "source_gdframes"):
+                if hasattr(self, gdframes):
+                    record["rows"] = sum(map(len, getattr(self, gdframes).values()))
+                    break
+
+
+# Process pool worker state.
+worker_stage = None
+
+
+def configure_log_file(path):
+    """Adds a log file handler to the logger and returns it."""
+
+    file_handler = logging.FileHandler(path, encoding="utf8")
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(processName)s - %(levelname)s: %(message)s",
+                                                "%Y-%m-%d %H:%M:%S"))
+    logger.addHandler(file_handler)
 
-        self.compile_source_attributes()
-        self.compile_target_attributes()
-        self.compile_domains()
-        self.gen_source_dataframes()
-        self.gen_target_dataframes()
-        self.apply_field_mapping()
-        self.apply_domains()
-        self.export_gpkg()
+    return file_handler
+
+
+def execute_source(source, chunk_size=None, workers=1, cprofile=False, factorize=True, deterministic=False,
+                   incremental=False, interim_format="gpkg"):
+    """Executes an NRN stage for a single source, logging to {source}.log next to the interim output."""
+
+    stage = Stage(source, chunk_size=chunk_size, workers=workers, cprofile=cprofile, factorize=factorize,
+                  deterministic=deterministic, incremental=incremental, interim_format=interim_format)
+    file_handler = configure_log_file("{}.log".format(os.path.splitext(stage.output_path)[0]))
+
+    try:
+        logger.info("Started source: {}.".format(source))
+        stage.execute()
+        logger.info("Finished source: {}.".format(source))
+
+    finally:
+        logger.removeHandler(file_handler)
+        file_handler.close()
+
+    return source
+
+
+def init_worker(source, options, paths):
+    """
+    Initializes a target table process pool worker with a stage of the source, built from the stage options and paths
+    (attribute name: path), and compiles its configuration.
+    """
+
+    global worker_stage
+    worker_stage = Stage(source, **options)
+    for name, path in paths.items():
+        setattr(worker_stage, name, path)
+
+    worker_stage.compile_source_attributes()
+    worker_stage.compile_target_attributes()
+    worker_stage.compile_domains()
+    worker_stage.source_inputs = None
+
+
+def map_target_table(table, source_name, rows, offset):
+    """
+    Applies field mapping, field domains and field dtypes to a single target table within a process pool worker,
+    logging to {source}_{table}.log next to the interim output. Returns the target dataframe and the run profile
+    records.
+    The worker loads the rows of the table source itself, keyed by their uuid positions from the given offset, and
+    reuses them for the following tables of the same source and rows.
+    """
+
+    file_handler = configure_log_file("{}_{}.log".format(os.path.splitext(worker_stage.output_path)[0], table))
+    worker_stage.profiler = helpers.RunProfiler()
+
+    try:
+
+        # Load source dataframe and compile its field mapping plan.
+        if worker_stage.source_inputs != (source_name, rows):
+            gdf = worker_stage.load_source_dataframe(source_name, rows=rows)
+            gdf["uuid"] = np.arange(offset, offset + len(gdf), dtype=np.int64)
+            worker_stage.source_gdframes = {source_name: gdf}
+            worker_stage.source_inputs = (source_name, rows)
+            worker_stage.compile_field_mapping(sources=[source_name])
+
+        worker_stage.gen_target_dataframes(tables=[table])
+        worker_stage.apply_field_mapping(tables=[table])
+        worker_stage.apply_domains(tables=[table])
+        worker_stage.apply_dtypes(tables=[table])
+
+    finally:
+        logger.removeHandler(file_handler)
+        file_handler.close()
+
+    return worker_stage.target_gdframes[table], worker_stage.profiler.records
 
 
 @click.command()
-@click.argument("source", type=click.Choice(["ab", "bc", "mb", "nb", "nl", "ns", "nt", "nu", "on", "pe", "qc", "sk",
-                                             "yt", "parks_canada"], case_sensitive=False))
-def main(source):
-    """Executes an NRN stage."""
+@click.argument("source", nargs=-1, required=True,
+                type=click.Choice(["ab", "bc", "mb", "nb", "nl", "ns", "nt", "nu", "on", "pe", "qc", "sk", "yt",
+                                   "parks_canada"], case_sensitive=False))
+@click.option("--chunk-size", type=click.IntRange(min=1), default=None,
+              help="Process source features in chunks of this size to bound peak memory.")
+@click.option("--processes", type=click.IntRange(min=1), default=1,
+              help="Number of sources to execute concurrently.")
+@click.option("--workers", type=click.IntRange(min=1), default=1,
+              help="Number of worker processes to fan target tables out to, per source.")
+@click.option("--cprofile", is_flag=True, default=False,
+              help="Dump cProfile stats to {source}.prof next to the interim output.")
+@click.option("--factorize/--no-factorize", default=True, show_default=True,
+              help="Apply field mapping functions to unique source values only.")
+@click.option("--deterministic", is_flag=True, default=False,
+              help="Generate name-based uuids from source geometry and attributes, reproducible across runs.")
+@click.option("--incremental", is_flag=True, default=False,
+              help="Recompute only the target tables whose source files or configuration changed since the last run.")
+@click.option("--interim-format", type=click.Choice(["gpkg", "parquet"]), default="gpkg", show_default=True,
+              help="Interim storage format: a GeoPackage, or a directory of columnar GeoParquet datasets.")
+def main(source, chunk_size, processes, workers, cprofile, factorize, deterministic, incremental, interim_format):
+    """Executes an NRN stage for one or more sources."""
 
     logger.info("Started.")
 
-    stage = Stage(source)
-    stage.execute()
+    # Single source.
+    if len(source) == 1:
+        stage = Stage(source[0], chunk_size=chunk_size, workers=workers, cprofile=cprofile, factorize=factorize,
+                      deterministic=deterministic, incremental=incremental, interim_format=interim_format)
+        stage.execute()
+
+    # Multiple sources.
+    else:
+        sources = list(dict.fromkeys(map(str.lower, source)))
+        logger.info("Executing {} sources with {} processes: {}.".format(len(sources), processes, ", ".join(sources)))
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for completed in executor.map(partial(execute_source, chunk_size=chunk_size, workers=workers,
+                                                  cprofile=cprofile, factorize=factorize,
+                                                  deterministic=deterministic, incremental=incremental,
+                                                  interim_format=interim_format), sources):
+                logger.info("Completed source: {}.".format(completed))
 
     logger.info("Finished.")
 
+
 if __name__ == "__main__":
     try:
 
@@ -0,0 +1,243 @@
+import click
+import geopandas as gpd
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shapely
+import sys
+
+sys.path.insert(1, os.path.join(sys.path[0], ".."))
+import helpers
+
+
+# Set logger.
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
+logger.addHandler(handler)
+
+
+class Stage:
+    """Defines an NRN stage."""
+
+    def __init__(self, source, tolerance=1e-7, boundary=None, boundary_distance=1e-4, tile_size=None, workers=1):
+        self.stage = 2
+        self.source = source.lower()
+        self.tolerance = tolerance
+        self.boundary_path = boundary
+        self.boundary_distance = boundary_distance
+        self.tile_size = tile_size
+        self.workers = workers
+
+        # Configure and validate input data path.
+        self.data_path = helpers.interim_path(self.source)
+        if self.data_path is None:
+            logger.error("Input data not found: \"{}\".".format(os.path.join(helpers.interim_data_path, self.source)))
+            sys.exit(1)
+
+    def classify_junctions(self):
+        """
+        Classifies the junction type of each node from the roadseg and ferryseg endpoints meeting at it, in order of
+        precedence: NatProvTer (within the boundary distance of the boundary), Ferry (any ferryseg endpoint), Dead End
+        (a single roadseg endpoint), Intersection (three or more roadseg endpoints). Other nodes (two roadseg endpoints,
+        i.e. pseudo-nodes between consecutive road elements) are not junctions and are classified as 0.
+        """
+
+        logger.info("Classifying junction types.")
+
+        count = len(self.node_coords)
+        degree = np.bincount(self.endpoint_nodes, minlength=count)
+        ferries = np.bincount(self.endpoint_nodes, weights=self.endpoint_ferry, minlength=count)
+
+        # Classify junction types by degree and ferry connections.
+        self.junctypes = np.select([ferries > 0, degree == 1, degree >= 3], [3, 2, 1], default=0)
+
+        # Classify boundary junctions.
+        if self.boundary is not None:
+            nodes = shapely.STRtree(shapely.points(self.node_coords))
+            _, indexes = nodes.query(self.boundary, predicate="dwithin", distance=self.boundary_distance)
+            self.junctypes[np.unique(indexes)] = 4
+
+        for code, label in self.junctype_domain.items():
+            logger.info("Junction type {}: {} junctions.".format(label, np.count_nonzero(self.junctypes == code)))
+        logger.info("Excluded {} pseudo-nodes.".format(np.count_nonzero(self.junctypes == 0)))
+
+    def compile_target_attributes(self):
+        """
+        Compiles the junction table schema and junction type domain from the distribution format and field domains.
+        """
+
+        logger.info("Compiling target attributes.")
+
+        try:
+            self.fields = {field: dtypes[0] for field, dtypes in
+                           helpers.load_yaml("../distribution_format.yaml")["junction"]["fields"].items()}
+            self.junctype_domain = helpers.load_yaml("../field_domains_en.yaml")["junction"]["junctype"]
+
+        except (KeyError, TypeError):
+            logger.exception("Invalid junction schema definition.")
+            sys.exit(1)
+
+    def export_interim(self):
+        """Exports the junction dataframe to interim storage, replacing any existing junction table."""
+
+        logger.info("Exporting junction dataframe to interim storage.")
+
+        helpers.export_interim({"junction": self.junction}, self.data_path, schemas={"junction": self.fields})
+
+    def gen_junctions(self):
+        """
+        Generates the junction dataframe: one point per classified node (excluding pseudo-nodes), with the metadata
+        attributes of the first roadseg or ferryseg record meeting at it, the first available roadseg exit number and a
+        new nid.
+        """
+
+        logger.info("Generating junctions.")
+
+        attributes = pd.concat([self.dframes[table].drop(columns=self.dframes[table].geometry.name) for table in
+                                self.dframes], ignore_index=True)
+
+        # Retrieve the attributes of the first segment meeting at each node.
+        _, firsts = np.unique(self.endpoint_nodes, return_index=True)
+        fields = [field for field in self.fields if field in attributes.columns and field not in ("exitnbr", "nid")]
+        junction = attributes[fields].take(self.endpoint_segments[firsts]).reset_index(drop=True)
+
+        # Retrieve the first available exit number at each node.
+        if "exitnbr" in attributes.columns:
+            exitnbr = attributes["exitnbr"].take(self.endpoint_segments).to_numpy()
+            available = ~(pd.isna(exitnbr) | np.isin(exitnbr, ["", "None"]))
+            junction["exitnbr"] = pd.Series(exitnbr[available]).groupby(self.endpoint_nodes[available]).first()
+            junction["exitnbr"] = junction["exitnbr"].fillna("None")
+
+        # Exclude pseudo-nodes.
+        junctions = np.flatnonzero(self.junctypes > 0)
+        junction = junction.take(junctions).reset_index(drop=True)
+
+        # Assign junction types and nids.
+        junction["junctype"] = pd.Series(self.junctypes[junctions]).map(self.junctype_domain)
+        junction["nid"] = helpers.uuid_hex(helpers.gen_uuids(len(junction)))
+
+        self.junction = gpd.GeoDataFrame(junction.reindex(columns=list(self.fields)),
+                                         geometry=shapely.points(self.node_coords[junctions]), crs=self.crs)
+
+    def gen_nodes(self):
+        """
+        Derives the network nodes from the roadseg and ferryseg endpoints, grouping endpoints within the tolerance of
+        each other into a single node.
+        """
+
+        logger.info("Deriving nodes from roadseg and ferryseg endpoints.")
+
+        coords, segments, ferry = list(), list(), list()
+        offset = 0
+
+        for table, df in self.dframes.items():
+            first, last = helpers.endpoints(df.geometry.values)
+
+            # Exclude missing geometries.
+            valid = np.flatnonzero(~np.isnan(first).any(axis=1))
+            coords.extend([first[valid], last[valid]])
+            segments.extend([valid + offset, valid + offset])
+            ferry.append(np.full(len(valid) * 2, table == "ferryseg"))
+            offset += len(df)
+
+        self.endpoint_segments = np.concatenate(segments)
+        self.endpoint_ferry = np.concatenate(ferry)
+        self.endpoint_nodes, self.node_coords = helpers.gen_nodes(np.concatenate(coords), self.tolerance,
+                                                                  tile_size=self.tile_size, workers=self.workers)
+
+        logger.info("Derived {} nodes from {} endpoints.".format(len(self.node_coords), len(self.endpoint_nodes)))
+
+    def load_boundary(self):
+        """Loads the optional boundary dataset as an array of boundary lines in the input data coordinate system."""
+
+        self.boundary = None
+
+        if self.boundary_path is None:
+            logger.warning("No boundary provided, NatProvTer junctions will not be identified.")
+            return
+
+        logger.info("Loading boundary: {}.".format(self.boundary_path))
+
+        try:
+            boundary = gpd.read_file(self.boundary_path).to_crs(self.crs)
+        except (OSError, ValueError):
+            logger.exception("Unable to load boundary: {}.".format(self.boundary_path))
+            sys.exit(1)
+
+        self.boundary = shapely.boundary(boundary.geometry.values)
+        self.boundary = self.boundary[~shapely.is_empty(self.boundary)]
+
+    def load_interim(self):
+        """
+        Loads the roadseg and, if available, ferryseg tables of the interim data into dataframes, restricted to the
+        junction attributes.
+        """
+
+        logger.info("Loading input data as dataframes.")
+        self.dframes = dict()
+
+        tables = helpers.interim_tables(self.data_path)
+        if "roadseg" not in tables:
+            logger.error("Input data does not contain a roadseg table: \"{}\".".format(self.data_path))
+            sys.exit(1)
+
+        for table in ("roadseg", "ferryseg"):
+            if table in tables:
+                self.dframes[table] = helpers.load_interim(self.data_path, table, columns=list(self.fields))
+                logger.info("Successfully loaded dataframe for {}: {} records.".format(table, len(self.dframes[table])))
+
+        self.crs = self.dframes["roadseg"].crs
+
+        # Align ferryseg coordinate system.
+        if "ferryseg" in self.dframes:
+            self.dframes["ferryseg"] = self.dframes["ferryseg"].to_crs(self.crs)
+
+    def execute(self):
+        """Executes an NRN stage."""
+
+        self.compile_target_attributes()
+        self.load_interim()
+        self.load_boundary()
+        self.gen_nodes()
+        self.classify_junctions()
+        self.gen_junctions()
+        self.export_interim()
+
+
+@click.command()
+@click.argument("source", type=click.Choice(["ab", "bc", "mb", "nb", "nl", "ns", "nt", "nu", "on", "pe", "qc", "sk",
+                                             "yt", "parks_canada"], case_sensitive=False))
+@click.option("--tolerance", type=click.FloatRange(min=0), default=1e-7, show_default=True,
+              help="Distance (input coordinate system units) within which endpoints form a single junction.")
+@click.option("--boundary", type=click.Path(exists=True, dir_okay=True),
+              help="Dataset of the source boundary polygon(s), used to identify NatProvTer junctions.")
+@click.option("--boundary-distance", type=click.FloatRange(min=0), default=1e-4, show_default=True,
+              help="Distance (input coordinate system units) from the boundary of NatProvTer junctions.")
+@click.option("--tile-size", type=click.FloatRange(min=0, min_open=True), default=None,
+              help="Tile size (input coordinate system units) to split tolerance queries across worker processes.")
+@click.option("--workers", type=click.IntRange(min=1), default=1,
+              help="Number of worker processes to fan tiles out to.")
+def main(source, tolerance, boundary, boundary_distance, tile_size, workers):
+    """Executes an NRN stage."""
+
+    logger.info("Started.")
+
+    stage = Stage(source, tolerance=tolerance, boundary=boundary, boundary_distance=boundary_distance,
+                  tile_size=tile_size, workers=workers)
+    stage.execute()
+
+    logger.info("Finished.")
+
+
+if __name__ == "__main__":
+    try:
+
+        main()
+
+    except KeyboardInterrupt:
+        logger.exception("KeyboardInterrupt: exiting program.")
+        sys.exit(1)
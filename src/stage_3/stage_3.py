@@ -0,0 +1,356 @@
+import click
+import geopandas as gpd
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shapely
+import sys
+
+sys.path.insert(1, os.path.join(sys.path[0], ".."))
+import helpers
+
+
+# Set logger.
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
+logger.addHandler(handler)
+
+# Effects, in order of priority among the records sharing a nid.
+effects = ["Addition", "Geometric Modification", "Descriptive Modification", "Confirmation"]
+
+
+class Stage:
+    """Defines an NRN stage."""
+
+    def __init__(self, source, previous=None, tolerance=1e-7, new_tables=None):
+        self.stage = 3
+        self.source = source.lower()
+        self.tolerance = tolerance
+        self.new_tables = set(new_tables or [])
+
+        # Configure and validate input data paths.
+        self.data_path = helpers.interim_path(self.source) or os.path.join(helpers.interim_data_path, self.source)
+        self.previous_path = os.path.abspath(previous or "../../data/processed/{}.gpkg".format(self.source))
+        for path in (self.data_path, self.previous_path):
+            if not os.path.exists(path):
+                logger.error("Input data not found: \"{}\".".format(path))
+                sys.exit(1)
+
+    def assign_nids(self, df, matched, previous_nids):
+        """
+        Returns the nids of the current records: the previous nid of matched records, otherwise a single nid per group
+        of records sharing a current nid. Groups with a matched record take its conserved nid, other groups are assigned
+        a new nid. Records without a current nid (i.e. stage 1 output) each form their own group.
+        """
+
+        # Group records by current nid, numbering records without a nid as their own groups.
+        groups, _ = pd.factorize(df["nid"])
+        missing = groups < 0
+        groups[missing] = groups.max(initial=-1) + 1 + np.arange(missing.sum())
+
+        # Conserve matched nids and extend them to the other records of their group.
+        nids = np.full(len(df), None, dtype=object)
+        nids[matched >= 0] = np.asarray(previous_nids, dtype=object)[matched[matched >= 0]]
+        nids = pd.Series(nids).groupby(groups).transform("first").to_numpy(dtype=object)
+
+        # Assign new nids to unmatched groups.
+        unmatched = pd.isna(nids)
+        new_groups, codes = np.unique(groups[unmatched], return_inverse=True)
+        nids[unmatched] = helpers.uuid_hex(helpers.gen_uuids(len(new_groups)))[codes.ravel()]
+
+        return nids
+
+    def conserve_nids(self):
+        """
+        Assigns the conserved nids to the current dataframes and rewrites every nid reference field (i.e.
+        roadseg.adrangenid, addrange.l_offnanid) from the current nids to the conserved nids.
+        """
+
+        logger.info("Conserving nids.")
+
+        # Compile nid mapping across all tables, nids are unique across tables.
+        mapping = pd.concat([pd.Series(self.nids[table], index=self.dframes[table]["nid"].to_numpy()) for table in
+                             self.nids], ignore_index=False)
+        mapping = mapping[mapping.index.notna() & ~mapping.index.duplicated()]
+
+        for table, df in self.dframes.items():
+            df["nid"] = self.nids[table]
+
+            for field in [field for field in df.columns if field.endswith("nid") and field != "nid"]:
+                mapped = df[field].map(mapping)
+                if mapped.notna().any():
+                    logger.info("Rewriting nid references: {}.{}.".format(table, field))
+                    df[field] = mapped.fillna(df[field])
+
+    def detect_changes(self):
+        """
+        Assigns the change management effect of each current record against the previous release, conserving the nids
+        of matched records:
+        1) Confirmation: identical geometry (WKB hash) and attributes (row hash).
+        2) Descriptive Modification: identical geometry, different attributes.
+        3) Geometric Modification: different geometry but the same junctions (both endpoints within the tolerance) for
+           linear elements, or the same location within the tolerance for point features. Only records unmatched by
+           hash are compared, via STRtree queries.
+        4) Addition: unmatched current records, assigned a new nid per current nid group (see assign_nids). Unmatched
+           records sharing a current nid with a matched record take its conserved nid, as a Geometric Modification.
+        5) Retirement: unmatched previous records, keeping their nid.
+        Tables without geometry are matched by row hash only. nid and uuid fields are excluded from the row hash.
+        The records sharing a nid (segmented data) are assigned a single effect, by priority.
+        """
+
+        logger.info("Detecting changes.")
+
+        self.nids, changes = dict(), list()
+
+        for table in sorted(set(self.dframes) | set(self.previous)):
+            logger.info("Detecting changes for {}.".format(table))
+
+            df = self.dframes.get(table)
+            previous = self.previous.get(table)
+
+            # Table retirement.
+            if df is None:
+                changes.append(pd.DataFrame({"table": table, "nid": previous["nid"].unique(), "effect": "Retirement"}))
+                continue
+
+            # Table addition.
+            if previous is None:
+                self.nids[table] = self.assign_nids(df, np.full(len(df), -1), [])
+                changes.append(pd.DataFrame({"table": table, "nid": pd.unique(self.nids[table]), "effect": "Addition"}))
+                continue
+
+            # Compile row and geometry hashes.
+            spatial = isinstance(df, gpd.GeoDataFrame)
+            fields = [field for field in df.columns if field in previous.columns and field != "uuid" and not
+                      field.endswith("nid") and not (spatial and field == df.geometry.name)]
+            rows, previous_rows = helpers.hash_rows(df, fields), helpers.hash_rows(previous, fields)
+            matched = np.full(len(df), -1)
+            effect = np.full(len(df), "Addition", dtype=object)
+
+            if spatial:
+                wkbs = shapely.to_wkb(df.geometry.values)
+                previous_wkbs = shapely.to_wkb(previous.geometry.values)
+                geoms, previous_geoms = pd.util.hash_array(wkbs), pd.util.hash_array(previous_wkbs)
+
+                # Match identical geometries and attributes, then identical geometries.
+                # Geometry hash matches are verified against the WKB.
+                for name, keys, previous_keys in (("Confirmation", (geoms, rows), (previous_geoms, previous_rows)),
+                                                  ("Descriptive Modification", (geoms,), (previous_geoms,))):
+                    current, prior = match_keys(keys, previous_keys, matched)
+                    identical = wkbs[current] == previous_wkbs[prior]
+                    matched[current[identical]], effect[current[identical]] = prior[identical], name
+
+                # Match the remaining geometries by location.
+                current, prior = self.match_locations(df, previous, matched, linear=table in ("ferryseg", "roadseg"))
+                matched[current], effect[current] = prior, "Geometric Modification"
+
+            else:
+
+                # Match identical attributes.
+                current, prior = match_keys((rows,), (previous_rows,), matched)
+                matched[current], effect[current] = prior, "Confirmation"
+
+            # Conserve matched nids and assign new nids to additions. Unmatched records taking the conserved nid of
+            # their group extend the geometry of a previous element.
+            nids = self.assign_nids(df, matched, previous["nid"])
+            effect[(matched < 0) & np.isin(nids, previous["nid"].to_numpy())] = "Geometric Modification"
+            self.nids[table] = nids
+
+            # Assign a single effect per nid, by priority.
+            effect = pd.Series(pd.Categorical(effect, categories=effects, ordered=True)).groupby(
+                nids, observed=True, dropna=False)
+            effect = effect.min().astype(str)
+
+            # Retire the unmatched previous records whose nid was not conserved.
+            retired = previous["nid"].take(np.setdiff1d(np.arange(len(previous)), matched[matched >= 0])).unique()
+            retired = retired[~np.isin(retired, nids)]
+
+            table_changes = pd.concat([pd.DataFrame({"nid": effect.index, "effect": effect.to_numpy()}),
+                                       pd.DataFrame({"nid": retired, "effect": "Retirement"})]).assign(table=table)
+            changes.append(table_changes)
+
+            for name, count in table_changes["effect"].value_counts().items():
+                logger.info("{}: {} nids.".format(name, count))
+
+        self.changes = pd.concat(changes, ignore_index=True)[["table", "nid", "effect"]]
+
+    def export_interim(self):
+        """
+        Exports the current dataframes with conserved nids, replacing their interim tables, and the change effects as
+        the changes table.
+        """
+
+        logger.info("Exporting dataframes to interim storage.")
+
+        helpers.export_interim({**self.dframes, "changes": self.changes}, self.data_path,
+                               schemas={table: self.fields[table] for table in self.dframes if table in self.fields})
+
+    def load_data(self):
+        """
+        Loads the distribution format tables of the current (interim GeoPackage or GeoParquet) and previous release
+        data. Previous release layers are resolved by table name (see match_layers), every current table requires a
+        previous release layer unless flagged as a new table.
+        """
+
+        logger.info("Loading input data as dataframes.")
+
+        distribution_format = helpers.load_yaml("../distribution_format.yaml")
+        self.fields = {table: {field: dtypes[0] for field, dtypes in attributes["fields"].items()} for table, attributes
+                       in distribution_format.items()}
+        self.dframes, self.previous = dict(), dict()
+
+        # Resolve current and previous release layers.
+        current_layers = {table: table for table in helpers.interim_tables(self.data_path) if table in self.fields}
+        previous_layers = match_layers(helpers.interim_tables(self.previous_path), self.fields)
+
+        # Validate previous release layers.
+        missing = sorted(set(current_layers) - set(previous_layers) - self.new_tables)
+        if missing:
+            logger.error("Previous release \"{}\" contains no layer for table(s): {}. Tables without a previous "
+                         "release must be flagged as new tables.".format(self.previous_path, ", ".join(missing)))
+            sys.exit(1)
+
+        for path, layers, dframes in ((self.data_path, current_layers, self.dframes),
+                                      (self.previous_path, previous_layers, self.previous)):
+            for table, layer in layers.items():
+                df = helpers.load_interim(path, layer, geometry=distribution_format[table]["spatial"])
+
+                dframes[table] = df
+                logger.info("Successfully loaded dataframe for {}, layer={}: {} records.".format(
+                    os.path.basename(path), layer, len(df)))
+
+        # Align previous coordinate systems.
+        for table, df in self.previous.items():
+            if isinstance(df, gpd.GeoDataFrame) and isinstance(self.dframes.get(table), gpd.GeoDataFrame):
+                self.previous[table] = df.to_crs(self.dframes[table].crs)
+
+    def match_locations(self, df, previous, matched, linear=False):
+        """
+        Matches the unmatched current and previous geometries by location via an STRtree of the previous geometries:
+        both endpoints within the tolerance (in either direction) for linear elements, otherwise the representative
+        point within the tolerance. Each record is matched at most once, closest first. Returns the (current, previous)
+        index arrays.
+        """
+
+        current = np.flatnonzero(matched < 0)
+        prior = np.setdiff1d(np.arange(len(previous)), matched[matched >= 0])
+        if not len(current) or not len(prior):
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+        # Linear elements - compare junction (endpoint) locations.
+        if linear:
+            first, last = helpers.endpoints(df.geometry.values[current])
+            prior_first, prior_last = helpers.endpoints(previous.geometry.values[prior])
+
+            # Query current first endpoints against previous first and last endpoints.
+            tree = shapely.STRtree(shapely.points(np.concatenate([prior_first, prior_last])))
+            queried, hits = tree.query(shapely.points(first), predicate="dwithin", distance=self.tolerance)
+            candidates, reverse = hits % len(prior), hits >= len(prior)
+
+            # Validate opposite endpoints, each within the tolerance, and rank candidates by their summed distances.
+            opposite = np.where(reverse[:, None], prior_first[candidates], prior_last[candidates])
+            opposite_distance = np.hypot(*(last[queried] - opposite).T)
+            distance = opposite_distance + np.hypot(*(first[queried] - np.where(
+                reverse[:, None], prior_last[candidates], prior_first[candidates])).T)
+            valid = opposite_distance <= self.tolerance
+
+        # Other geometries - compare representative point locations.
+        else:
+            points = shapely.point_on_surface(df.geometry.values[current])
+            prior_points = shapely.point_on_surface(previous.geometry.values[prior])
+            queried, candidates = shapely.STRtree(prior_points).query(points, predicate="dwithin",
+                                                                      distance=self.tolerance)
+            distance = shapely.distance(points[queried], prior_points[candidates])
+            valid = np.ones(len(queried), dtype=bool)
+
+        # Match each record at most once, closest first.
+        pairs = pd.DataFrame({"current": queried[valid], "prior": candidates[valid], "distance": distance[valid]})
+        pairs = pairs.sort_values("distance", kind="stable").drop_duplicates("current").drop_duplicates("prior")
+
+        return current[pairs["current"].to_numpy()], prior[pairs["prior"].to_numpy()]
+
+    def execute(self):
+        """Executes an NRN stage."""
+
+        self.load_data()
+        self.detect_changes()
+        self.conserve_nids()
+        self.export_interim()
+
+
+def match_keys(keys, previous_keys, matched):
+    """
+    Matches the unmatched current and previous records with equal hash keys (tuples of uint64 arrays), pairing repeated
+    keys by occurrence. Returns the (current, previous) index arrays.
+    """
+
+    current = pd.DataFrame({index: key for index, key in enumerate(keys)}).assign(current=np.arange(len(matched)))
+    current = current[matched < 0]
+    prior = pd.DataFrame({index: key for index, key in enumerate(previous_keys)})
+    prior = prior.assign(prior=np.arange(len(prior))).drop(index=matched[matched >= 0])
+
+    # Number repeated keys by occurrence.
+    columns = list(range(len(keys)))
+    for df in (current, prior):
+        df["occurrence"] = df.groupby(columns).cumcount()
+
+    pairs = current.merge(prior, on=columns + ["occurrence"])
+
+    return pairs["current"].to_numpy(), pairs["prior"].to_numpy()
+
+
+def match_layers(layers, tables):
+    """
+    Matches layer names to table names, case-insensitively, by name or by "_{table}" suffix (i.e. published release
+    layers, NRN_<PRCODE>_<major>_<minor>_<LAYER>). Returns a dictionary of table names to layer names. Exits if multiple
+    layers match a table.
+    """
+
+    matches = dict()
+
+    for layer in layers:
+        for table in tables:
+            if layer.lower() == table.lower() or layer.lower().endswith("_{}".format(table.lower())):
+                matches.setdefault(table, list()).append(layer)
+
+    ambiguous = {table: names for table, names in matches.items() if len(names) > 1}
+    if ambiguous:
+        logger.error("Multiple layers match table(s): {}.".format("; ".join(
+            "{}: {}".format(table, ", ".join(names)) for table, names in ambiguous.items())))
+        sys.exit(1)
+
+    return {table: names[0] for table, names in matches.items()}
+
+
+@click.command()
+@click.argument("source", type=click.Choice(["ab", "bc", "mb", "nb", "nl", "ns", "nt", "nu", "on", "pe", "qc", "sk",
+                                             "yt", "parks_canada"], case_sensitive=False))
+@click.option("--previous", type=click.Path(exists=True, dir_okay=False),
+              help="Previous release GeoPackage. Defaults to data/processed/{source}.gpkg.")
+@click.option("--tolerance", type=click.FloatRange(min=0), default=1e-7, show_default=True,
+              help="Distance (input coordinate system units) within which junctions / points are considered unmoved.")
+@click.option("--new-table", "new_tables", multiple=True,
+              help="Table absent from the previous release, whose records are all additions. Repeatable.")
+def main(source, previous, tolerance, new_tables):
+    """Executes an NRN stage."""
+
+    logger.info("Started.")
+
+    stage = Stage(source, previous=previous, tolerance=tolerance, new_tables=new_tables)
+    stage.execute()
+
+    logger.info("Finished.")
+
+
+if __name__ == "__main__":
+    try:
+
+        main()
+
+    except KeyboardInterrupt:
+        logger.exception("KeyboardInterrupt: exiting program.")
+        sys.exit(1)
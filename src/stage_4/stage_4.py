@@ -0,0 +1,398 @@
+import click
+import geopandas as gpd
+import logging
+import numpy as np
+import os
+import pandas as pd
+import shapely
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(1, os.path.join(sys.path[0], ".."))
+import addranges
+import helpers
+
+
+# Set logger.
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+handler = logging.StreamHandler(sys.stdout)
+handler.setLevel(logging.INFO)
+handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s: %(message)s", "%Y-%m-%d %H:%M:%S"))
+logger.addHandler(handler)
+
+# Validation flags and their descriptions, in report order.
+flags = {
+    "duplicate": "Identical geometry to another segment, in either direction.",
+    "overlap": "Shares a linear section with another segment.",
+    "self_intersection": "Intersects itself.",
+    "zero_length": "Zero length or empty geometry.",
+    "short": "Shorter than the minimum length.",
+    "dangle": "Unconnected endpoint within the dangle distance of another segment.",
+    "closed_loop": "Starts and ends at the same junction."
+}
+
+# Address range validation flags and their descriptions, in report order (see addranges.validate_addranges).
+addrange_flags = {
+    "l_parity": "Left house numbers do not match the left structure type parity.",
+    "r_parity": "Right house numbers do not match the right structure type parity.",
+    "l_order": "Left first house number exceeds the last, given the left digitizing direction.",
+    "r_order": "Right first house number exceeds the last, given the right digitizing direction.",
+    "l_overlap": "Left house numbers overlap another range on the same street and place.",
+    "r_overlap": "Right house numbers overlap another range on the same street and place."
+}
+
+# Output table schemas.
+schemas = {
+    "validation": {"table": "str", "uuid": "str", "nid": "str", "flag": "str", "description": "str", "related": "str"},
+    "addrange_validation": {"nid": "str", "datasetnam": "str", "flag": "str", "description": "str", "related": "str"},
+    "addrange_summary": {"datasetnam": "str", "records": "int", **{flag: "int" for flag in addrange_flags},
+                         "flagged": "int"}
+}
+
+# Addrange fields required for address range validation.
+addrange_fields = ["nid", "datasetnam"] + ["{}_{}".format(side, field) for side in ("l", "r") for field in
+                                           ("hnumf", "hnuml", "hnumstr", "digdirfg", "offnanid")]
+
+
+class Stage:
+    """Defines an NRN stage."""
+
+    def __init__(self, source, tolerance=1e-7, min_length=1e-7, dangle_distance=1e-5, tile_size=None, workers=1):
+        self.stage = 4
+        self.source = source.lower()
+        self.tolerance = tolerance
+        self.min_length = min_length
+        self.dangle_distance = dangle_distance
+        self.tile_size = tile_size
+        self.workers = workers
+        self.outputs = dict()
+
+        # Configure and validate input data path.
+        self.data_path = helpers.interim_path(self.source)
+        if self.data_path is None:
+            logger.error("Input data not found: \"{}\".".format(os.path.join(helpers.interim_data_path, self.source)))
+            sys.exit(1)
+
+    def export_interim(self):
+        """Exports the generated output tables (see schemas) to interim storage, replacing any existing ones."""
+
+        logger.info("Exporting flagged features to interim storage.")
+
+        helpers.export_interim(self.outputs, self.data_path, schemas={table: schemas[table] for table in self.outputs})
+
+    def flag(self, flagged, indexes, related=None):
+        """
+        Records a validation flag for the given segment indexes (positions within the combined segment arrays), with
+        the optional indexes of the related segments.
+        """
+
+        indexes = np.asarray(indexes, dtype=np.int64)
+        related = np.full(len(indexes), -1) if related is None else np.asarray(related, dtype=np.int64)
+
+        self.flagged.append(pd.DataFrame({"segment": indexes, "flag": flagged, "related": related}))
+
+    def gen_validation(self):
+        """
+        Generates the validation dataframe of the flagged features: one record per segment, flag and related segment,
+        with the segment geometry, uuid and nid, and the uuid of the related segment.
+        """
+
+        logger.info("Generating flagged features.")
+
+        flagged = pd.concat(self.flagged, ignore_index=True).drop_duplicates()
+        flagged["flag"] = pd.Categorical(flagged["flag"], categories=list(flags), ordered=True)
+        flagged = flagged.sort_values(["flag", "segment", "related"], kind="stable")
+
+        # Compile segment attributes.
+        attributes = pd.concat([pd.DataFrame(df.drop(columns=df.geometry.name)) for df in self.dframes.values()],
+                               ignore_index=True).reindex(columns=["uuid", "nid"])
+        uuids = np.append(attributes["uuid"].to_numpy(dtype=object), None)
+        segments, related = flagged["segment"].to_numpy(), flagged["related"].to_numpy()
+
+        self.outputs["validation"] = gpd.GeoDataFrame({
+            "table": self.tables[segments],
+            "uuid": uuids[segments],
+            "nid": attributes["nid"].to_numpy(dtype=object)[segments],
+            "flag": flagged["flag"].astype(str).to_numpy(),
+            "description": flagged["flag"].map(flags).astype(str).to_numpy(),
+            "related": uuids[related]
+        }, geometry=self.geoms[segments], crs=self.crs)
+
+        for table in self.dframes:
+            counts = flagged["flag"][self.tables[segments] == table].value_counts(sort=False)
+            for flag, count in counts[counts > 0].items():
+                logger.info("Validation {}: {} {} flag(s).".format(table, count, flag))
+
+    def load_interim(self):
+        """
+        Loads the roadseg and, if available, ferryseg tables of the interim data as combined segment arrays, and the
+        addrange table, if available, without geometry.
+        """
+
+        logger.info("Loading input data as dataframes.")
+        self.dframes = dict()
+
+        tables = helpers.interim_tables(self.data_path)
+        if "roadseg" not in tables:
+            logger.error("Input data does not contain a roadseg table: \"{}\".".format(self.data_path))
+            sys.exit(1)
+
+        for table in ("roadseg", "ferryseg"):
+            if table in tables:
+                self.dframes[table] = helpers.load_interim(self.data_path, table, columns=["uuid", "nid"])
+                logger.info("Successfully loaded dataframe for {}: {} records.".format(table, len(self.dframes[table])))
+
+        self.addrange = None
+        if "addrange" in tables:
+            self.addrange = helpers.load_interim(self.data_path, "addrange", columns=addrange_fields, geometry=False)
+            logger.info("Successfully loaded dataframe for addrange: {} records.".format(len(self.addrange)))
+
+        self.crs = self.dframes["roadseg"].crs
+
+        # Align ferryseg coordinate system.
+        if "ferryseg" in self.dframes:
+            self.dframes["ferryseg"] = self.dframes["ferryseg"].to_crs(self.crs)
+
+        # Combine segments, keeping the table of each segment.
+        self.tables = np.concatenate([np.full(len(df), table, dtype=object) for table, df in self.dframes.items()])
+        self.geoms = np.concatenate([np.asarray(df.geometry.values) for df in self.dframes.values()])
+        self.flagged = list()
+
+    def validate_addranges(self):
+        """
+        Flags inconsistent address ranges: parity against the structure type, first to last order and overlaps with
+        other ranges on the same street and place (see addranges.validate_addranges). Generates the addrange_validation
+        dataframe (one record per address range and flag, with the nid of the overlapping range) and the
+        addrange_summary dataframe (record and flag counts by province, see addranges.summarize_addranges).
+        """
+
+        if self.addrange is None:
+            return
+
+        logger.info("Validating address ranges.")
+
+        df = self.addrange.reindex(columns=addrange_fields)
+        validated = addranges.validate_addranges(df)
+
+        # Compile flagged address ranges.
+        records = list()
+        for flag in addrange_flags:
+            indexes = np.flatnonzero(validated[flag].to_numpy())
+            related = validated["{}_overlap_nid".format(flag[0])].to_numpy(dtype=object)[indexes] \
+                if flag.endswith("overlap") else np.full(len(indexes), None, dtype=object)
+            records.append(pd.DataFrame({"index": indexes, "flag": flag, "related": related}))
+
+        flagged = pd.concat(records, ignore_index=True)
+        self.outputs["addrange_validation"] = pd.DataFrame({
+            "nid": df["nid"].to_numpy(dtype=object)[flagged["index"].to_numpy()],
+            "datasetnam": df["datasetnam"].to_numpy(dtype=object)[flagged["index"].to_numpy()],
+            "flag": flagged["flag"].to_numpy(dtype=object),
+            "description": flagged["flag"].map(addrange_flags).to_numpy(dtype=object),
+            "related": flagged["related"].to_numpy(dtype=object)
+        })
+
+        # Summarize flag counts by province.
+        summary = addranges.summarize_addranges(validated, df["datasetnam"].fillna("Unknown").rename("datasetnam"))
+        self.outputs["addrange_summary"] = summary.reset_index()[list(schemas["addrange_summary"])]
+        for datasetnam, counts in summary.iterrows():
+            details = ", ".join("{} {}".format(counts[flag], flag) for flag in addrange_flags if counts[flag])
+            logger.info("Validation addrange {}: {} of {} record(s) flagged{}.".format(
+                datasetnam, counts["flagged"], counts["records"], " ({})".format(details) if details else ""))
+
+    def validate_duplicates(self):
+        """
+        Flags segments with an identical geometry to another segment of the same table, in either direction, by
+        normalized WKB. Each duplicate is related to the first segment with the same geometry, and the first segment to
+        the second.
+        """
+
+        logger.info("Validating duplicate segments.")
+
+        wkbs = shapely.to_wkb(shapely.normalize(self.geoms))
+        valid = np.flatnonzero(~shapely.is_missing(self.geoms))
+
+        # Group identical geometries within each table.
+        groups = pd.DataFrame({"table": self.tables[valid], "wkb": wkbs[valid]}).groupby(["table", "wkb"], sort=False)
+        codes = groups.ngroup().to_numpy()
+        duplicate = groups["wkb"].transform("size").to_numpy() > 1
+
+        # Relate duplicates.
+        indexes = pd.Series(valid)
+        firsts = indexes.groupby(codes).transform("first").to_numpy()
+        seconds = indexes.where(valid != firsts).groupby(codes).transform("first").to_numpy()
+        related = np.where(valid == firsts, seconds, firsts)[duplicate].astype(np.int64)
+
+        self.duplicates = np.full(len(self.geoms), -1)
+        self.duplicates[valid[duplicate]] = firsts[duplicate]
+        self.flag("duplicate", valid[duplicate], related)
+
+    def validate_geometries(self):
+        """
+        Flags empty, zero length, sub-tolerance (shorter than the minimum length) and self-intersecting segments, in a
+        single pass per shapely array function.
+        """
+
+        logger.info("Validating segment geometries.")
+
+        lengths = shapely.length(self.geoms)
+        zero = shapely.is_missing(self.geoms) | shapely.is_empty(self.geoms) | (lengths == 0)
+        self.flag("zero_length", np.flatnonzero(zero))
+        short = ~zero & (lengths < self.min_length)
+        self.flag("short", np.flatnonzero(short))
+        self.flag("self_intersection", np.flatnonzero(~zero & ~shapely.is_simple(self.geoms)))
+        self.zero, self.short = zero, short
+
+    def validate_overlaps(self):
+        """
+        Flags the segments of the same table whose interiors share a linear section, excluding duplicates (see
+        validate_duplicates). Candidate pairs are found via a bulk STRtree query and tested via a vectorized DE-9IM
+        pattern. If a tile size is given, segments are grouped into tiles by their lower left bound and each tile is
+        queried against the segments intersecting the bounds of its segments, across a process pool.
+        """
+
+        logger.info("Validating overlapping segments.")
+
+        pairs = list()
+
+        for table in self.dframes:
+            indexes = np.flatnonzero((self.tables == table) & ~self.zero)
+            geoms = self.geoms[indexes]
+
+            # Tiled queries.
+            if self.tile_size and len(indexes):
+                bounds = shapely.bounds(geoms)
+                tile_ids = np.unique(np.floor(bounds[:, :2] / self.tile_size).astype(np.int64), axis=0,
+                                     return_inverse=True)[1].ravel()
+
+                # Compile the segments intersecting the bounds of the segments of each tile.
+                extents = pd.DataFrame(bounds).groupby(tile_ids).agg({0: "min", 1: "min", 2: "max", 3: "max"})
+                extents = shapely.box(*extents.to_numpy().T)
+                tiles, candidates = shapely.STRtree(geoms).query(extents)
+
+                # Group candidates by tile, flagging the candidates within their own tile as queries.
+                order = np.argsort(tiles, kind="stable")
+                tiles, candidates = tiles[order], candidates[order]
+                splits = np.flatnonzero(np.diff(tiles)) + 1
+                queries = np.split(tile_ids[candidates] == tiles, splits)
+                tasks = [(geoms[group], indexes[group], np.flatnonzero(query)) for group, query in
+                         zip(np.split(candidates, splits), queries)]
+
+                logger.info("Querying {} {} segments across {} tiles.".format(len(indexes), table, len(tasks)))
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    pairs.extend(executor.map(query_overlaps, *zip(*tasks)))
+
+            else:
+                pairs.append(query_overlaps(geoms, indexes, np.arange(len(indexes))))
+
+        # Exclude duplicates, which are flagged separately.
+        pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=np.int64)
+        duplicates = self.duplicates[pairs]
+        pairs = pairs[(duplicates[:, 0] < 0) | (duplicates[:, 0] != duplicates[:, 1])]
+
+        self.flag("overlap", np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]]))
+
+    def validate_topology(self):
+        """
+        Derives the junctions from the segment endpoints, grouping endpoints within the tolerance of each other, then
+        flags:
+        1) closed loops: segments starting and ending at the same junction, excluding sub-tolerance segments.
+        2) dangles: segments with an endpoint meeting no other segment, but within the dangle distance of another
+           segment (excluding the segments connected to its other endpoint). Each dangle is related to the nearby
+           segments, found via a bulk STRtree query of the dangling endpoints.
+        """
+
+        logger.info("Validating segment topology.")
+
+        first, last = helpers.endpoints(self.geoms)
+        valid = np.flatnonzero(~self.zero)
+        nodes, coords = helpers.gen_nodes(np.concatenate([first[valid], last[valid]]), self.tolerance,
+                                          tile_size=self.tile_size, workers=self.workers)
+
+        segment_nodes = np.full((len(self.geoms), 2), -1)
+        segment_nodes[valid] = nodes.reshape(2, -1).T
+
+        # Closed loops.
+        closed = segment_nodes[:, 0] == segment_nodes[:, 1]
+        self.flag("closed_loop", np.flatnonzero(closed & ~self.zero & ~self.short))
+
+        # Dangling endpoints: nodes with a single endpoint.
+        degree = np.bincount(nodes, minlength=len(coords))
+        segments = np.concatenate([valid, valid])
+        dangles = np.flatnonzero(degree[nodes] == 1)
+        others = segment_nodes[segments[dangles], np.where(dangles < len(valid), 1, 0)]
+
+        # Query the dangling endpoints against all segments.
+        queried, hits = shapely.STRtree(self.geoms).query(shapely.points(coords[nodes[dangles]]), predicate="dwithin",
+                                                          distance=self.dangle_distance)
+        owners = segments[dangles[queried]]
+        connected = (segment_nodes[hits] == others[queried][:, None]).any(axis=1)
+        near = (hits != owners) & ~connected & ~self.zero[hits]
+
+        self.flag("dangle", owners[near], hits[near])
+        logger.info("Derived {} junctions, {} dangling endpoints.".format(len(coords), len(dangles)))
+
+    def execute(self):
+        """Executes an NRN stage."""
+
+        self.load_interim()
+        self.validate_geometries()
+        self.validate_duplicates()
+        self.validate_overlaps()
+        self.validate_topology()
+        self.validate_addranges()
+        self.gen_validation()
+        self.export_interim()
+
+
+def query_overlaps(geoms, indexes, queries):
+    """
+    Returns the (n, 2) array of index pairs (lower index first) of the query geometries (positions within geoms) whose
+    interiors share a linear section with another geometry, via a bulk STRtree query. Indexes map geometry positions to
+    the returned indexes. Each pair is returned once, by the query geometry of the lower index.
+    """
+
+    queried, hits = shapely.STRtree(geoms).query(geoms[queries], predicate="intersects")
+    queried = queries[queried]
+
+    # Test interior linear intersections of candidate pairs.
+    candidates = indexes[queried] < indexes[hits]
+    queried, hits = queried[candidates], hits[candidates]
+    overlap = shapely.relate_pattern(geoms[queried], geoms[hits], "1********")
+
+    return np.column_stack([indexes[queried[overlap]], indexes[hits[overlap]]]).reshape(-1, 2)
+
+
+@click.command()
+@click.argument("source", type=click.Choice(["ab", "bc", "mb", "nb", "nl", "ns", "nt", "nu", "on", "pe", "qc", "sk",
+                                             "yt", "parks_canada"], case_sensitive=False))
+@click.option("--tolerance", type=click.FloatRange(min=0), default=1e-7, show_default=True,
+              help="Distance (input coordinate system units) within which endpoints form a single junction.")
+@click.option("--min-length", type=click.FloatRange(min=0), default=1e-7, show_default=True,
+              help="Length (input coordinate system units) below which segments are flagged as sub-tolerance.")
+@click.option("--dangle-distance", type=click.FloatRange(min=0), default=1e-5, show_default=True,
+              help="Distance (input coordinate system units) from other segments of flagged dangling endpoints.")
+@click.option("--tile-size", type=click.FloatRange(min=0, min_open=True), default=None,
+              help="Tile size (input coordinate system units) to split spatial queries across worker processes.")
+@click.option("--workers", type=click.IntRange(min=1), default=1,
+              help="Number of worker processes to fan tiles out to.")
+def main(source, tolerance, min_length, dangle_distance, tile_size, workers):
+    """Executes an NRN stage."""
+
+    logger.info("Started.")
+
+    stage = Stage(source, tolerance=tolerance, min_length=min_length, dangle_distance=dangle_distance,
+                  tile_size=tile_size, workers=workers)
+    stage.execute()
+
+    logger.info("Finished.")
+
+
+if __name__ == "__main__":
+    try:
+
+        main()
+
+    except KeyboardInterrupt:
+        logger.exception("KeyboardInterrupt: exiting program.")
+        sys.exit(1)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Make the shared modules (src), stage modules (src/stage_N) and report functions (reports) importable.
+src_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path[1:1] = [os.path.abspath(src_path)] + sorted(os.path.abspath(os.path.join(src_path, name))
+                                                     for name in os.listdir(src_path) if name.startswith("stage_")) + \
+                [os.path.abspath(os.path.join(src_path, "..", "reports"))]
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import addranges
+
+
+parities = {"even": 0, "odd": 1, "numéros pairs": 0, "numéros impairs": 1}
+
+
+def random_addrange(count, seed):
+    """Returns a random addrange dataframe of few streets, such that ranges overlap frequently."""
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({"nid": ["n{}".format(index) for index in range(count)]})
+
+    for side in ("l", "r"):
+        for field in ("hnumf", "hnuml"):
+            values = rng.integers(0, 40, count).astype(float)
+            values[rng.random(count) < 0.1] = np.nan
+            df["{}_{}".format(side, field)] = values
+        df["{}_hnumstr".format(side)] = rng.choice(np.array(["Even", "odd", "Mixed", "Irregular", None, "None",
+                                                             "Numéros pairs"], dtype=object), count)
+        df["{}_digdirfg".format(side)] = rng.choice(np.array(["Same Direction", "Opposite Direction",
+                                                              "Not Applicable", None], dtype=object), count)
+        df["{}_offnanid".format(side)] = rng.choice(np.array(["a", "b", "c", None], dtype=object), count)
+
+    return df
+
+
+def reference_ranges(df):
+    """Returns the addressed ranges of an addrange dataframe: (record, side, key, parity, low, high)."""
+
+    ranges = list()
+    for index, record in enumerate(df.itertuples(index=False)):
+        record = record._asdict()
+        for side in ("l", "r"):
+            first, last = record["{}_hnumf".format(side)], record["{}_hnuml".format(side)]
+            key = record["{}_offnanid".format(side)]
+            if first > 0 and last > 0 and key is not None:
+                parity = parities.get(str(record["{}_hnumstr".format(side)]).lower(), -1)
+                ranges.append((index, side, key, parity, min(first, last), max(first, last)))
+
+    return ranges
+
+
+def reference_overlaps(df):
+    """Returns the records overlapping another record per side, via a pairwise comparison of all ranges."""
+
+    overlaps = {"l": dict(), "r": dict()}
+    ranges = reference_ranges(df)
+
+    for record, side, key, parity, low, high in ranges:
+        for other, _, other_key, other_parity, other_low, other_high in ranges:
+            if record != other and key == other_key and (parity < 0 or other_parity < 0 or parity == other_parity) \
+                    and low <= other_high and other_low <= high:
+                overlaps[side].setdefault(record, set()).add(other)
+
+    return overlaps
+
+
+def test_validate_addranges_matches_reference():
+    for seed in range(100):
+        df = random_addrange(30, seed)
+
+        validated = addranges.validate_addranges(df)
+        overlaps = reference_overlaps(df)
+
+        for side in ("l", "r"):
+            assert set(np.flatnonzero(validated["{}_overlap".format(side)])) == set(overlaps[side]), (seed, side)
+            for record, others in overlaps[side].items():
+                assert validated["{}_overlap_nid".format(side)][record] in set(df["nid"][list(others)]), (seed, side)
+            assert validated["{}_overlap_nid".format(side)][~validated["{}_overlap".format(side)]].isna().all()
+
+
+def test_validate_addranges_parity_and_order():
+    df = random_addrange(200, 0)
+
+    validated = addranges.validate_addranges(df)
+
+    for side in ("l", "r"):
+        first, last = df["{}_hnumf".format(side)], df["{}_hnuml".format(side)]
+        parity = df["{}_hnumstr".format(side)].map(lambda value: parities.get(str(value).lower(), -1))
+        opposite = df["{}_digdirfg".format(side)] == "Opposite Direction"
+        addressed = (first > 0) & (last > 0)
+
+        expected = [bool(a and p >= 0 and (f % 2 != p or l % 2 != p)) for a, p, f, l in
+                    zip(addressed, parity, first, last)]
+        assert validated["{}_parity".format(side)].tolist() == expected
+        expected = [bool(a and (f < l if o else f > l)) for a, o, f, l in zip(addressed, opposite, first, last)]
+        assert validated["{}_order".format(side)].tolist() == expected
+
+
+def test_validate_addranges_same_record_ranges():
+    # n1 holds two ranges on key B (left and right, mixed), n2 overlaps the right range only.
+    df = pd.DataFrame({
+        "nid": ["n1", "n2"],
+        "l_hnumf": [4, 0], "l_hnuml": [5, 0], "l_hnumstr": ["Mixed", "None"], "l_offnanid": ["B", None],
+        "r_hnumf": [3, 4], "r_hnuml": [5, 27], "r_hnumstr": ["Odd", "Mixed"], "r_offnanid": ["B", "B"],
+        "l_digdirfg": "Same Direction", "r_digdirfg": "Same Direction"
+    })
+
+    validated = addranges.validate_addranges(df)
+
+    assert validated["l_overlap_nid"].fillna("").tolist() == ["n2", ""]
+    assert validated["r_overlap_nid"].tolist() == ["n2", "n1"]
+
+
+@pytest.mark.parametrize("records", [200, 20, 3])
+def test_find_overlaps_matches_reference(records):
+    rng = np.random.default_rng(records)
+    count = 300
+    keys, lanes, records = rng.integers(0, 5, count), rng.integers(0, 2, count), rng.integers(0, records, count)
+    low = rng.integers(0, 100, count).astype(float)
+    high = low + rng.integers(0, 10, count)
+
+    pairs = addranges.find_overlaps(keys, lanes, low, high, records)
+    expected = {a for a in range(count) for b in range(count) if keys[a] == keys[b] and lanes[a] == lanes[b] and
+                records[a] != records[b] and low[a] <= high[b] and low[b] <= high[a]}
+
+    # Each overlapping range is reported once, with a range of another record which it overlaps.
+    assert sorted(pairs[:, 0].tolist()) == sorted(expected)
+    a, b = pairs.T
+    assert ((keys[a] == keys[b]) & (lanes[a] == lanes[b]) & (records[a] != records[b]) & (low[a] <= high[b]) &
+            (low[b] <= high[a])).all()
+
+
+def test_find_overlaps_excludes_the_holding_record():
+    # Record 0 holds the running maximum when its second range starts, which only overlaps record 1 among the preceding
+    # ranges. Its third range overlaps no other record.
+    keys, lanes = np.zeros(5, dtype=int), np.zeros(5, dtype=int)
+    low, high = np.array([1, 2, 3, 8, 12.]), np.array([20, 4, 30, 9, 13.])
+    records = np.array([0, 1, 0, 2, 0])
+
+    pairs = dict(addranges.find_overlaps(keys, lanes, low, high, records).tolist())
+
+    assert pairs == {0: 1, 1: 0, 2: 1, 3: 2}
+
+
+def test_summarize_addranges():
+    df = random_addrange(100, 1)
+    validated = addranges.validate_addranges(df)
+    provinces = pd.Series(np.where(np.arange(100) < 40, "NB", "NS"), name="province")
+
+    summary = addranges.summarize_addranges(validated, provinces)
+
+    assert summary.index.name == "province" and summary.index.tolist() == ["NB", "NS"]
+    assert summary["records"].tolist() == [40, 60]
+    for flag in addranges.addrange_flags:
+        assert summary[flag].tolist() == [validated[flag][:40].sum(), validated[flag][40:].sum()]
+    assert summary["flagged"].tolist() == [validated[addranges.addrange_flags][:40].any(axis=1).sum(),
+                                           validated[addranges.addrange_flags][40:].any(axis=1).sum()]
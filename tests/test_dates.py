@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+import dates
+
+
+def reference_normalize(value):
+    """Normalizes a single NRN date to YYYYMMDD, see dates.factorize_dates."""
+
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+
+    value = str(int(value)) if isinstance(value, (int, float)) else str(value).strip()
+
+    return {4: value + "0101", 6: value + "01"}.get(len(value), value)
+
+
+def reference_parse(value):
+    """Parses a single normalized NRN date, None if it is missing or not a real calendar date."""
+
+    try:
+        return datetime.strptime(value, "%Y%m%d") if value and value.isdigit() and len(value) == 8 else None
+    except ValueError:
+        return None
+
+
+values = ["2019", "201902", "20190228", "20190229", "20200229", " 2018 ", "2019-02", "", None, np.nan, 2017, 201705.0,
+          "Unknown", "20191301", "99999999", "0"]
+
+
+def test_normalize_dates_matches_reference():
+    series = pd.Series(values * 3, index=np.arange(len(values) * 3) * 2, dtype=object)
+
+    result = dates.normalize_dates(series)
+
+    assert result.index.equals(series.index)
+    assert [None if pd.isna(value) else value for value in result] == [reference_normalize(value) for value in series]
+
+
+def test_parse_dates_matches_reference():
+    result = dates.parse_dates(pd.Series(values, dtype=object))
+
+    assert [None if pd.isna(value) else value.to_pydatetime() for value in result] == \
+           [reference_parse(reference_normalize(value)) for value in values]
+
+
+def test_validate_dates_matches_reference():
+    rng = np.random.default_rng(0)
+    credate = pd.Series(rng.choice(np.array(values, dtype=object), 200))
+    revdate = pd.Series(rng.choice(np.array(values + ["20300101"], dtype=object), 200))
+    today = datetime(2025, 1, 1)
+
+    result = dates.validate_dates(credate, revdate, today=today)
+
+    for index in range(200):
+        created, revised = [reference_parse(reference_normalize(value)) for value in (credate[index], revdate[index])]
+        expected = {
+            "invalid_credate": created is None and reference_normalize(credate[index]) not in (None, ""),
+            "invalid_revdate": revised is None and reference_normalize(revdate[index]) not in (None, ""),
+            "future_credate": created is not None and created > today,
+            "future_revdate": revised is not None and revised > today,
+            "revdate_before_credate": created is not None and revised is not None and revised < created
+        }
+        assert result.loc[index, dates.date_flags].to_dict() == expected
+
+
+def test_validate_dates_flags():
+    credate = pd.Series(["2019", "20190230", "20300101", "20190517", None, ""])
+    revdate = pd.Series(["201905", "2020", "20300101", "20190516", "2019", "20191301"])
+
+    result = dates.validate_dates(credate, revdate, today="2025-01-01")
+
+    assert result["created"].dt.strftime("%Y%m%d").fillna("").tolist() == ["20190101", "", "20300101", "20190517", "",
+                                                                             ""]
+    assert result["revised"].dt.strftime("%Y%m%d").fillna("").tolist() == ["20190501", "20200101", "20300101",
+                                                                             "20190516", "20190101", ""]
+    assert np.flatnonzero(result["invalid_credate"]).tolist() == [1]
+    assert np.flatnonzero(result["invalid_revdate"]).tolist() == [5]
+    assert np.flatnonzero(result["future_credate"] & result["future_revdate"]).tolist() == [2]
+    assert np.flatnonzero(result["revdate_before_credate"]).tolist() == [3]
+
+
+def test_summarize_dates():
+    validated = dates.validate_dates(pd.Series(["2019", "2020", "2021", "bad"]),
+                                     pd.Series(["2020", "2019", None, "2021"]), today="2025-01-01")
+
+    summary = dates.summarize_dates(validated, pd.Series(["a", "a", "b", "b"], name="province"))
+
+    assert summary.index.name == "province"
+    assert summary["records"].tolist() == [2, 2]
+    assert summary["revdate_before_credate"].tolist() == [1, 0]
+    assert summary["invalid_credate"].tolist() == [0, 1]
+    assert summary.loc["a", "interval_min"] == -365 and summary.loc["a", "interval_max"] == 365
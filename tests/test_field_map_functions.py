@@ -0,0 +1,203 @@
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import re
+from operator import itemgetter
+
+import field_map_functions
+import helpers
+
+
+def distinct(values):
+    """Returns the distinct values of a sequence, in order, with nulls comparing equal."""
+
+    kept = list()
+    for value in values:
+        if not any((pd.isna(value) and pd.isna(other)) or (not pd.isna(other) and value == other) for other in kept):
+            kept.append(value)
+
+    return kept
+
+
+def reference_split_record(df, fields):
+    """Row-by-row reference of split_record: originals first, then the split records grouped by split order."""
+
+    records = list()
+    for position, (index, row) in enumerate(df.iterrows()):
+        values = {field: distinct(row[field]) for field in fields}
+        for rank in range(max(map(len, values.values()))):
+            record = row.copy()
+            for field, field_values in values.items():
+                record[field] = field_values[min(rank, len(field_values) - 1)]
+            records.append((rank, position, index, record))
+
+    records.sort(key=lambda record: record[:2])
+
+    return pd.DataFrame([record for *_, record in records], index=[index for _, _, index, _ in records])
+
+
+def test_split_record_passthrough():
+    values = np.array([1, 2, 3])
+
+    assert field_map_functions.split_record(values) is values
+    assert field_map_functions.split_record(values, "field") is values
+
+
+def test_split_record_two_way_matches_baseline():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"field": [tuple(pair) for pair in rng.choice(["a", "b", "c"], (50, 2))],
+                       "other": np.arange(50)}, index=np.arange(50) * 10)
+
+    # Baseline: originals keep the first value, records with distinct values are appended with the second value.
+    split = df.loc[df["field"].map(lambda val: val[0] != val[1])].copy()
+    expected = df.assign(field=df["field"].map(lambda val: val[0]))
+    expected = pd.concat([expected, split.assign(field=split["field"].map(lambda val: val[1]))])
+
+    result = field_map_functions.split_record(df.copy(), "field")
+
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_split_record_n_way_matches_reference():
+    rng = np.random.default_rng(1)
+    choices = np.array(["a", "b", None, "c"], dtype=object)
+    df = pd.DataFrame({"name": [tuple(rng.choice(choices, 4)) for _ in range(100)],
+                       "place": [tuple(rng.choice(choices, 4)) for _ in range(100)],
+                       "other": rng.integers(0, 10, 100)}, index=rng.permutation(100))
+
+    result = field_map_functions.split_record(df.copy(), ["name", "place"])
+    expected = reference_split_record(df, ["name", "place"])
+
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_split_record_candidate_dataframes():
+    df = pd.DataFrame({"name": [None, None, None], "other": [1, 2, 3]}, index=[5, 6, 7])
+    candidates = pd.DataFrame({"a": ["x", "y", "z"], "b": ["x", "w", None], "c": ["v", "w", "z"]}, index=df.index)
+
+    result = field_map_functions.split_record(df.copy(), {"name": candidates})
+
+    assert list(result.index) == [5, 6, 7, 5, 6, 7]
+    assert list(result["name"].fillna("null")) == ["x", "y", "z", "v", "w", "null"]
+    assert list(result["other"]) == [1, 2, 3, 1, 2, 3]
+
+
+def street_types():
+    """Returns the strtypre field domain values."""
+
+    path = os.path.join(os.path.dirname(os.path.abspath(helpers.__file__)), "field_domains_en.yaml")
+
+    return tuple(helpers.load_yaml(path)["strplaname"]["strtypre"])
+
+
+def alternation(domain):
+    """Returns the reference pattern of a field domain: an alternation of the literal values, longest first."""
+
+    return "|".join(map(re.escape, sorted(set(str(value).lower() for value in domain), key=len, reverse=True)))
+
+
+def test_domain_regex_matches_alternation():
+    domain = street_types() + ("North", "Northwest", "Nord", "a.b", "de", "des")
+    rng = np.random.default_rng(0)
+    values = [value.lower() for value in domain]
+    words = values + [value[:rng.integers(1, len(value) + 1)] + rng.choice(["", "x", "e", " ", "-"])
+                      for value in values for _ in range(3)] + ["axb", "NORTHWEST", "Allée", "allee"]
+
+    trie = re.compile(field_map_functions.domain_regex(domain), flags=re.I)
+    reference = re.compile(alternation(domain), flags=re.I)
+
+    for word in words:
+        assert bool(trie.fullmatch(word)) == bool(reference.fullmatch(word)), word
+        match, reference_match = trie.match(word), reference.match(word)
+        assert (match and match.span()) == (reference_match and reference_match.span()), word
+
+
+def test_regex_find_with_domain_matches_alternation():
+    domain = street_types()
+    pattern = r"\b(domain)\b\s*$"
+    names = pd.Series(["Main Street", "King Court", "Maple Cour", "Elm Avenue Extension", "Rue Principale", None, "",
+                       "Northwest Crescent", "Crescent", "Cul-de-sac Drive"] * 2)
+
+    result = field_map_functions.regex_find(names, pattern, match_index=0, group_index=0, domain=domain)
+    expected = field_map_functions.regex_find(names, pattern.replace("domain", alternation(domain)), match_index=0,
+                                              group_index=0)
+
+    pd.testing.assert_series_equal(result, expected)
+    assert result[0] == "Street" and result[1] == "Court" and result[2] == "Cour"
+
+
+def baseline_regex_find(val, pattern, match_index, group_index, domain=None, strip_result=False):
+    """
+    Per-value regex_find as it was before column-level application: a single int group index is wrapped in a list
+    and unpacked by itemgetter into the group string itself, such that its first character is returned.
+    """
+
+    if val in (None, "", np.nan):
+        return np.nan
+
+    pattern = field_map_functions.validate_regex(pattern, domain)
+    if not isinstance(group_index, list):
+        group_index = [group_index]
+
+    try:
+        matches = re.finditer(pattern, val, flags=re.IGNORECASE)
+        result = [[itemgetter(*group_index)(m.groups()), m.start(), m.end()] for m in matches][match_index]
+        result[0] = [grp for grp in result[0] if grp not in (None, "", np.nan)][0]
+
+        if strip_result:
+            start, end = result[1:]
+            return " ".join(map(str, [val[:start], val[end:]])).strip()
+        else:
+            return result[0]
+
+    except (IndexError, ValueError):
+        return val if strip_result else np.nan
+
+
+street_names = pd.Series(["123 Main Street North", "Rue de l'Église Est", "Chemin Gauthier", "12A King St", "", None,
+                          "Avenue Northwest Crescent Nord", "45-47 Rue Principale", "Street", "7", "Mill Rd W"] * 3)
+
+# Source regex_find patterns (sources/nb), as (pattern, match index, group index).
+source_patterns = [(r"(^\d+)", 0, 0), (r"([\s\W]+|^)(domain)([\s\W]+)*?", 0, 1),
+                   (r"([\s\W]+)(domain)([\s\W]+|$)*?", -1, 1), (r"([\s\W]+|^)(domain)([\s\W]+|$)*?", -1, 1)]
+
+
+@pytest.mark.parametrize("pattern, match_index, group_index", source_patterns)
+@pytest.mark.parametrize("strip_result", [False, True])
+def test_regex_find_series_matches_values(pattern, match_index, group_index, strip_result):
+    domain = street_types() + ("North", "Nord", "Est", "W", "de", "l'")
+
+    for group_indexes in (group_index, [group_index], [2, group_index], [-1, 0]):
+        result = field_map_functions.regex_find(street_names, pattern, match_index, group_indexes, domain=domain,
+                                                strip_result=strip_result)
+        expected = [field_map_functions.regex_find(value, pattern, match_index, group_indexes, domain=domain,
+                                                   strip_result=strip_result) for value in street_names]
+
+        assert result.index.equals(street_names.index)
+        assert result.fillna("null").tolist() == pd.Series(expected, dtype=object).fillna("null").tolist()
+
+
+@pytest.mark.parametrize("pattern, match_index, group_index", source_patterns + [(r"(\w)(\d)?", 1, [1, 0]),
+                                                                                 (r"(\w+)", -2, 0), (r"(x?)", 3, 0)])
+@pytest.mark.parametrize("strip_result", [False, True])
+def test_regex_find_matches_baseline(pattern, match_index, group_index, strip_result):
+    domain = field_map_functions.domain_regex(street_types() + ("North", "Nord", "Est", "W", "de", "l'"))
+
+    result = field_map_functions.regex_find(street_names, pattern, match_index, group_index, domain=domain,
+                                            strip_result=strip_result)
+
+    for value, new in zip(street_names, result):
+        try:
+            old = baseline_regex_find(value, pattern, match_index, group_index, domain=domain,
+                                      strip_result=strip_result)
+        except TypeError:
+            # The baseline failed on a single missing group.
+            assert not isinstance(group_index, list)
+            continue
+
+        # A single int group index now returns the whole group instead of its first character.
+        if not isinstance(group_index, list) and not strip_result and not pd.isna(new):
+            assert old == new[0], value
+        else:
+            assert (pd.isna(old) and pd.isna(new)) or old == new, value
@@ -0,0 +1,162 @@
+import geopandas as gpd
+import numpy as np
+import os
+import pandas as pd
+import pickle
+import pytest
+import shapely
+import sqlite3
+import uuid
+
+import helpers
+
+
+def test_export_gpkg_without_attribute_fields(tmp_path):
+    gpkg_path = str(tmp_path / "test.gpkg")
+    geoms = gpd.GeoDataFrame(geometry=[shapely.LineString([(0, 0), (1, 1)])] * 2, crs="EPSG:4617")
+
+    helpers.export_gpkg({"geoms": geoms, "records": pd.DataFrame(index=range(3))}, gpkg_path)
+    helpers.export_gpkg({"records": pd.DataFrame(index=range(2))}, gpkg_path, append=True)
+
+    with sqlite3.connect(gpkg_path) as con:
+        assert con.execute("select count(*) from geoms;").fetchone() == (2,)
+        assert con.execute("select count(*) from records;").fetchone() == (5,)
+    assert gpd.read_file(gpkg_path, layer="geoms").geometry.equals(geoms.geometry)
+
+
+def test_export_gpkg_failure_keeps_existing_layers(tmp_path):
+    gpkg_path = str(tmp_path / "test.gpkg")
+    geoms = gpd.GeoDataFrame({"name": ["a", "b"]}, geometry=[shapely.Point(0, 0), shapely.Point(1, 1)],
+                             crs="EPSG:4617")
+    helpers.export_gpkg({"geoms": geoms}, gpkg_path)
+
+    # Unsupported attribute values fail the write after the layer has been replaced within the transaction.
+    with pytest.raises(SystemExit):
+        helpers.export_gpkg({"geoms": geoms.assign(name=[["a"], ["b"]])}, gpkg_path)
+
+    with sqlite3.connect(gpkg_path) as con:
+        assert con.execute("pragma journal_mode;").fetchone() == ("delete",)
+    assert gpd.read_file(gpkg_path, layer="geoms")["name"].tolist() == ["a", "b"]
+    assert sorted(os.listdir(tmp_path)) == ["test.gpkg"]
+
+
+def test_config_cache_is_invalidated_by_changed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(helpers, "config_cache_path", str(tmp_path / "cache"))
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text("a: 1")
+
+    assert helpers.load_config_cache("config", [str(config_path)]) is None
+    helpers.save_config_cache("config", [str(config_path)], {"a": 1})
+    assert helpers.load_config_cache("config", [str(config_path)]) == {"a": 1}
+
+    config_path.write_text("a: 2")
+    assert helpers.load_config_cache("config", [str(config_path)]) is None
+
+
+@pytest.mark.parametrize("content", [b"\x80\x04\x95", b"cmissing_module\nConfig\n.", b"chelpers\nmissing_function\n.",
+                                     b"\x80\x99.", b"garbage", pickle.dumps(["config"]), None])
+def test_unreadable_config_cache_is_recompiled(tmp_path, monkeypatch, content):
+    monkeypatch.setattr(helpers, "config_cache_path", str(tmp_path / "cache"))
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text("a: 1")
+    cache_path = tmp_path / "cache" / "config.pickle"
+    cache_path.parent.mkdir()
+
+    # Truncated, incompatible or invalid caches, or a directory in place of the cache file.
+    if content is None:
+        cache_path.mkdir()
+    else:
+        cache_path.write_bytes(content)
+
+    assert helpers.load_config_cache("config", [str(config_path)]) is None
+
+    if content is not None:
+        helpers.save_config_cache("config", [str(config_path)], {"a": 1})
+        assert helpers.load_config_cache("config", [str(config_path)]) == {"a": 1}
+
+
+def test_gen_uuids_are_random_version_4():
+    uuids = helpers.gen_uuids(1000)
+
+    assert uuids.shape == (1000, 16) and uuids.dtype == np.uint8
+    assert all(uuid.UUID(bytes=bytes(row)).version == 4 for row in uuids)
+    assert all(uuid.UUID(bytes=bytes(row)).variant == uuid.RFC_4122 for row in uuids)
+    assert len(np.unique(uuids, axis=0)) == 1000
+    assert helpers.gen_uuids(0).shape == (0, 16)
+
+
+def test_gen_uuids_v5_matches_uuid5():
+    namespace = uuid.uuid5(uuid.NAMESPACE_URL, "nrn-rrn/test")
+    names = [b"a", b"b", b"a", b"", b"a"]
+
+    uuids = helpers.gen_uuids_v5(namespace, names)
+    expected = [uuid.uuid5(namespace, name) for name in ("a", "b", "a#1", "", "a#2")]
+
+    assert [uuid.UUID(bytes=bytes(row)) for row in uuids] == expected
+    assert (helpers.gen_uuids_v5(namespace, names) == uuids).all()
+
+
+def test_uuid_hex_matches_uuid():
+    uuids = helpers.gen_uuids(100)
+
+    assert list(helpers.uuid_hex(uuids)) == [uuid.UUID(bytes=bytes(row)).hex for row in uuids]
+    assert list(helpers.uuid_hex(uuids[::2])) == [uuid.UUID(bytes=bytes(row)).hex for row in uuids[::2]]
+    assert helpers.uuid_hex(uuids).dtype == object
+
+
+def test_domain_codes_resolve_values_codes_and_references():
+    codes = helpers.domain_codes("addrange", "r_hnumstr")
+
+    # English and French values and code strings, through the l_hnumstr reference.
+    assert codes == helpers.domain_codes("addrange", "l_hnumstr")
+    assert codes["even"] == codes["numéros pairs"] == codes["1"] == 1
+    assert helpers.domain_codes("roadseg", "trafficdir")["opposite direction"] == 3
+    assert helpers.domain_codes("roadseg", "l_hnumf") == dict()
+
+
+@pytest.mark.parametrize("tile_size", [None, 1.5])
+def test_gen_nodes_within_tolerance(tile_size):
+    points = [[0, 0], [0.9, 0], [1.1, 0], [5, 5], [5.99, 5.99], [0, 0], [10, 10], [10.5, 10.5], [11, 11]]
+
+    nodes, coords = helpers.gen_nodes(points, 1.0, tile_size=tile_size, workers=2)
+
+    # Points across a cell boundary are merged, diagonal points beyond the tolerance are not, and chains are merged.
+    assert nodes[0] == nodes[1] == nodes[2] == nodes[5]
+    assert nodes[3] != nodes[4]
+    assert nodes[6] == nodes[7] == nodes[8]
+    assert len(coords) == len(set(nodes.tolist())) == 4
+    assert coords[nodes].tolist() == [[0, 0]] * 3 + [[5, 5], [5.99, 5.99], [0, 0]] + [[10, 10]] * 3
+
+
+def test_gen_nodes_without_tolerance():
+    nodes, coords = helpers.gen_nodes([[1, 1], [0, 0], [1, 1], [0, 1e-9]])
+
+    assert nodes.tolist() == [2, 0, 2, 1]
+    assert coords.tolist() == [[0, 0], [0, 1e-9], [1, 1]]
+
+
+@pytest.mark.skipif(helpers.pq is None, reason="pyarrow is required for GeoParquet interim data.")
+def test_export_parquet_casts_and_appends_parts(tmp_path):
+    path = str(tmp_path / "nb")
+    geoms = gpd.GeoDataFrame({"nid": ["a", "b"], "speed": ["50", "x"], "code": [1, 2]},
+                             geometry=[shapely.Point(0, 0), shapely.Point(1, 1)], crs="EPSG:4617")
+    schemas = {"geoms": {"nid": "str", "speed": "int", "code": "str"}}
+
+    helpers.export_interim({"geoms": geoms, "records": pd.DataFrame({"value": [1.5]})}, path, schemas=schemas)
+    helpers.export_interim({"geoms": geoms.iloc[:1]}, path, schemas=schemas, append=True)
+
+    # Schema casts, one part per export, and column selection with and without geometry.
+    assert helpers.interim_tables(path) == ["geoms", "records"]
+    assert sorted(os.listdir(os.path.join(path, "geoms"))) == ["part-00000.parquet", "part-00001.parquet"]
+    df = helpers.load_interim(path, "geoms")
+    assert isinstance(df, gpd.GeoDataFrame) and df.crs == geoms.crs
+    assert df.geometry.equals(gpd.GeoSeries(list(geoms.geometry) + [geoms.geometry[0]], crs=geoms.crs))
+    assert df["speed"].tolist()[::2] == [50, 50] and pd.isna(df["speed"].iloc[1])
+    assert df["code"].tolist() == ["1", "2", "1"]
+    assert list(helpers.load_interim(path, "geoms", columns=["nid"]).columns) == ["nid", "geometry"]
+    assert list(helpers.load_interim(path, "geoms", columns=["nid"], geometry=False).columns) == ["nid"]
+    assert list(helpers.load_interim(path, "geoms", geometry=False).columns) == ["nid", "speed", "code"]
+
+    # Replacing drops the previous parts.
+    helpers.export_interim({"geoms": geoms}, path)
+    assert len(helpers.load_interim(path, "geoms")) == 2
@@ -0,0 +1,106 @@
+import geopandas as gpd
+import numpy as np
+import shapely
+from collections import Counter
+
+import network
+
+
+def random_network(seed=0, count=200):
+    """Returns roadseg and ferryseg dataframes of random segments between grid points."""
+
+    rng = np.random.default_rng(seed)
+    coords = rng.integers(0, 12, (count, 2, 2)).astype(float)
+    geoms = list(shapely.linestrings(coords))
+    geoms[::25] = [None] * len(geoms[::25])
+    trafficdir = rng.choice(np.array(["Both directions", "same direction", " Opposite direction ", "Même direction",
+                                      "Direction contraire", 1, 2, "3", "Unknown", None], dtype=object), count)
+
+    roadseg = gpd.GeoDataFrame({"trafficdir": trafficdir}, geometry=geoms, crs="EPSG:4617")
+    ferryseg = gpd.GeoDataFrame(geometry=shapely.linestrings(rng.integers(0, 12, (10, 2, 2)).astype(float)),
+                                crs="EPSG:4617")
+
+    return {"roadseg": roadseg, "ferryseg": ferryseg}
+
+
+def reference_adjacency(dframes):
+    """
+    Returns the adjacency entries of each node coordinate, (neighbour coordinate, table, row, traversable), from a
+    record-by-record pass over the segments.
+    """
+
+    codes = {"both directions": 1, "same direction": 2, "opposite direction": 3, "bi-directionel": 1,
+             "même direction": 2, "direction contraire": 3, "1": 1, "2": 2, "3": 3}
+    adjacency = dict()
+
+    for table, df in dframes.items():
+        for row, (geom, trafficdir) in enumerate(zip(df.geometry, df.get("trafficdir", [None] * len(df)))):
+            if geom is None:
+                continue
+
+            code = codes.get(str(trafficdir).strip().lower(), 0)
+            first, last = geom.coords[0], geom.coords[-1]
+            adjacency.setdefault(first, Counter())[(last, table, row, code != 3)] += 1
+            adjacency.setdefault(last, Counter())[(first, table, row, code != 2)] += 1
+
+    return adjacency
+
+
+def test_build_network_matches_reference():
+    dframes = random_network()
+
+    graph = network.build_network(dframes)
+    adjacency = dict()
+    for node in range(graph.node_count):
+        coords = tuple(graph.node_coords[node])
+        for position in range(graph.indptr[node], graph.indptr[node + 1]):
+            edge = graph.arcs[position]
+            entry = (tuple(graph.node_coords[graph.indices[position]]), network.edge_tables[graph.edge_table[edge]],
+                     graph.edge_row[edge], bool(graph.traversable[position]))
+            adjacency.setdefault(coords, Counter())[entry] += 1
+
+    assert adjacency == reference_adjacency(dframes)
+    assert graph.edge_count == sum(df.geometry.notna().sum() for df in dframes.values())
+
+
+def test_neighbours_traversable():
+    dframes = {"roadseg": gpd.GeoDataFrame({"trafficdir": ["Same direction", "Opposite direction", "Both directions"]},
+                                           geometry=shapely.linestrings([[(0, 0), (1, 0)], [(0, 0), (0, 1)],
+                                                                         [(0, 0), (1, 1)]]), crs="EPSG:4617")}
+
+    graph = network.build_network(dframes)
+    origin = int(np.flatnonzero((graph.node_coords == 0).all(axis=1))[0])
+    neighbours, arcs = graph.neighbours(origin, traversable=True)
+
+    assert sorted(arcs.tolist()) == [0, 2]
+    assert sorted(map(tuple, graph.node_coords[neighbours].tolist())) == [(1, 0), (1, 1)]
+    assert sorted(graph.neighbours(origin)[1].tolist()) == [0, 1, 2]
+
+
+def test_components_match_reference():
+    graph = network.build_network(random_network(1, count=40))
+
+    # Reference: flood fill over the undirected edges.
+    labels = np.full(graph.node_count, -1)
+    for start in range(graph.node_count):
+        if labels[start] < 0:
+            labels[start], stack = start, [start]
+            while stack:
+                node = stack.pop()
+                for neighbour in graph.neighbours(node)[0]:
+                    if labels[neighbour] < 0:
+                        labels[neighbour] = start
+                        stack.append(neighbour)
+
+    components = graph.components()
+    assert len(set(zip(components, labels))) == len(set(labels)) == len(set(components))
+
+
+def test_save_load(tmp_path):
+    graph = network.build_network(random_network(2))
+
+    graph.save(str(tmp_path / "network"), {"tolerance": 0})
+    loaded = network.Network.load(str(tmp_path / "network"))
+
+    for name in network.network_arrays:
+        assert np.array_equal(getattr(loaded, name), getattr(graph, name))
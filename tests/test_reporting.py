@@ -0,0 +1,56 @@
+import geopandas as gpd
+import os
+import pandas as pd
+import shapely
+
+import reporting
+
+
+def write_roadseg(data_dir, prcode, datasetnam, count):
+    """Writes a GeoPackage with a roadseg layer of a province in the NRN release naming, returning its path."""
+
+    gpkg_path = data_dir / "NRN_{}_10_0_GPKG".format(prcode) / "NRN_{}_10_0_GPKG_en.gpkg".format(prcode)
+    gpkg_path.parent.mkdir(parents=True, exist_ok=True)
+    gpd.GeoDataFrame({"DATASETNAM": [datasetnam] * count, "CREDATE": ["2019"] * count,
+                      "REVDATE": ["20200101"] * count, "NID": list(map(str, range(count)))},
+                     geometry=[shapely.LineString([(index, 0), (index + 1, 1)]) for index in range(count)],
+                     crs="EPSG:4617").to_file(str(gpkg_path), layer="NRN_{}_10_0_ROADSEG".format(prcode))
+
+    return gpkg_path
+
+
+def test_load_all_roadseg_reads_requested_columns_of_each_province(tmp_path):
+    write_roadseg(tmp_path, "NB", "New Brunswick", 3)
+    write_roadseg(tmp_path, "PE", "Prince Edward Island", 2)
+
+    roadseg = reporting.load_all_roadseg(tmp_path, columns=["datasetnam", "credate", "missing"], geometry=False,
+                                         cache=False)
+
+    # Provinces are concatenated in PROVINCES order, missing columns are ignored.
+    assert list(roadseg.columns) == ["datasetnam", "credate"]
+    assert roadseg["datasetnam"].tolist() == ["New Brunswick"] * 3 + ["Prince Edward Island"] * 2
+    assert isinstance(reporting.load_all_roadseg(tmp_path, columns=["nid"], cache=False), gpd.GeoDataFrame)
+
+
+def test_load_all_roadseg_cache_accumulates_columns_and_follows_the_geopackage(tmp_path):
+    gpkg_path = write_roadseg(tmp_path, "NB", "New Brunswick", 3)
+    cache_dir = tmp_path / reporting.CACHE_DIRNAME
+
+    dates = reporting.load_all_roadseg(tmp_path, columns=["credate"], geometry=False)
+    pd.testing.assert_frame_equal(dates, reporting.load_all_roadseg(tmp_path, columns=["credate"], geometry=False,
+                                                                    cache=False))
+
+    # Missing columns and geometry are added to the cache, which keeps the previously cached columns.
+    roadseg = reporting.load_all_roadseg(tmp_path, columns=["revdate"])
+    assert roadseg.geometry.equals(reporting.load_all_roadseg(tmp_path, columns=["revdate"], cache=False).geometry)
+    cache_files = list(cache_dir.glob("*.parquet"))
+    assert len(cache_files) == 1
+    assert set(pd.read_parquet(cache_files[0]).columns) == {"credate", "revdate", "geometry"}
+
+    # A changed GeoPackage replaces the stale cache.
+    write_roadseg(tmp_path, "NB", "Nouveau-Brunswick", 2)
+    os.utime(gpkg_path, ns=(cache_files[0].stat().st_mtime_ns, gpkg_path.stat().st_mtime_ns + 1))
+    assert reporting.load_all_roadseg(tmp_path, columns=["datasetnam"], geometry=False)["datasetnam"].tolist() == \
+        ["Nouveau-Brunswick"] * 2
+    assert list(cache_dir.glob("*.parquet")) != cache_files and len(list(cache_dir.glob("*.parquet"))) == 1
+
@@ -0,0 +1,384 @@
+import geopandas as gpd
+import json
+import numpy as np
+import os
+import pandas as pd
+import pytest
+import shapely
+import sqlite3
+from functools import partial
+
+import helpers
+import stage_1
+
+
+@pytest.fixture
+def stage(tmp_path, monkeypatch):
+    """Returns a factory of stage 1 instances of the nb source, run from the stage directory."""
+
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(stage_1.__file__)))
+    monkeypatch.setattr(helpers, "config_cache_path", str(tmp_path / "cache"))
+
+    def make_stage(**kwargs):
+        stage = stage_1.Stage("nb", **kwargs)
+        stage.compile_source_attributes()
+        stage.source_attributes = {name: attributes for name, attributes in stage.source_attributes.items()
+                                   if "road-route" in name}
+        stage.compile_target_attributes()
+        stage.compile_domains()
+
+        return stage
+
+    return make_stage
+
+
+def road_route(count, seed=0):
+    """Returns a synthetic nb road-route source dataframe."""
+
+    rng = np.random.default_rng(seed)
+    choice = lambda values: rng.choice(np.array(values, dtype=object), count)
+
+    return gpd.GeoDataFrame({
+        "streetname": choice(["Main Street", "Route 51 Highway", "Chemin Gauthier Est", "rue de la Montagne Nord",
+                              "King St East", "", None, "Côte-Sud Road", "Avenue du Parc Ouest"]),
+        "l_placenam": choice(["Moncton", "Dieppe", "Fredericton", None]),
+        "r_placenam": choice(["Moncton", "Dieppe", "Fredericton", None]),
+        "l_hnumf": choice(["12", "14A", "3-B", None, "100 1/2"]),
+        "r_hnumf": choice(["11", "15", None]),
+        "l_hnuml": choice(["20", "22B"]),
+        "r_hnuml": choice(["21", None]),
+        "l_hnumstr": choice(["Even", "odd", "Mixed", None]),
+        "r_hnumstr": choice(["Even", "ODD"]),
+        "roadclass": choice(["Local / Street", "Arterial", "Freeway"]),
+        "closing": "", "exitnbr": None, "nbrlanes": 2, "pavsurf": "Rigid", "pavstatus": "Paved",
+        "roadsegid": np.arange(count), "rtename1en": None, "rtename2en": None, "rtename1fr": None, "rtename2fr": None,
+        "rtnumber1": None, "rtnumber2": None, "speed": 50, "strunameen": None, "strunamefr": None,
+        "structtype": "None", "trafficdir": choice(["Both directions", "Same direction", "Opposite direction"]),
+        "unpavsurf": None,
+        "uuid": ["{:032x}".format(index) for index in range(count)]
+    }, geometry=[shapely.LineString([(index, 0), (index + 1, 1)]) for index in range(count)], crs="EPSG:4617")
+
+
+def map_fields(stage, source_gdf):
+    """Applies the field mapping and domains of a stage to a source dataframe, returning the target dataframes."""
+
+    stage.source_gdframes = {name: source_gdf.copy() for name in stage.source_attributes}
+    stage.compile_field_mapping()
+    stage.gen_target_dataframes()
+    stage.apply_field_mapping()
+    stage.apply_domains()
+
+    return stage.target_gdframes
+
+
+def test_field_mapping_plan_binds_frozen_parameters(stage):
+    stage = stage()
+    stage.source_gdframes = {name: road_route(3) for name in stage.source_attributes}
+    stage.compile_field_mapping()
+    addrange = next(iter(stage.field_mapping.values()))["addrange"]
+
+    # Unmapped fields, raw values and function chains, with copy_attribute_functions expanded in place.
+    assert addrange["l_hnumtypf"] is None
+    assert addrange["datasetnam"] == {"raw": "New Brunswick"}
+    assert addrange["l_hnumsuff"]["fields"] == ["l_hnumf"]
+    assert [func for func, _ in addrange["l_hnumsuff"]["functions"]] == ["regex_sub", "regex_find"]
+    assert addrange["l_hnumsuff"]["functions"][1][1].keywords["strip_result"] is True
+    assert "strip_result" not in addrange["l_hnumf"]["functions"][1][1].keywords
+
+
+@pytest.mark.parametrize("functions", [{"missing_function": None}, {"regex_find": {"pattern": "a", "index": 0}}])
+def test_compile_functions_rejects_invalid_functions(stage, functions):
+    stage = stage()
+
+    with pytest.raises(SystemExit):
+        stage.compile_functions(dict(), functions, "addrange", "l_hnumf")
+
+
+def test_field_mapping_applies_function_chains(stage):
+    source_gdf = road_route(5).assign(l_hnumf=["12", "14A", "3-B", None, "100 1/2"])
+
+    addrange = map_fields(stage(), source_gdf)["addrange"]
+
+    assert addrange["l_hnumf"].tolist()[:3] + addrange["l_hnumf"].tolist()[4:] == ["12", "14", "3", "100"]
+    assert addrange["l_hnumsuff"].tolist()[1:3] + addrange["l_hnumsuff"].tolist()[4:] == ["A", "B", "1 2"]
+    assert addrange[["l_hnumf", "l_hnumsuff"]].iloc[3].isna().all()
+
+
+def test_apply_domains_matches_keys_and_values_case_insensitively(stage):
+    source_gdf = road_route(6).assign(trafficdir=["2", "same DIRECTION", "Même direction", "both directions",
+                                                  "Unknown direction", None])
+
+    roadseg = map_fields(stage(), source_gdf)["roadseg"]
+
+    # Domain keys and en/fr values resolve to the en value, other values to null.
+    assert roadseg["trafficdir"].tolist()[:4] == ["Same direction"] * 3 + ["Both directions"]
+    assert roadseg["trafficdir"].iloc[4:].isna().all()
+
+
+def test_field_mapping_aligns_target_records_by_uuid(stage):
+    stage = stage()
+    source_gdf = road_route(20)
+    stage.source_gdframes = {name: source_gdf.copy() for name in stage.source_attributes}
+    stage.compile_field_mapping()
+    stage.gen_target_dataframes()
+
+    # Target records in a different order and subset than the source records.
+    roadseg = stage.target_gdframes["roadseg"]
+    stage.target_gdframes["roadseg"] = roadseg.iloc[::-3]
+    stage.apply_field_mapping()
+
+    roadseg = stage.target_gdframes["roadseg"]
+    source = source_gdf.set_index("uuid").loc[roadseg["uuid"]]
+    assert roadseg["roadsegid"].astype(int).tolist() == source["roadsegid"].tolist()
+    assert roadseg["l_hnumf"].fillna("").tolist() == [value.split(" ")[0].rstrip("AB-") if value else ""
+                                                      for value in source["l_hnumf"]]
+
+
+def test_unreadable_config_cache_is_recompiled_and_rewritten(stage, tmp_path):
+    target_attributes = stage().target_attributes
+    cache_path = tmp_path / "cache" / "target_attributes.pickle"
+    cache_path.write_bytes(b"chelpers\nmissing_function\n.")
+
+    assert stage().target_attributes == target_attributes
+    assert helpers.load_config_cache("target_attributes", [os.path.abspath("../distribution_format.yaml"),
+                                                           stage_1.__file__]) == target_attributes
+
+
+@pytest.fixture
+def raw_stage(stage, tmp_path):
+    """Returns a factory of stage 1 instances of both nb sources, reading raw shapefiles from a temporary directory."""
+
+    raw_path = tmp_path / "raw" / "geonb_nbrn-rrnb_shp"
+    raw_path.mkdir(parents=True)
+    road_route(50).drop(columns="uuid").to_file(str(raw_path / "geonb_nbrn-rrnb_road-route.shp"))
+    gpd.GeoDataFrame({"closing": ["No"] * 2, "fersegid": [1, 2], "roadclass": ["Ferry"] * 2},
+                     geometry=[shapely.LineString([(0, 0), (1, 1)])] * 2, crs="EPSG:4617").to_file(
+        str(raw_path / "geonb_nbrn-rrnb_ferry-traversier.shp"))
+
+    def make_stage(interim_format="gpkg", **kwargs):
+        stage = stage_1.Stage("nb", interim_format=interim_format, **kwargs)
+        stage.data_path = str(tmp_path / "raw")
+        stage.output_path = str(tmp_path / ("nb.gpkg" if interim_format == "gpkg" else "nb"))
+        stage.fingerprints_path = str(tmp_path / "nb_fingerprints.json")
+
+        return stage
+
+    return make_stage
+
+
+def test_chunked_execution_matches_single_pass(raw_stage, tmp_path):
+    raw_stage(deterministic=True).execute()
+    single = {table: helpers.load_interim(str(tmp_path / "nb.gpkg"), table) for table in
+              helpers.interim_tables(str(tmp_path / "nb.gpkg"))}
+    os.remove(str(tmp_path / "nb.gpkg"))
+
+    raw_stage(deterministic=True, chunk_size=15).execute()
+
+    # Chunks append their records, strplaname names first exported by a previous chunk are not exported again. The
+    # first record of a name, and therefore its uuid, depends on the order of the records split within each chunk.
+    for table, df in single.items():
+        chunked = helpers.load_interim(str(tmp_path / "nb.gpkg"), table)
+        if table == "strplaname":
+            df, chunked = df.drop(columns="uuid"), chunked.drop(columns="uuid")
+        fields = [field for field in df.columns if field != "geometry"]
+        pd.testing.assert_frame_equal(chunked.sort_values(fields).reset_index(drop=True),
+                                      df.sort_values(fields).reset_index(drop=True))
+
+
+@pytest.mark.skipif(helpers.pq is None, reason="pyarrow is required for GeoParquet interim data.")
+@pytest.mark.parametrize("chunk_size", [None, 15])
+def test_parquet_execution_matches_gpkg(raw_stage, tmp_path, chunk_size):
+    raw_stage(deterministic=True, chunk_size=chunk_size).execute()
+    raw_stage(deterministic=True, chunk_size=chunk_size, interim_format="parquet").execute()
+
+    # Categorical domain and dtype fields, including nulls, are exported as plain values.
+    assert sorted(helpers.interim_tables(str(tmp_path / "nb"))) == sorted(helpers.interim_tables(str(tmp_path /
+                                                                                                    "nb.gpkg")))
+    for table in helpers.interim_tables(str(tmp_path / "nb.gpkg")):
+        gpkg = helpers.load_interim(str(tmp_path / "nb.gpkg"), table)
+        parquet = helpers.load_interim(str(tmp_path / "nb"), table)
+        pd.testing.assert_frame_equal(parquet[gpkg.columns], gpkg, check_dtype=False)
+
+
+@pytest.mark.parametrize("chunk_size", [None, 20])
+def test_target_table_workers_match_serial(raw_stage, tmp_path, chunk_size):
+    raw_stage(deterministic=True, chunk_size=chunk_size).execute()
+    serial = {table: helpers.load_interim(str(tmp_path / "nb.gpkg"), table) for table in
+              helpers.interim_tables(str(tmp_path / "nb.gpkg"))}
+    os.remove(str(tmp_path / "nb.gpkg"))
+
+    # Workers load their own source rows, keyed by the uuid positions of the stage.
+    raw_stage(deterministic=True, chunk_size=chunk_size, workers=2).execute()
+    assert os.path.exists(str(tmp_path / "nb_roadseg.log"))
+
+    for table, df in serial.items():
+        pd.testing.assert_frame_equal(helpers.load_interim(str(tmp_path / "nb.gpkg"), table), df)
+
+
+def test_execute_writes_run_profile(raw_stage, tmp_path):
+    raw_stage(cprofile=True).execute()
+
+    with open(str(tmp_path / "nb_profile.json"), encoding="utf8") as f:
+        records = json.load(f)
+
+    # Steps, tables, fields and functions, with the rows processed.
+    steps = {record["step"]: record for record in records if record["table"] is None}
+    assert {"execute", "gen_source_dataframes", "apply_target_mapping", "export_interim"} <= set(steps)
+    assert steps["gen_source_dataframes"]["rows"] == 52
+    assert any(record["table"] == "addrange" and record["field"] == "l_hnumf" and record["function"] == "regex_find"
+               for record in records)
+    assert all(record["seconds"] >= 0 for record in records)
+    assert pd.read_csv(str(tmp_path / "nb_profile.csv"))["step"].tolist() == [record["step"] for record in records]
+    assert os.path.getsize(str(tmp_path / "nb.prof"))
+
+
+def test_factorized_field_mapping_matches_direct(stage):
+    source_gdf = road_route(300)
+
+    factorized = map_fields(stage(factorize=True), source_gdf)
+    direct = map_fields(stage(factorize=False), source_gdf)
+
+    assert factorized.keys() == direct.keys()
+    for table in factorized:
+        pd.testing.assert_frame_equal(factorized[table], direct[table])
+
+
+def test_apply_functions_memoizes_chain_prefixes(stage):
+    stage = stage()
+    stage.function_results = dict()
+    calls = list()
+
+    def append(series, suffix):
+        calls.append(suffix)
+        return series + suffix
+
+    functions = [("append", partial(append, suffix="a")), ("append", partial(append, suffix="b"))]
+    series = pd.Series(["x", "y"])
+
+    direct = stage.apply_functions(series, functions)
+    first = stage.apply_functions(series, functions, cache_key=("source", "field"))
+    second = stage.apply_functions(series, functions[:1], cache_key=("source", "field"))
+
+    pd.testing.assert_series_equal(first, direct)
+    pd.testing.assert_series_equal(second, series + "a")
+    assert calls == ["a", "b", "a", "b"]
+
+
+def test_incremental_unchanged_runs_skip_all_work(raw_stage, monkeypatch, caplog):
+    raw_stage(incremental=True).execute()
+    assert set(helpers.interim_tables(raw_stage().output_path)) >= {"addrange", "ferryseg", "roadseg", "strplaname"}
+
+    def fail(self):
+        raise AssertionError("Unchanged inputs were reloaded.")
+
+    monkeypatch.setattr(stage_1.Stage, "gen_source_dataframes", fail)
+    for _ in range(2):
+        caplog.clear()
+        raw_stage(incremental=True).execute()
+        assert "No target table inputs changed, output is up to date." in caplog.text
+
+
+def test_apply_dtypes_compacts_fields(stage, caplog):
+    source_gdf = road_route(4).assign(speed=["50", "100000", "x", None], rtename1en=["Route 1", "A" * 150, None, ""])
+    stage = stage()
+    map_fields(stage, source_gdf)
+    stage.apply_dtypes()
+    roadseg = stage.target_gdframes["roadseg"]
+
+    # Integers of the smallest nullable dtype holding the field width, invalid or out of range values set to null.
+    assert str(roadseg["speed"].dtype) == "Int16"
+    assert roadseg["speed"].tolist()[0] == 50 and roadseg["speed"].iloc[1:].isna().all()
+    assert "Target field \"speed\": 2 invalid or out of range integer(s) set to null." in caplog.text
+
+    # Domain fields as categoricals of the domain values, strings truncated to the field width.
+    assert isinstance(roadseg["trafficdir"].dtype, pd.CategoricalDtype)
+    assert "Same direction" in roadseg["trafficdir"].cat.categories
+    width = stage.target_attributes["roadseg"]["widths"]["rtename1en"]
+    assert roadseg["rtename1en"].astype(object).tolist()[:2] == ["Route 1", "A" * width]
+
+
+def test_apply_domains_keeps_and_validates_dates(stage, caplog):
+    source_gdf = road_route(6)
+    stage = stage()
+    for source_yaml in stage.source_attributes.values():
+        source_yaml["conform"]["roadseg"].update({"credate": "credate", "revdate": "revdate"})
+    source_gdf["credate"] = ["2019", "201905", "20190517", "2006", "2019-05", None]
+    source_gdf["revdate"] = ["2020", "202001", "20200230", "200606", "20210101", "2020"]
+
+    roadseg = map_fields(stage, source_gdf)["roadseg"]
+
+    # Partial dates are left unpadded.
+    assert roadseg["credate"].tolist()[:5] == ["2019", "201905", "20190517", "2006", "2019-05"]
+    assert pd.isna(roadseg["credate"].iloc[5])
+    assert roadseg["revdate"].tolist() == ["2020", "202001", "20200230", "200606", "20210101", "2020"]
+    assert "Target table roadseg: 1 record(s) with invalid credate." in caplog.text
+    assert "Target table roadseg: 1 record(s) with invalid revdate." in caplog.text
+
+
+def test_incremental_changes_propagate_to_linked_tables(raw_stage, tmp_path, caplog):
+    raw_stage(incremental=True, deterministic=True).execute()
+
+    # Changed source: only its tables are recomputed.
+    gpd.GeoDataFrame({"closing": ["No"], "fersegid": [3], "roadclass": ["Ferry"]},
+                     geometry=[shapely.LineString([(0, 0), (2, 2)])], crs="EPSG:4617").to_file(
+        str(tmp_path / "raw" / "geonb_nbrn-rrnb_shp" / "geonb_nbrn-rrnb_ferry-traversier.shp"))
+    caplog.clear()
+    raw_stage(incremental=True, deterministic=True).execute()
+    assert "Changed target tables: ferryseg." in caplog.text
+
+    # Missing strplaname layer: strplaname is recomputed with the tables referencing its nids.
+    with sqlite3.connect(str(tmp_path / "nb.gpkg")) as con:
+        helpers.gpkg_drop_layer(con, "strplaname")
+    caplog.clear()
+    raw_stage(incremental=True, deterministic=True).execute()
+    assert "Changed target tables: addrange, strplaname." in caplog.text
+    assert "strplaname" in helpers.interim_tables(str(tmp_path / "nb.gpkg"))
+
+
+def name_key(record):
+    """Returns the strplaname name of a record as a tuple, with nulls compared equal."""
+
+    return tuple(None if pd.isna(record[field]) else record[field] for field in stage_1.strplaname_fields)
+
+
+def test_dedup_strplaname_matches_reference(stage):
+    stage = stage(deterministic=True)
+    target_gdframes = map_fields(stage, road_route(200))
+    strplaname, addrange = target_gdframes["strplaname"].copy(), target_gdframes["addrange"].copy()
+
+    stage.dedup_strplaname()
+    result = stage.target_gdframes["strplaname"]
+
+    # One record per unique name, keeping the first record.
+    firsts = dict()
+    for index, record in strplaname.iterrows():
+        firsts.setdefault(name_key(record), index)
+    assert list(result.index) == list(firsts.values())
+    assert result["nid"].is_unique and result["nid"].str.fullmatch("[0-9a-f]{32}").all()
+
+    # References to the first (left) and last (right) name of each source record.
+    nids = {name_key(record): nid for (_, record), nid in zip(result.iterrows(), result["nid"])}
+    names = dict()
+    for _, record in strplaname.iterrows():
+        names.setdefault(record["uuid"], list()).append(nids[name_key(record)])
+    for (index, record), (_, filled) in zip(addrange.iterrows(), stage.target_gdframes["addrange"].iterrows()):
+        for field, position in (("l_offnanid", 0), ("r_offnanid", -1)):
+            expected = names[record["uuid"]][position] if pd.isna(record[field]) else record[field]
+            assert filled[field] == expected, (index, field)
+
+
+def test_dedup_strplaname_across_chunks(stage):
+    stage = stage(deterministic=True)
+    source_gdf = road_route(60)
+
+    map_fields(stage, source_gdf.iloc[:30])
+    stage.dedup_strplaname()
+    first_chunk = stage.target_gdframes["strplaname"]
+    map_fields(stage, source_gdf)
+    stage.dedup_strplaname()
+    second_chunk = stage.target_gdframes["strplaname"]
+
+    # Names exported by the first chunk are not exported again, and keep their nid.
+    assert not set(first_chunk["nid"]) & set(second_chunk["nid"])
+    assert len(stage.strplaname_nids) == len(first_chunk) + len(second_chunk)
+    assert set(stage.target_gdframes["addrange"]["l_offnanid"]) <= set(first_chunk["nid"]) | set(second_chunk["nid"])
@@ -0,0 +1,36 @@
+import geopandas as gpd
+import os
+import pytest
+import shapely
+
+import helpers
+import stage_2
+
+
+@pytest.fixture
+def interim(tmp_path, monkeypatch):
+    """Runs from the stage directory, with interim storage in a temporary directory."""
+
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(stage_2.__file__)))
+    monkeypatch.setattr(helpers, "interim_data_path", str(tmp_path))
+
+    return tmp_path
+
+
+def test_junction_types(interim):
+    roadseg = [shapely.LineString(coords) for coords in ([(0, 0), (1, 0)], [(1, 0), (2, 0)], [(2, 0), (2, 1)],
+                                                         [(2, 0), (3, 0)], [(3, 0), (3, 1), (2, 1)])]
+    ferryseg = [shapely.LineString([(3, 0), (4, 0)])]
+    helpers.export_interim({
+        "roadseg": gpd.GeoDataFrame({"nid": ["a"] * 5, "exitnbr": "None"}, geometry=roadseg, crs="EPSG:4617"),
+        "ferryseg": gpd.GeoDataFrame({"nid": ["b"]}, geometry=ferryseg, crs="EPSG:4617")
+    }, str(interim / "nb.gpkg"))
+
+    stage_2.Stage("nb").execute()
+    junction = helpers.load_interim(str(interim / "nb.gpkg"), "junction")
+
+    # Dead ends meet a single segment, intersections three or more, and ferry junctions any ferry segment. Endpoints
+    # meeting two road segments are not junctions.
+    assert dict(zip(map(tuple, shapely.get_coordinates(junction.geometry.values)), junction["junctype"])) == \
+           {(0, 0): "Dead End", (2, 0): "Intersection", (3, 0): "Ferry", (4, 0): "Ferry"}
+    assert junction["nid"].str.len().eq(32).all() and junction["nid"].is_unique
@@ -0,0 +1,101 @@
+import geopandas as gpd
+import numpy as np
+import os
+import pytest
+import shapely
+
+import helpers
+import stage_3
+
+
+@pytest.fixture
+def interim(tmp_path, monkeypatch):
+    """Runs from the stage directory, with interim storage in a temporary directory."""
+
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(stage_3.__file__)))
+    monkeypatch.setattr(helpers, "interim_data_path", str(tmp_path))
+
+    return tmp_path
+
+
+def roadseg(nids, roadclass):
+    geoms = [shapely.LineString([(index, 0), (index + 1, 0)]) for index in range(len(nids))]
+
+    return gpd.GeoDataFrame({"nid": nids, "roadclass": roadclass}, geometry=geoms, crs="EPSG:4617")
+
+
+def test_match_layers():
+    layers = ["NRN_NB_14_0_ROADSEG", "NRN_NB_14_0_FERRYSEG", "nrn_nb_14_0_addrange", "junction", "NRN_NB_14_0_OTHER"]
+
+    assert stage_3.match_layers(layers, ["roadseg", "ferryseg", "addrange", "junction", "strplaname"]) == {
+        "roadseg": "NRN_NB_14_0_ROADSEG", "ferryseg": "NRN_NB_14_0_FERRYSEG", "addrange": "nrn_nb_14_0_addrange",
+        "junction": "junction"}
+
+    with pytest.raises(SystemExit):
+        stage_3.match_layers(["NRN_NB_14_0_ROADSEG", "NRN_NB_15_0_ROADSEG"], ["roadseg"])
+
+
+def test_previous_release_layers_conserve_nids(interim):
+    helpers.export_interim({"roadseg": roadseg(["c1", "c2", "c3"], ["Local / Street", "Arterial", "Freeway"])},
+                           str(interim / "nb.gpkg"))
+    helpers.export_interim({"NRN_NB_14_0_ROADSEG": roadseg(["p1", "p2"], ["Local / Street", "Local / Street"])},
+                           str(interim / "previous.gpkg"))
+
+    stage_3.Stage("nb", previous=str(interim / "previous.gpkg")).execute()
+
+    assert list(helpers.load_interim(str(interim / "nb.gpkg"), "roadseg")["nid"][:2]) == ["p1", "p2"]
+    changes = helpers.load_interim(str(interim / "nb.gpkg"), "changes").set_index("nid")["effect"]
+    assert changes[["p1", "p2"]].tolist() == ["Confirmation", "Descriptive Modification"]
+    assert (changes == "Addition").sum() == 1
+
+
+def test_previous_release_missing_layer(interim):
+    helpers.export_interim({"roadseg": roadseg(["c1"], ["Arterial"])}, str(interim / "nb.gpkg"))
+    helpers.export_interim({"NRN_NB_14_0_FERRYSEG": roadseg(["p1"], ["Ferry"])}, str(interim / "previous.gpkg"))
+
+    with pytest.raises(SystemExit):
+        stage_3.Stage("nb", previous=str(interim / "previous.gpkg")).execute()
+
+    stage_3.Stage("nb", previous=str(interim / "previous.gpkg"), new_tables=["roadseg"]).execute()
+    changes = helpers.load_interim(str(interim / "nb.gpkg"), "changes")
+    assert sorted(zip(changes["table"], changes["effect"])) == [("ferryseg", "Retirement"), ("roadseg", "Addition")]
+
+
+def test_null_nids_are_assigned_per_group(interim):
+    helpers.export_interim({"roadseg": roadseg([None, None, None, "s", "s"], ["Local / Street"] * 5)},
+                           str(interim / "nb.gpkg"))
+    helpers.export_interim({"NRN_NB_14_0_ROADSEG": roadseg(["p1", "p2"], ["Local / Street"] * 2)},
+                           str(interim / "previous.gpkg"))
+
+    stage_3.Stage("nb", previous=str(interim / "previous.gpkg")).execute()
+
+    nids = helpers.load_interim(str(interim / "nb.gpkg"), "roadseg")["nid"].tolist()
+    assert nids[:2] == ["p1", "p2"]
+    assert nids[3] == nids[4] and len({nids[2], nids[3], "p1", "p2"}) == 4
+    changes = helpers.load_interim(str(interim / "nb.gpkg"), "changes").set_index("nid")["effect"]
+    assert changes.to_dict() == {"p1": "Confirmation", "p2": "Confirmation", nids[2]: "Addition", nids[3]: "Addition"}
+
+
+def test_unmatched_records_take_the_conserved_nid_of_their_group(interim):
+    helpers.export_interim({"roadseg": roadseg(["c", "c", None], ["Local / Street"] * 3)}, str(interim / "nb.gpkg"))
+    helpers.export_interim({"NRN_NB_14_0_ROADSEG": roadseg(["p1"], ["Local / Street"])}, str(interim / "previous.gpkg"))
+
+    stage_3.Stage("nb", previous=str(interim / "previous.gpkg")).execute()
+
+    nids = helpers.load_interim(str(interim / "nb.gpkg"), "roadseg")["nid"].tolist()
+    assert nids[:2] == ["p1", "p1"] and nids[2] != "p1"
+    changes = helpers.load_interim(str(interim / "nb.gpkg"), "changes").set_index("nid")["effect"]
+    assert changes.to_dict() == {"p1": "Geometric Modification", nids[2]: "Addition"}
+
+
+def test_match_locations_requires_both_endpoints_within_tolerance(interim):
+    helpers.export_interim({"roadseg": roadseg(["c1"], ["Arterial"])}, str(interim / "nb.gpkg"))
+    stage = stage_3.Stage("nb", previous=str(interim / "nb.gpkg"), tolerance=1e-3)
+    current = gpd.GeoDataFrame(geometry=[shapely.LineString([(0, 0), (1, 0)]), shapely.LineString([(5, 0), (6, 0)])])
+    previous = gpd.GeoDataFrame(geometry=[shapely.LineString([(0, 0), (1, 1.5e-3)]),
+                                          shapely.LineString([(6, 5e-4), (5, 5e-4)])])
+
+    # The first endpoint of the first record matches exactly, but its last endpoint exceeds the tolerance. The second
+    # record matches reversed.
+    matched_current, matched_previous = stage.match_locations(current, previous, np.full(2, -1), linear=True)
+    assert matched_current.tolist() == [1] and matched_previous.tolist() == [1]
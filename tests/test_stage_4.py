@@ -0,0 +1,75 @@
+import geopandas as gpd
+import os
+import pandas as pd
+import pytest
+import shapely
+
+import helpers
+import stage_4
+
+
+@pytest.fixture
+def interim(tmp_path, monkeypatch):
+    """Runs from the stage directory, with interim storage in a temporary directory."""
+
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(stage_4.__file__)))
+    monkeypatch.setattr(helpers, "interim_data_path", str(tmp_path))
+
+    return tmp_path
+
+
+@pytest.mark.parametrize("tile_size", [None, 0.5])
+def test_geometry_and_topology_validation(interim, tile_size):
+    roadseg = gpd.GeoDataFrame({"uuid": ["u{}".format(index) for index in range(8)],
+                                "nid": ["n{}".format(index) for index in range(8)]}, geometry=[
+        shapely.LineString([(0, 0), (1, 0)]),
+        shapely.LineString([(1, 0), (0, 0)]),
+        shapely.LineString([(0, 0), (2, 0)]),
+        shapely.LineString([(0, 1), (1, 2), (1, 1), (0, 2)]),
+        shapely.LineString([(5, 5), (5, 5)]),
+        shapely.LineString([(3, 3), (4, 3), (4, 4), (3, 3)]),
+        shapely.LineString([(10, 0), (11, 0)]),
+        shapely.LineString([(11, 5e-6), (12, 1)])], crs="EPSG:4617")
+    helpers.export_interim({"roadseg": roadseg}, str(interim / "nb.gpkg"))
+
+    stage_4.Stage("nb", tile_size=tile_size, workers=2).execute()
+
+    # Duplicates in either direction, overlaps other than duplicates, self intersections, zero length segments,
+    # unconnected endpoints near another segment and closed loops, in flag order.
+    validation = helpers.load_interim(str(interim / "nb.gpkg"), "validation")
+    assert list(zip(validation["uuid"], validation["flag"], validation["related"].fillna(""))) == [
+        ("u0", "duplicate", "u1"), ("u1", "duplicate", "u0"), ("u0", "overlap", "u2"), ("u1", "overlap", "u2"),
+        ("u2", "overlap", "u0"), ("u2", "overlap", "u1"), ("u3", "self_intersection", ""), ("u4", "zero_length", ""),
+        ("u6", "dangle", "u7"), ("u7", "dangle", "u6"), ("u5", "closed_loop", "")]
+    assert validation.geometry.equals(gpd.GeoSeries(roadseg.geometry[[0, 1, 0, 1, 2, 2, 3, 4, 6, 7, 5]].values,
+                                                    crs=roadseg.crs))
+
+
+@pytest.mark.parametrize("name", ["nb.gpkg", pytest.param("nb", marks=pytest.mark.skipif(
+    helpers.pq is None, reason="pyarrow is required for GeoParquet interim data."))])
+def test_addrange_validation_and_summary(interim, name):
+    roadseg = gpd.GeoDataFrame({"uuid": ["u1", "u2"], "nid": ["s1", "s2"]},
+                               geometry=[shapely.LineString([(0, 0), (1, 0)]), shapely.LineString([(1, 0), (2, 0)])],
+                               crs="EPSG:4617")
+    addrange = pd.DataFrame({
+        "nid": ["a", "b", "c", "d"], "datasetnam": ["New Brunswick"] * 2 + ["Nova Scotia"] * 2,
+        "l_hnumf": [2, 3, 10, 0], "l_hnuml": [20, 9, 4, 0], "l_hnumstr": ["Even", "Even", "Even", "None"],
+        "l_digdirfg": ["Same Direction", "Same Direction", "Same Direction", "Not Applicable"],
+        "l_offnanid": ["k1", "k2", "k1", None],
+        "r_hnumf": [1, 5, 0, 1], "r_hnuml": [19, 7, 0, 5], "r_hnumstr": ["Odd", "Odd", "None", "Odd"],
+        "r_digdirfg": ["Same Direction", "Opposite Direction", "Not Applicable", "Same Direction"],
+        "r_offnanid": ["k1", "k2", None, "k3"]
+    })
+    helpers.export_interim({"roadseg": roadseg, "addrange": addrange}, str(interim / name))
+
+    stage_4.Stage("nb").execute()
+
+    validation = helpers.load_interim(str(interim / name), "addrange_validation")
+    assert list(zip(validation["nid"], validation["flag"], validation["related"].fillna(""))) == [
+        ("b", "l_parity", ""), ("c", "l_order", ""), ("b", "r_order", ""), ("a", "l_overlap", "c"),
+        ("c", "l_overlap", "a")]
+
+    summary = helpers.load_interim(str(interim / name), "addrange_summary").set_index("datasetnam")
+    assert summary.loc["New Brunswick", ["records", "l_parity", "r_order", "l_overlap", "flagged"]].tolist() == \
+           [2, 1, 1, 1, 2]
+    assert summary.loc["Nova Scotia", ["records", "l_order", "l_overlap", "flagged"]].tolist() == [2, 1, 1, 1]